@@ -3,3 +3,12 @@ from .EventManager import EventManager
 class BaseApplication:
     def get_event_manager(self) -> EventManager:
         return None
+
+    def get_clock(self):
+        return None
+
+    def get_systems(self) -> list:
+        return []
+
+    def get_memory_stats(self) -> dict:
+        return {}
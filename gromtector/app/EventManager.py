@@ -5,6 +5,8 @@ from collections import defaultdict
 from collections import defaultdict
 import queue
 
+from gromtector import tracing
+
 
 class EventManager:
     def __init__(self):
@@ -24,14 +26,24 @@ class EventManager:
         self.event_queue.put((event_type, event))
 
     def dispatch_event(self, event_type, event) -> None:
+        tracer = tracing.get_tracer()
+        if tracer is None:
+            for listener in self.listeners[event_type]:
+                listener(event_type, event)
+            return
         for listener in self.listeners[event_type]:
-            listener(event_type, event)
+            name = getattr(listener, "__qualname__", None) or repr(listener)
+            with tracer.span(event_type, "event", {"listener": name}):
+                listener(event_type, event)
 
     def dispatch_queued_events(self) -> None:
         while not self.event_queue.empty():
             event_type, event = self.event_queue.get()
             self.dispatch_event(event_type=event_type, event=event)
 
+    def get_memory_stats(self) -> dict:
+        return {"event_queue_len": self.event_queue.qsize()}
+
     def shutdown(self) -> None:
         self.listeners.clear()
 
@@ -1,12 +1,18 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Sequence
+from gromtector import tracing
 from gromtector.app.systems.BaseSystem import BaseSystem
 import logging
 import queue
+import time
+import numpy as np
 import pygame as pg
 
 from .BaseApplication import BaseApplication
+from .clock import VirtualClock, WallClock
 from .EventManager import EventManager
+from .system_runner import SystemRunner
 from .Window import Window
 
 
@@ -35,26 +41,87 @@ class Application(BaseApplication):
 
         self.event_manager = EventManager()
 
+        # Replays run on the input's stream time instead of real time, and end once
+        # the whole input has been through inference.
+        self.replay = bool(self.args.get("--replay"))
+        self.time_source = VirtualClock() if self.replay else WallClock()
+        if self.replay:
+            self.event_manager.add_listener("inference_ended", self.handle_replay_ended)
+
         self.systems = []
         self.system_classes: Sequence[BaseSystem] = system_classes
+        self.system_runners: Sequence[SystemRunner] = []
+        self.system_executor: ThreadPoolExecutor = None
+        self.system_stats_interval_s: float = 10.0
+        self.system_stats_time: float = None
+        self.frame_times_ms = []
 
     def init_systems(self):
         for cls in self.system_classes:
             new_sys = cls(self, config=self.args)
             new_sys.init()
             self.systems.append(new_sys)
+            self.system_runners.append(SystemRunner(new_sys))
+        self.system_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="system"
+        )
 
     def start_systems(self):
         for sys in self.systems:
             sys.run()
 
     def shutdown_systems(self):
+        for runner in self.system_runners:
+            runner.wait()
+        self.system_executor.shutdown()
         for sys in self.systems:
             sys.shutdown()
 
     def update_systems(self, elapsed_time_ms: int):
+        now = time.monotonic()
+        for runner in self.system_runners:
+            runner.update(now, self.system_executor)
+        self.report_system_stats(now)
+
+    def draw_systems(self):
         for sys in self.systems:
-            sys.update(elapsed_time_ms)
+            sys.draw()
+
+    def report_system_stats(self, now: float) -> None:
+        if self.system_stats_time is None:
+            self.system_stats_time = now
+            return
+        interval_s = now - self.system_stats_time
+        if interval_s < self.system_stats_interval_s:
+            return
+        self.system_stats_time = now
+
+        stats = [runner.get_stats(interval_s) for runner in self.system_runners]
+        for runner in self.system_runners:
+            runner.reset_stats()
+        if self.frame_times_ms:
+            frame_times_ms = np.array(self.frame_times_ms)
+            self.frame_times_ms = []
+            logger.info(
+                "Frame time avg %.1fms, p99 %.1fms, max %.1fms.",
+                frame_times_ms.mean(),
+                np.percentile(frame_times_ms, 99),
+                frame_times_ms.max(),
+            )
+        logger.info(
+            "System updates: %s",
+            ", ".join(
+                "{} {:.1f}Hz {:.1f}/{:.1f}ms{}".format(
+                    st["name"],
+                    st["rate_hz"],
+                    st["avg_ms"],
+                    st["max_ms"],
+                    " ({} skipped)".format(st["skipped"]) if st["skipped"] else "",
+                )
+                for st in stats
+            ),
+        )
+        self.event_manager.queue_event("system_stats", stats)
 
     def update(self, elapsed_time_ms: int):
         self.event_manager.queue_event("new_app_fps", self.clock.get_fps())
@@ -79,11 +146,29 @@ class Application(BaseApplication):
             self.update(elapsed_time_ms)
             self.update_systems(elapsed_time_ms)
             self.event_manager.dispatch_queued_events()
+            self.draw_systems()
             elapsed_time_ms = self.clock.tick(self.max_fps)
+            self.frame_times_ms.append(elapsed_time_ms)
 
-            pg.display.flip()
+            with tracing.span("pg.display.flip", "render"):
+                pg.display.flip()
 
         self.shutdown_systems()
 
+    def handle_replay_ended(self, event_type, event) -> None:
+        logger.info("Replay finished.")
+        self.running = False
+
     def get_event_manager(self) -> EventManager:
         return self.event_manager
+
+    def get_clock(self):
+        return self.time_source
+
+    def get_systems(self) -> Sequence[BaseSystem]:
+        return self.systems
+
+    def get_memory_stats(self) -> dict:
+        stats = self.event_manager.get_memory_stats()
+        stats["frame_times_len"] = len(self.frame_times_ms)
+        return stats
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+
+
+class WallClock:
+    """
+    Real time, what the app runs on when processing live audio.
+    """
+
+    is_virtual: bool = False
+
+    def now(self) -> datetime:
+        return datetime.now(tz=timezone.utc)
+
+
+class VirtualClock:
+    """
+    Stream time of a replayed input: it only moves when the input is advanced, so a
+    replay produces the same timestamps however fast it runs.
+    """
+
+    is_virtual: bool = True
+
+    def __init__(self, begin: datetime = None):
+        self.current = begin if begin else datetime.fromtimestamp(0, tz=timezone.utc)
+
+    def now(self) -> datetime:
+        return self.current
+
+    def advance_to(self, timestamp: datetime) -> None:
+        if timestamp > self.current:
+            self.current = timestamp
@@ -0,0 +1,88 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import time
+
+from gromtector import tracing
+from gromtector.app.systems.BaseSystem import BaseSystem
+
+logger = logging.getLogger(__name__)
+
+
+class SystemRunner:
+    """
+    Schedules the `update()` of one system at its `update_rate_hz` and keeps its
+    timings. Systems that aren't `main_thread` bound are updated on the app's
+    worker pool; an update still running when the next one is due is skipped
+    rather than queued, so a slow system only slows itself down.
+    """
+
+    def __init__(self, system: BaseSystem):
+        self.system = system
+        self.name = system.__class__.__name__
+        self.span_name = "{}.update".format(self.name)
+        self.interval_s = (
+            1.0 / system.update_rate_hz if system.update_rate_hz else 0.0
+        )
+        self.next_update_time = 0.0
+        self.last_update_time: float = None
+        self.future: Future = None
+
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.num_updates = 0
+        self.num_skipped = 0
+        self.total_update_s = 0.0
+        self.max_update_s = 0.0
+
+    def update(self, now: float, executor: ThreadPoolExecutor) -> None:
+        if now < self.next_update_time:
+            return
+        # Keep to the rate on average without bursting after a stall.
+        self.next_update_time = max(self.next_update_time + self.interval_s, now)
+        if self.future is not None and not self.future.done():
+            self.num_skipped += 1
+            return
+
+        elapsed_time_ms = (
+            int((now - self.last_update_time) * 1000)
+            if self.last_update_time is not None
+            else 0
+        )
+        self.last_update_time = now
+        if self.system.main_thread:
+            self.run_update(elapsed_time_ms)
+        else:
+            self.future = executor.submit(self.run_update, elapsed_time_ms)
+
+    def run_update(self, elapsed_time_ms: int) -> None:
+        start = time.perf_counter()
+        try:
+            with tracing.span(self.span_name, "system"):
+                self.system.update(elapsed_time_ms)
+        except Exception:
+            if self.system.main_thread:
+                raise
+            logger.exception("%s update failed.", self.name)
+        update_s = time.perf_counter() - start
+        self.num_updates += 1
+        self.total_update_s += update_s
+        self.max_update_s = max(self.max_update_s, update_s)
+
+    def wait(self) -> None:
+        if self.future is not None:
+            self.future.result()
+
+    def get_stats(self, interval_s: float) -> dict:
+        return {
+            "name": self.name,
+            "main_thread": self.system.main_thread,
+            "rate_hz": self.num_updates / interval_s if interval_s else 0.0,
+            "avg_ms": (
+                self.total_update_s / self.num_updates * 1000
+                if self.num_updates
+                else 0.0
+            ),
+            "max_ms": self.max_update_s * 1000,
+            "skipped": self.num_skipped,
+        }
@@ -1,9 +1,12 @@
-from typing import Mapping
+from typing import Dict, Mapping
 
 from ..EventManager import EventManager
 from ..BaseApplication import BaseApplication
 
 class BaseSystem:
+    update_rate_hz: float = None  # How often `update()` runs, every frame if None.
+    main_thread: bool = True  # False to run `update()` on the app's worker pool.
+
     def __init__(self, app: BaseApplication, config: dict=None):
         if not app:
             raise RuntimeError("Where mah app?!")
@@ -16,6 +19,9 @@ class BaseSystem:
     def get_event_manager(self) -> EventManager:
         return self.get_app().get_event_manager()
 
+    def get_clock(self):
+        return self.get_app().get_clock()
+
     def get_config(self) -> Mapping:
         return self.config
 
@@ -28,5 +34,20 @@ class BaseSystem:
     def update(self, elapsed_time: int) -> None:
         pass
 
+    def draw(self) -> None:
+        """
+        Called every frame on the main thread after the updates, to put what the
+        system last rendered on the window.
+        """
+        pass
+
     def run(self) -> None:
-        pass
\ No newline at end of file
+        pass
+
+    def get_memory_stats(self) -> Dict[str, int]:
+        """
+        Sizes of what the system holds on to, `<name>_bytes` for buffers and
+        `<name>_len` for queue lengths. Sampled from the memory diagnostics thread,
+        so it must only read.
+        """
+        return {}
@@ -0,0 +1,188 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from .BaseSystem import BaseSystem
+
+from gromtector.audio_archive import AudioArchive
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveSegment:
+    """
+    A run of contiguous audio of one source being collected into a segment.
+    """
+
+    def __init__(self, source: str, rate: int, begin_timestamp: datetime):
+        self.source = source
+        self.rate = rate
+        self.begin_timestamp = begin_timestamp
+        self.end_timestamp = begin_timestamp  # Right after the latest sample.
+        self.chunks: List[np.ndarray] = []
+        self.num_samples = 0
+
+
+class AudioArchiveSystem(BaseSystem):
+    """
+    Keeps the last `--archive-days` of raw capture audio for incident review, in
+    `--archive-segment` long compressed segments indexed by time (see
+    `gromtector archive-export`).
+
+    A segment is cut early whenever its source's audio isn't contiguous (a
+    capture loss, a rate change), so offsets into segments are exact. Encoding,
+    writes and retention run on a background writer thread fed through a bounded
+    queue: the main loop never waits on the disk and segments are dropped if the
+    writer falls too far behind.
+    """
+
+    archive_dir: str = None
+    segment_s: float = 60.0
+    max_age_s: float = None
+    max_size_bytes: int = None
+    retention_interval_s: float = 60.0
+    max_gap_s: float = 0.05  # Timestamp jitter tolerated within a segment.
+    max_queued_segments: int = 16
+
+    segments: Dict[str, ArchiveSegment] = None
+    segment_queue: queue.Queue = None
+    writer_thread: threading.Thread = None
+    running: bool = False
+
+    segments_written: int = 0
+    segments_dropped: int = 0
+    raw_bytes_written: int = 0
+    bytes_written: int = 0
+
+    def init(self) -> None:
+        configs = self.get_config()
+        self.archive_dir = os.path.abspath(os.path.expanduser(configs["--archive-dir"]))
+        if configs.get("--archive-segment"):
+            self.segment_s = float(configs["--archive-segment"])
+        if configs.get("--archive-days"):
+            self.max_age_s = float(configs["--archive-days"]) * 24 * 3600
+        if configs.get("--archive-max-mb"):
+            self.max_size_bytes = int(float(configs["--archive-max-mb"]) * 2 ** 20)
+        # Create the index up front so a bad path fails at startup.
+        AudioArchive(self.archive_dir).close()
+
+        self.segments = {}
+        self.segment_queue = queue.Queue(maxsize=self.max_queued_segments)
+        self.get_event_manager().add_listener("new_audio_data", self.recv_audio_data)
+        self.running = True
+
+    def run(self) -> None:
+        self.writer_thread = threading.Thread(
+            target=self.__class__.run_writer_thread, args=(self,)
+        )
+        self.writer_thread.start()
+
+    def shutdown(self) -> None:
+        for segment in list(self.segments.values()):
+            self.finish_segment(segment)
+        self.running = False
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+
+    def get_memory_stats(self) -> dict:
+        return {
+            "segment_bytes": sum(
+                chunk.nbytes
+                for segment in list(self.segments.values())
+                for chunk in list(segment.chunks)
+            ),
+            "segment_queue_len": self.segment_queue.qsize(),
+        }
+
+    def recv_audio_data(self, event_type, audio_event) -> None:
+        segment = self.segments.get(audio_event.source)
+        if segment is not None and (
+            segment.rate != audio_event.rate
+            or abs(audio_event.begin_timestamp - segment.end_timestamp)
+            > timedelta(seconds=self.max_gap_s)
+        ):
+            self.finish_segment(segment)
+            segment = None
+        if segment is None:
+            segment = ArchiveSegment(
+                audio_event.source, audio_event.rate, audio_event.begin_timestamp
+            )
+            self.segments[audio_event.source] = segment
+
+        data = audio_event.data.astype(np.int16, copy=False)
+        segment.chunks.append(data)
+        segment.num_samples += data.size
+        segment.end_timestamp = audio_event.begin_timestamp + timedelta(
+            seconds=data.size / audio_event.rate
+        )
+        if segment.num_samples >= self.segment_s * segment.rate:
+            self.finish_segment(segment)
+
+    def finish_segment(self, segment: ArchiveSegment) -> None:
+        if self.segments.get(segment.source) is segment:
+            del self.segments[segment.source]
+        if not segment.num_samples:
+            return
+        try:
+            self.segment_queue.put_nowait(segment)
+        except queue.Full:
+            self.segments_dropped += 1
+            logger.warning(
+                "Archive writer is behind, dropping the %s segment from %s.",
+                segment.source,
+                segment.begin_timestamp,
+            )
+
+    @classmethod
+    def run_writer_thread(cls, system: AudioArchiveSystem) -> None:
+        archive = AudioArchive(system.archive_dir)
+        next_retention = 0.0
+        while system.running or not system.segment_queue.empty():
+            if time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + system.retention_interval_s
+                try:
+                    deleted = archive.enforce_retention(
+                        system.max_age_s,
+                        system.max_size_bytes,
+                        now=system.get_clock().now(),
+                    )
+                except Exception:
+                    logger.exception("Failed to enforce the archive retention.")
+                else:
+                    if deleted:
+                        logger.info("Deleted %d expired archive segments.", deleted)
+
+            try:
+                segment = system.segment_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            start = time.time()
+            pcm = np.concatenate(segment.chunks)
+            try:
+                size = archive.add_segment(
+                    segment.source, segment.begin_timestamp, segment.rate, pcm
+                )
+            except Exception:
+                logger.exception("Failed to archive the %s segment.", segment.source)
+                continue
+            system.segments_written += 1
+            system.raw_bytes_written += pcm.nbytes
+            system.bytes_written += size
+            logger.debug(
+                "Archived %.1fs of %s audio, %.0f%% of its raw size, in %.1fms.",
+                pcm.size / segment.rate,
+                segment.source,
+                100 * size / pcm.nbytes,
+                (time.time() - start) * 1000,
+            )
+
+        archive.close()
+        logger.debug("Reaching the end of the archive writer thread.")
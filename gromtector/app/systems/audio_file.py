@@ -1,13 +1,15 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import logging
 import threading
 import os
 import platform
 import queue
+import time
 from collections import namedtuple
 import numpy as np
 import pyaudio as pa
 
+from gromtector import tracing
 from gromtector.audio_file import AudioFile, FilePlaybackFinished
 from .BaseSystem import BaseSystem
 
@@ -15,20 +17,37 @@ logger = logging.getLogger(__name__)
 
 
 InputAudioDataEvent = namedtuple(
-    "InputAudioDataEvent", ["data", "rate", "begin_timestamp"]
+    "InputAudioDataEvent",
+    ["data", "rate", "begin_timestamp", "source"],
+    defaults=["file"],
 )
 
 
 class AudioFileSystem(BaseSystem):
+    """
+    Plays an audio file through the speakers and streams it like live audio.
+
+    With `--replay` nothing is played. Chunks are stamped with the file position
+    relative to a fixed origin (the file's modification time) and advance the app's
+    virtual clock, and the file is read as fast as `--replay-speed` allows (0 for as
+    fast as the rest of the pipeline keeps up). Every chunk is its own
+    `new_audio_data` event so downstream chunking doesn't depend on the frame rate.
+    """
+
     pa = None
     audio_out_stream = None
     audio_file: AudioFile = None
     file_playback_done: bool = True
     read_write_thread: threading.Thread = None
-    audio_data_queue: queue.Queue = queue.Queue()
+    audio_data_queue: queue.Queue = None
+
+    replay: bool = False
+    replay_speed: float = 0.0
+    replay_chunk_size: int = 4096
+    replay_max_queued_chunks: int = 64
+    stream_origin: datetime = None
 
     running: bool = False
-    read_write_thread: threading.Thread = None
 
     def init(self):
         input_file_path = self.config.get("--file", None)
@@ -42,18 +61,29 @@ class AudioFileSystem(BaseSystem):
         if not os.path.exists(input_file_path):
             raise RuntimeError('Cannot locate audio file "{}"'.format(input_file_path))
 
-        self.audio_file = AudioFile(file_path=self.config["--file"])
-
-        self.pa = pa.PyAudio()
-        self.audio_out_stream = self.pa.open(
-            format=self.pa.get_format_from_width(
-                self.audio_file.audio_segment.seg.sample_width,  # or maybe frame_width?
-            ),
-            channels=self.audio_file.audio_segment.channels,
-            rate=self.audio_file.audio_segment.frame_rate,
-            output=True,
+        self.replay = bool(self.config.get("--replay"))
+        self.replay_speed = float(self.config.get("--replay-speed") or 0.0)
+        self.audio_file = AudioFile(
+            file_path=input_file_path,
+            chunk_size=self.replay_chunk_size if self.replay else None,
+            start_s=float(self.config.get("--file-start") or 0.0),
         )
 
+        if self.replay:
+            self.stream_origin = datetime.fromtimestamp(
+                os.path.getmtime(input_file_path), tz=timezone.utc
+            )
+            self.audio_data_queue = queue.Queue(maxsize=self.replay_max_queued_chunks)
+        else:
+            self.audio_data_queue = queue.Queue()
+            self.pa = pa.PyAudio()
+            self.audio_out_stream = self.pa.open(
+                format=self.pa.get_format_from_width(self.audio_file.sample_width),
+                channels=self.audio_file.channels,
+                rate=self.audio_file.sample_rate,
+                output=True,
+            )
+
         self.running = True
         self.file_playback_done = False
 
@@ -61,10 +91,14 @@ class AudioFileSystem(BaseSystem):
         self.running = False
 
         self.read_write_thread.join()
-        self.audio_out_stream.stop_stream()
-        self.audio_out_stream.close()
-        self.pa.terminate()
+        if self.audio_out_stream is not None:
+            self.audio_out_stream.stop_stream()
+            self.audio_out_stream.close()
+            self.pa.terminate()
+        self.audio_file.close()
 
+    def get_memory_stats(self) -> dict:
+        return {"audio_data_queue_len": self.audio_data_queue.qsize()}
 
     def run(self) -> None:
         self.read_write_thread = threading.Thread(
@@ -73,9 +107,6 @@ class AudioFileSystem(BaseSystem):
         self.read_write_thread.start()
 
     def update(self, elapsed_time_ms: int) -> None:
-        if self.file_playback_done:
-            return
-
         evt_mgr = self.get_event_manager()
         dataset = []
         dataset_utcbegin = None
@@ -84,32 +115,75 @@ class AudioFileSystem(BaseSystem):
             if audio_data_pack is None:
                 # Audio ended.
                 evt_mgr.queue_event("input_audio_data_ended", None)
+                continue
             audio_raw, utc_begin = audio_data_pack
+            if self.replay:
+                self.queue_audio_data(audio_raw, utc_begin)
+                continue
             if not dataset_utcbegin:
                 dataset_utcbegin = utc_begin
             dataset.append(audio_raw)
         if dataset:
-            data = np.concatenate(dataset)
-            evt_mgr.queue_event(
-                "new_audio_data",
-                InputAudioDataEvent(
-                    data=data,
-                    rate=self.audio_file.audio_segment.frame_rate,
-                    begin_timestamp=dataset_utcbegin,
-                ),
+            self.queue_audio_data(np.concatenate(dataset), dataset_utcbegin)
+
+    def queue_audio_data(self, data: np.ndarray, begin_timestamp: datetime) -> None:
+        self.get_event_manager().queue_event(
+            "new_audio_data",
+            InputAudioDataEvent(
+                data=data,
+                rate=self.audio_file.sample_rate,
+                begin_timestamp=begin_timestamp,
+            ),
+        )
+        if self.replay:
+            self.get_clock().advance_to(
+                begin_timestamp
+                + timedelta(seconds=data.size / self.audio_file.sample_rate)
             )
 
+    def put_audio_data(self, audio_data_pack) -> bool:
+        """
+        Hands data to the main thread, waiting while a replay's queue is full.
+        Returns `False` if the system shut down in the meantime.
+        """
+        while self.running:
+            try:
+                self.audio_data_queue.put(audio_data_pack, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
     @classmethod
     def run_read_write_thread(cls, system) -> None:
+        replay_wall_begin = time.monotonic()
+        replay_position_begin = system.audio_file.position_s
         while system.running:
             if system.file_playback_done:
                 break
 
             try:
-                utcnow = datetime.now(tz=timezone.utc)
-                aud_f_data = system.audio_file.read()
-                system.audio_out_stream.write(aud_f_data.data.tobytes())
-                system.audio_data_queue.put((aud_f_data, utcnow))
+                if system.replay:
+                    utc_begin = system.stream_origin + timedelta(
+                        seconds=system.audio_file.position_s
+                    )
+                else:
+                    utc_begin = datetime.now(tz=timezone.utc)
+                with tracing.span("capture.read", "audio"):
+                    aud_f_data = system.audio_file.read()
+                if system.replay:
+                    if system.replay_speed > 0:
+                        played_s = system.audio_file.position_s - replay_position_begin
+                        delay = (
+                            replay_wall_begin
+                            + played_s / system.replay_speed
+                            - time.monotonic()
+                        )
+                        if delay > 0:
+                            time.sleep(delay)
+                else:
+                    system.audio_out_stream.write(aud_f_data.data.tobytes())
+                system.put_audio_data((aud_f_data, utc_begin))
             except FilePlaybackFinished:
                 system.file_playback_done = True
-                system.audio_data_queue.put(None)  # Empty to signal end.
+                system.put_audio_data(None)  # Empty to signal end.
@@ -14,6 +14,8 @@ from pydub import AudioSegment
 from simpleaudio import play_buffer
 from simpleaudio.shiny import PlayObject
 
+from gromtector import tracing
+
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +29,7 @@ class BarkReactSystem(BaseSystem):
 
     bark_notify_email: str = None
     gmail_app_pw: str = None
+    settings_lock: threading.Lock = None  # Email settings can be reloaded live.
     email_thread: threading.Thread = None
 
     running: bool = False
@@ -35,6 +38,7 @@ class BarkReactSystem(BaseSystem):
         evt_mgr = self.get_event_manager()
         evt_mgr.add_listener("dog_bark_begin", self.handle_dogbark_begin)
         evt_mgr.add_listener("audio_event_dogbark", self.handle_dogbark_detected)
+        evt_mgr.add_listener("config_changed", self.handle_config_changed)
 
         configs = self.get_config()
 
@@ -52,19 +56,41 @@ class BarkReactSystem(BaseSystem):
             logger.error(err_msg)
             raise RuntimeError(err_msg)
 
-        self.clips = []
-        if self.bark_response_playback_paths:
-            for bark_response_playback_path in self.bark_response_playback_paths:
-                self.clips.append(AudioSegment.from_file(bark_response_playback_path))
+        self.clips = self.load_clips(self.bark_response_playback_paths)
+
+        self.settings_lock = threading.Lock()
+        self.dogbark_events = queue.Queue()
+        self.running = True
+
+    def load_clips(self, paths: Sequence[str]) -> Sequence[AudioSegment]:
+        clips = []
+        if paths:
+            for bark_response_playback_path in paths:
+                clips.append(AudioSegment.from_file(bark_response_playback_path))
         else:
             logger.warning("No dog bark response audio clips were provided.")
 
-        if self.clips:
-            for clip in self.clips:
+        if clips:
+            for clip in clips:
                 clip.apply_gain(+20.0)
-
-        self.dogbark_events = queue.Queue()
-        self.running = True
+        return clips
+
+    def handle_config_changed(self, event_type, event) -> None:
+        changed = event["changed"]
+        if "--bark-response-audio" in changed:
+            # Only swap the clips in once all of them loaded.
+            try:
+                clips = self.load_clips(changed["--bark-response-audio"])
+            except Exception as e:
+                logger.error("Bark response clips not reloaded: %s", e)
+            else:
+                self.bark_response_playback_paths = changed["--bark-response-audio"]
+                self.clips = clips
+        if "--bark-notify-email" in changed or "--gmail-app-pw" in changed:
+            configs = self.get_config()
+            with self.settings_lock:
+                self.bark_notify_email = configs["--bark-notify-email"]
+                self.gmail_app_pw = configs["--gmail-app-pw"]
 
     def run(self):
         self.email_thread = threading.Thread(
@@ -77,6 +103,12 @@ class BarkReactSystem(BaseSystem):
         if self.email_thread is not None:
             self.email_thread.join()
 
+    def get_memory_stats(self) -> dict:
+        return {
+            "clips_bytes": sum(len(clip.raw_data) for clip in self.clips),
+            "dogbark_events_len": self.dogbark_events.qsize(),
+        }
+
     def handle_dogbark_begin(self, event_type, event) -> None:
         if self.play_obj is None and self.clips:
             clip_idx = random.randint(0, len(self.clips)-1)
@@ -103,23 +135,33 @@ class BarkReactSystem(BaseSystem):
                 time.sleep(1)
                 continue
 
-            server_ssl = smtplib.SMTP_SSL("smtp.gmail.com", 465)
-            server_ssl.ehlo()  # optional, called by login()
-            server_ssl.login(system.bark_notify_email, system.gmail_app_pw)
+            with system.settings_lock:
+                bark_notify_email = system.bark_notify_email
+                gmail_app_pw = system.gmail_app_pw
+            if not (bark_notify_email and gmail_app_pw):
+                # Notifications were turned off since these were queued.
+                while not system.dogbark_events.empty():
+                    system.dogbark_events.get()
+                continue
+
+            with tracing.span("email.login", "notify"):
+                server_ssl = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+                server_ssl.ehlo()  # optional, called by login()
+                server_ssl.login(bark_notify_email, gmail_app_pw)
 
             while not system.dogbark_events.empty():
                 event = system.dogbark_events.get()
 
                 email_subject = "Gromtector: barking detected"
-                email_from = system.bark_notify_email
-                email_to = system.bark_notify_email
+                email_from = bark_notify_email
+                email_to = bark_notify_email
                 begin_ts = event["begin_timestamp"].astimezone(tz=None).strftime("%Y-%m-%d %H:%M:%S")
                 end_ts = event["end_timestamp"].astimezone(tz=None).strftime("%Y-%m-%d %H:%M:%S")
                 email_msg = (
                     "From: {}\n"
                     "To: {}\n"
                     "Subject: {}\n\n"
-                    "Barking detected on \"{}\".\n"
+                    "Barking detected on \"{}\" ({}).\n"
                     "{} - {}\n\n"
                     "Trigger classes:\n"
                     "{}\n\n"
@@ -130,6 +172,7 @@ class BarkReactSystem(BaseSystem):
                     email_to,
                     email_subject,
                     gethostname(),
+                    event["source"],
                     begin_ts,
                     end_ts,
                     "\n".join(
@@ -140,7 +183,8 @@ class BarkReactSystem(BaseSystem):
                     ),
                 )
                 # ssl server doesn't support or need tls, so don't call server_ssl.starttls()
-                server_ssl.sendmail(email_from, [email_to], email_msg)
+                with tracing.span("email.send", "notify"):
+                    server_ssl.sendmail(email_from, [email_to], email_msg)
 
             # server_ssl.quit()
             server_ssl.close()
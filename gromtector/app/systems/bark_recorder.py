@@ -0,0 +1,312 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+import logging
+import os
+import queue
+import threading
+import time
+import wave
+from typing import Dict, List
+
+import numpy as np
+from pydub import AudioSegment
+
+from .BaseSystem import BaseSystem
+
+from gromtector.audio_ring import RollingAudioBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class ClipRecording:
+    """
+    A bark clip being collected for one source.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        rate: int,
+        begin_timestamp: datetime,
+        detection_begin_timestamp: datetime,
+        preroll,
+    ):
+        self.source = source
+        self.rate = rate
+        self.begin_timestamp = begin_timestamp
+        self.detection_begin_timestamp = detection_begin_timestamp
+        self.chunks: List[np.ndarray] = [preroll]
+        self.num_samples = preroll.size
+        self.post_roll_left: int = None  # Samples still to record once barking ended.
+
+
+class SourceAudio:
+    def __init__(self, rate: int, preroll_s: float):
+        self.rate = rate
+        num_preroll = int(rate * preroll_s)
+        # No buffer at all for clips without a pre-roll.
+        self.preroll = RollingAudioBuffer(num_preroll) if num_preroll > 0 else None
+        self.end_timestamp: datetime = None  # Timestamp right after the latest sample.
+        self.recording: ClipRecording = None
+
+
+class BarkRecorderSystem(BaseSystem):
+    """
+    Saves an evidence clip of every bark episode: the pre-roll audio leading up to
+    `dog_bark_begin`, everything until `audio_event_dogbark` and then some post-roll.
+
+    Clips are recorded at the capture rate. Encoding and disk writes happen on a
+    background writer thread fed through a bounded queue, so the main loop never
+    waits on I/O and memory stays bounded: each source keeps a fixed pre-roll
+    buffer, clips are capped in length and clips are dropped if the writer falls
+    too far behind.
+
+    The writer hands `bark_clip_saved` events back through a queue that `update()`
+    forwards. Clips flushed at shutdown are announced directly once the writer is
+    done, while the detection history (shut down after this) still takes them.
+    """
+
+    clip_dir: str = None
+    clip_format: str = "flac"
+    preroll_s: float = 5.0
+    postroll_s: float = 2.0
+    max_clip_s: float = 120.0
+    max_queued_clips: int = 8
+
+    sources: Dict[str, SourceAudio] = None
+    clip_queue: queue.Queue = None
+    saved_clip_events: queue.Queue = None
+    writer_thread: threading.Thread = None
+    running: bool = False
+
+    clips_written: int = 0
+    clips_dropped: int = 0
+    bytes_written: int = 0
+    write_time_s: float = 0.0
+
+    stats_interval_s: float = 60.0
+    stats_time: float = 0.0
+    reported_clips: int = 0
+
+    def init(self) -> None:
+        configs = self.get_config()
+        self.clip_dir = os.path.abspath(os.path.expanduser(configs["--clip-dir"]))
+        self.clip_format = configs.get("--clip-format") or self.clip_format
+        if self.clip_format not in ("flac", "wav"):
+            raise RuntimeError(
+                'Unsupported clip format "{}", use flac or wav.'.format(self.clip_format)
+            )
+        if configs.get("--clip-pre-roll"):
+            self.preroll_s = float(configs["--clip-pre-roll"])
+        if configs.get("--clip-post-roll"):
+            self.postroll_s = float(configs["--clip-post-roll"])
+        if self.preroll_s < 0 or self.postroll_s < 0:
+            raise RuntimeError(
+                "Clip pre-roll and post-roll can't be negative, got {}s and {}s."
+                .format(self.preroll_s, self.postroll_s)
+            )
+        os.makedirs(self.clip_dir, exist_ok=True)
+
+        self.sources = {}
+        self.clip_queue = queue.Queue(maxsize=self.max_queued_clips)
+        self.saved_clip_events = queue.Queue()
+        self.stats_time = time.monotonic()
+
+        evt_mgr = self.get_event_manager()
+        evt_mgr.add_listener("new_audio_data", self.recv_audio_data)
+        evt_mgr.add_listener("dog_bark_begin", self.handle_dogbark_begin)
+        evt_mgr.add_listener("audio_event_dogbark", self.handle_dogbark_detected)
+
+        self.running = True
+
+    def run(self) -> None:
+        self.writer_thread = threading.Thread(
+            target=self.__class__.run_writer_thread, args=(self,)
+        )
+        self.writer_thread.start()
+
+    def shutdown(self) -> None:
+        # Flush the clips that are still recording before the writer stops.
+        for source in self.sources.values():
+            if source.recording is not None:
+                self.finish_clip(source)
+        self.running = False
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+        evt_mgr = self.get_event_manager()
+        while not self.saved_clip_events.empty():
+            evt_mgr.dispatch_event("bark_clip_saved", self.saved_clip_events.get())
+
+    def update(self, elapsed_time_ms: int) -> None:
+        evt_mgr = self.get_event_manager()
+        while not self.saved_clip_events.empty():
+            evt_mgr.queue_event("bark_clip_saved", self.saved_clip_events.get())
+        self.report_writer_stats()
+
+    def report_writer_stats(self) -> None:
+        now = time.monotonic()
+        if now - self.stats_time < self.stats_interval_s:
+            return
+        self.stats_time = now
+        stats = self.get_writer_stats()
+        num_clips = stats["clips_written"] + stats["clips_dropped"]
+        if num_clips == self.reported_clips:
+            return
+        self.reported_clips = num_clips
+        logger.info(
+            "Bark clips: %d written, %d dropped, %d queued, %.1f kB/s when writing.",
+            stats["clips_written"],
+            stats["clips_dropped"],
+            stats["queue_depth"],
+            stats["bytes_per_s"] / 1000,
+        )
+
+    def get_memory_stats(self) -> dict:
+        preroll_bytes = 0
+        recording_bytes = 0
+        for source in list(self.sources.values()):
+            if source.preroll is not None:
+                preroll_bytes += source.preroll.buffer.nbytes
+            clip = source.recording
+            if clip is not None:
+                recording_bytes += sum(chunk.nbytes for chunk in list(clip.chunks))
+        return {
+            "preroll_bytes": preroll_bytes,
+            "recording_bytes": recording_bytes,
+            "clip_queue_len": self.clip_queue.qsize(),
+        }
+
+    def recv_audio_data(self, event_type, audio_event) -> None:
+        source = self.sources.get(audio_event.source)
+        if source is None or source.rate != audio_event.rate:
+            source = SourceAudio(audio_event.rate, self.preroll_s)
+            self.sources[audio_event.source] = source
+
+        data = audio_event.data
+        source.end_timestamp = audio_event.begin_timestamp + timedelta(
+            seconds=data.size / audio_event.rate
+        )
+
+        clip = source.recording
+        if clip is not None:
+            max_samples = int(self.max_clip_s * source.rate)
+            if clip.post_roll_left is not None:
+                data = data[: clip.post_roll_left]
+                clip.post_roll_left -= data.size
+            data = data[: max(0, max_samples - clip.num_samples)]
+            clip.chunks.append(data)
+            clip.num_samples += data.size
+            if clip.post_roll_left == 0 or clip.num_samples >= max_samples:
+                self.finish_clip(source)
+
+        if source.preroll is not None:
+            source.preroll.write(audio_event.data)
+
+    def handle_dogbark_begin(self, event_type, event) -> None:
+        source = self.sources.get(event["source"])
+        if source is None or source.recording is not None:
+            return
+        if source.preroll is not None:
+            preroll = source.preroll.snapshot()
+        else:
+            preroll = np.zeros(0, dtype=np.int16)
+        begin_timestamp = source.end_timestamp - timedelta(
+            seconds=preroll.size / source.rate
+        )
+        source.recording = ClipRecording(
+            event["source"],
+            source.rate,
+            begin_timestamp,
+            event["begin_timestamp"],
+            preroll,
+        )
+
+    def handle_dogbark_detected(self, event_type, event) -> None:
+        source = self.sources.get(event["source"])
+        if source is None or source.recording is None:
+            return
+        source.recording.post_roll_left = int(self.postroll_s * source.rate)
+
+    def finish_clip(self, source: SourceAudio) -> None:
+        clip = source.recording
+        source.recording = None
+        try:
+            self.clip_queue.put_nowait(clip)
+        except queue.Full:
+            self.clips_dropped += 1
+            logger.warning(
+                "Clip writer is behind, dropping the %s clip from %s.",
+                clip.source,
+                clip.begin_timestamp,
+            )
+
+    def get_writer_stats(self) -> dict:
+        return {
+            "queue_depth": self.clip_queue.qsize(),
+            "clips_written": self.clips_written,
+            "clips_dropped": self.clips_dropped,
+            "bytes_written": self.bytes_written,
+            "bytes_per_s": (
+                self.bytes_written / self.write_time_s if self.write_time_s else 0.0
+            ),
+        }
+
+    def write_clip(self, clip: ClipRecording) -> str:
+        file_name = "{}_{}.{}".format(
+            clip.source,
+            clip.begin_timestamp.astimezone(tz=None).strftime("%Y%m%d-%H%M%S"),
+            self.clip_format,
+        )
+        path = os.path.join(self.clip_dir, file_name)
+        tmp_path = path + ".part"
+        pcm = np.concatenate(clip.chunks).astype(np.int16, copy=False)
+        if self.clip_format == "wav":
+            with wave.open(tmp_path, "wb") as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(clip.rate)
+                wav_file.writeframes(pcm.tobytes())
+        else:
+            AudioSegment(
+                data=pcm.tobytes(), sample_width=2, frame_rate=clip.rate, channels=1
+            ).export(tmp_path, format=self.clip_format)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def run_writer_thread(cls, system: BarkRecorderSystem) -> None:
+        while system.running or not system.clip_queue.empty():
+            try:
+                clip = system.clip_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            start = time.time()
+            try:
+                path = system.write_clip(clip)
+            except Exception:
+                logger.exception("Failed to write the %s bark clip.", clip.source)
+                continue
+            end = time.time()
+
+            size = os.path.getsize(path)
+            system.clips_written += 1
+            system.bytes_written += size
+            system.write_time_s += end - start
+            logger.info(
+                'Saved bark clip "%s" (%.1fs, %.1fms to write, %d queued).',
+                path,
+                clip.num_samples / clip.rate,
+                (end - start) * 1000,
+                system.clip_queue.qsize(),
+            )
+            system.saved_clip_events.put(
+                {
+                    "source": clip.source,
+                    "begin_timestamp": clip.begin_timestamp,
+                    "detection_begin_timestamp": clip.detection_begin_timestamp,
+                    "path": path,
+                }
+            )
+
+        logger.debug("Reaching the end of the clip writer thread.")
@@ -0,0 +1,64 @@
+import logging
+import os
+
+from .BaseSystem import BaseSystem
+
+from gromtector.config_file import config_file_stamp, load_config_file
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcherSystem(BaseSystem):
+    """
+    Applies the `--config` file on top of the command line and keeps watching it.
+
+    It has to come first in the system list: the file is merged into the shared
+    config at `init()`, before the other systems read it. When the file changes,
+    the whole new file is checked first, then the options that actually changed
+    are merged and one `config_changed` event (`{"changed": {option: value}}`)
+    is queued. Systems apply it between frames, and the model and capture
+    streams are not touched. An invalid file is logged and ignored until it is
+    fixed, and settings removed from the file keep their last value.
+    """
+
+    update_rate_hz: float = 1.0
+
+    config_path: str = None
+    config_stamp = None
+
+    def init(self) -> None:
+        self.config_path = os.path.abspath(
+            os.path.expanduser(self.get_config()["--config"])
+        )
+        self.config_stamp = config_file_stamp(self.config_path)
+        self.get_config().update(load_config_file(self.config_path))
+        logger.info('Loaded settings from "%s".', self.config_path)
+
+    def update(self, elapsed_time_ms: int) -> None:
+        try:
+            stamp = config_file_stamp(self.config_path)
+        except OSError:
+            return  # Editors can briefly remove the file while saving it.
+        if stamp == self.config_stamp:
+            return
+        self.config_stamp = stamp
+
+        try:
+            new_config = load_config_file(self.config_path)
+        except (OSError, RuntimeError) as e:
+            logger.error("Settings not reloaded: %s", e)
+            return
+
+        configs = self.get_config()
+        changed = {
+            option: value
+            for option, value in new_config.items()
+            if configs.get(option) != value
+        }
+        if not changed:
+            return
+        configs.update(changed)
+        logger.info(
+            'Reloaded "%s": %s changed.', self.config_path, ", ".join(sorted(changed))
+        )
+        self.get_event_manager().queue_event("config_changed", {"changed": changed})
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+
+from .BaseSystem import BaseSystem
+
+from gromtector.detection_store import DetectionStore
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionHistorySystem(BaseSystem):
+    """
+    Persists every bark episode into the SQLite detection store (see `gromtector
+    report`). Events are queued and written in batches by a writer thread, so the
+    main loop never waits on the database.
+    """
+
+    db_path: str = None
+    flush_interval_s: float = 2.0
+    max_batch_size: int = 500
+
+    write_queue: queue.Queue = None
+    writer_thread: threading.Thread = None
+    running: bool = False
+
+    def init(self) -> None:
+        self.db_path = self.get_config()["--db"]
+        # Create the schema up front so a bad path fails at startup.
+        DetectionStore(self.db_path).close()
+
+        self.write_queue = queue.Queue()
+
+        evt_mgr = self.get_event_manager()
+        evt_mgr.add_listener("audio_event_dogbark", self.recv_dogbark)
+        evt_mgr.add_listener("bark_clip_saved", self.recv_clip_saved)
+
+        self.running = True
+
+    def run(self) -> None:
+        self.writer_thread = threading.Thread(
+            target=self.__class__.run_writer_thread, args=(self,)
+        )
+        self.writer_thread.start()
+
+    def shutdown(self) -> None:
+        self.running = False
+        if self.writer_thread is not None:
+            self.writer_thread.join()
+
+    def get_memory_stats(self) -> dict:
+        return {"write_queue_len": self.write_queue.qsize()}
+
+    def recv_dogbark(self, event_type, event) -> None:
+        self.write_queue.put((event_type, event))
+
+    def recv_clip_saved(self, event_type, event) -> None:
+        self.write_queue.put((event_type, event))
+
+    @classmethod
+    def run_writer_thread(cls, system: DetectionHistorySystem) -> None:
+        store = DetectionStore(system.db_path)
+        while system.running or not system.write_queue.empty():
+            barks = []
+            clips = []
+            deadline = time.time() + system.flush_interval_s
+            while len(barks) + len(clips) < system.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event_type, event = system.write_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if event_type == "audio_event_dogbark":
+                    barks.append(event)
+                else:
+                    clips.append(
+                        (
+                            event["source"],
+                            event["detection_begin_timestamp"],
+                            event["path"],
+                        )
+                    )
+
+            # Barks always come before their clips, so insert them first.
+            try:
+                if barks:
+                    store.add_barks(barks)
+                if clips:
+                    store.set_clip_paths(clips)
+            except Exception:
+                logger.exception(
+                    "Failed to write %d barks and %d clips to the detection store.",
+                    len(barks),
+                    len(clips),
+                )
+
+        store.close()
+        logger.debug("Reaching the end of the detection store writer thread.")
@@ -1,8 +1,12 @@
 from datetime import datetime, timezone
 import logging
-from typing import Sequence
+from typing import Dict, Sequence, Tuple
+
 from .BaseSystem import BaseSystem
 
+from gromtector.rules import Rule, RuleEngine, dog_bark_rule
+from gromtector.score_frame import ScoreFrame
+
 
 logger = logging.getLogger(__name__)
 
@@ -30,97 +34,212 @@ ANIMAL_CLASSES_OF_INTEREST = [s.lower() for s in _ANIMAL_CLASSES_OF_INTEREST]
 DOG_NOISE_OF_INTEREST = [s.lower() for s in _DOG_NOISE_OF_INTEREST]
 
 
+class DetectionState:
+    """
+    Detection progress of one rule on a single input source.
+    """
+
+    def __init__(self, rule: Rule, source: str):
+        self.rule = rule
+        self.source = source
+        self.raw_detection_begin_timestamp: datetime = None
+        self.raw_detection_end_timestamp: datetime = None
+        self.last_raw_bark_end_timestamp: datetime = None
+        self.initial_trigger_classes: Sequence = None
+
+
 class DogAudioDetectionSystem(BaseSystem):
-    raw_detection_begin_timestamp: datetime = None
-    raw_detection_end_timestamp: datetime = None
-    last_raw_bark_end_timestamp: datetime = None
-    initial_trigger_classes: Sequence = None
+    """
+    Turns per-frame class detections into episode begin/end events, one state
+    machine per detection rule and input source. The bark rule is always there;
+    more rules (glass breaking, smoke alarms, ...) come from the config file's
+    `rules` (see `gromtector.rules`) and all of them are evaluated in one pass
+    per frame. Events carry the source id and the rule name.
+
+    On a virtual clock (replays) time is taken from the frames themselves rather
+    than the wall clock, so episode boundaries don't depend on the replay speed.
+
+    The thresholds, class sets and rules follow `config_changed`. Open episodes
+    carry on under the new settings, those of removed rules are ended.
+    """
+
+    update_rate_hz: float = 10.0
+
+    states: Dict[Tuple[str, str], DetectionState] = None
+
+    animal_classes: Sequence[str] = ANIMAL_CLASSES_OF_INTEREST
+    dog_noise_classes: Sequence[str] = DOG_NOISE_OF_INTEREST
+    rule_engine: RuleEngine = None
 
     def init(self) -> None:
+        self.states = {}
+
         evt_mgr = self.get_event_manager()
         evt_mgr.add_listener("detected_classes", self.recv_dclasses)
+        evt_mgr.add_listener("inference_ended", self.recv_inference_ended)
+        evt_mgr.add_listener("config_changed", self.recv_config_changed)
 
-        configs = self.get_config()
+        self.apply_config(self.get_config())
+
+    def apply_config(self, configs) -> None:
         self.animal_class_threshold: float = float(configs["--dog-class-threshold"])
         self.dog_audio_class_threshold: float = float(configs["--dog-audio-class-threshold"])
+        if configs.get("--animal-classes"):
+            self.animal_classes = [s.lower() for s in configs["--animal-classes"]]
+        if configs.get("--dog-noise-classes"):
+            self.dog_noise_classes = [s.lower() for s in configs["--dog-noise-classes"]]
+
+        rules = [
+            dog_bark_rule(
+                self.animal_classes,
+                self.dog_noise_classes,
+                self.animal_class_threshold,
+                self.dog_audio_class_threshold,
+            )
+        ] + list(configs.get("--rules") or [])
+        self.rule_engine = RuleEngine(rules)
+
+        # Carry the open episodes over to the new rules.
+        rules_by_name = {rule.name: rule for rule in rules}
+        for key, state in list(self.states.items()):
+            rule = rules_by_name.get(state.rule.name)
+            if rule is not None:
+                state.rule = rule
+                continue
+            if state.raw_detection_begin_timestamp is not None:
+                if state.last_raw_bark_end_timestamp is None:
+                    state.last_raw_bark_end_timestamp = self.get_clock().now()
+                self.update_state(state, None)
+            del self.states[key]
 
         logger.info("Dog class threshold: %.2f", self.animal_class_threshold)
         logger.info("Dog audio class threshold: %.2f", self.dog_audio_class_threshold)
-
-    def recv_dclasses(self, event_type, event) -> None:
+        if len(rules) > 1:
+            logger.info(
+                "Detection rules: %s", ", ".join(rule.name for rule in rules)
+            )
+
+    def recv_config_changed(self, event_type, event) -> None:
+        if any(
+            option in event["changed"]
+            for option in (
+                "--dog-class-threshold",
+                "--dog-audio-class-threshold",
+                "--animal-classes",
+                "--dog-noise-classes",
+                "--rules",
+            )
+        ):
+            self.apply_config(self.get_config())
+
+    def get_state(self, rule: Rule, source: str) -> DetectionState:
+        state = self.states.get((rule.name, source))
+        if state is None:
+            state = DetectionState(rule, source)
+            self.states[(rule.name, source)] = state
+        return state
+
+    def recv_dclasses(self, event_type, frame: ScoreFrame) -> None:
         evt_mgr = self.get_event_manager()
+        virtual_time = self.get_clock().is_virtual
+        fired, hits = self.rule_engine.evaluate(frame)
+
+        for rule_idx, rule in enumerate(self.rule_engine.rules):
+            state = self.get_state(rule, frame.source)
+            if virtual_time:
+                self.update_state(state, frame.begin_timestamp)
+
+            if fired[rule_idx]:
+                state.raw_detection_end_timestamp = None
+                if state.raw_detection_begin_timestamp is None:
+                    state.raw_detection_begin_timestamp = frame.begin_timestamp
+                    state.initial_trigger_classes = frame.classes(
+                        self.rule_engine.trigger_indices(rule_idx, hits, frame)
+                    )
+
+                    evt_mgr.queue_event(
+                        rule.begin_event,
+                        {
+                            "source": state.source,
+                            "rule": rule.name,
+                            "begin_timestamp": state.raw_detection_begin_timestamp,
+                            "detected_classes": state.initial_trigger_classes,
+                            **rule.event_fields,
+                        },
+                    )
+                else:
+                    # on-going episode.
+                    pass
 
-        detected_classes = event["classes"]
-        detected_dog_classes = [
-            c
-            for c in detected_classes
-            if c["label"].lower() in ANIMAL_CLASSES_OF_INTEREST and c["score"] >= self.animal_class_threshold
-        ]
-        detected_dog_noise_classes = [
-            c
-            for c in detected_classes
-            if c["label"].lower() in DOG_NOISE_OF_INTEREST and c["score"] >= self.dog_audio_class_threshold
-        ]
-        if len(detected_dog_classes) > 2 and detected_dog_noise_classes:
-            self.raw_detection_end_timestamp = None
-            if self.raw_detection_begin_timestamp is None:
-                self.raw_detection_begin_timestamp = event["begin_timestamp"]
-                self.initial_trigger_classes = (
-                    detected_dog_classes + detected_dog_noise_classes
-                )
-
-                evt_mgr.queue_event(
-                    "dog_bark_begin",
-                    {
-                        "begin_timestamp": self.raw_detection_begin_timestamp,
-                        "detected_classes": self.initial_trigger_classes,
-                        "dog_class_threshold": self.animal_class_threshold,
-                        "dog_audio_class_threshold": self.dog_audio_class_threshold,
-                    },
-                )
             else:
-                # on-going barking.
-                pass
-
-        else:
+                if (
+                    state.raw_detection_begin_timestamp is not None
+                    and state.last_raw_bark_end_timestamp is None
+                ):
+                    # sound stopped.
+                    if virtual_time:
+                        state.last_raw_bark_end_timestamp = frame.begin_timestamp
+                    else:
+                        state.last_raw_bark_end_timestamp = datetime.now(tz=timezone.utc)
+
+    def recv_inference_ended(self, event_type, event) -> None:
+        # Close the episodes still open when the input ran out.
+        for state in self.states.values():
             if (
-                self.raw_detection_begin_timestamp is not None
-                and self.last_raw_bark_end_timestamp is None
+                state.raw_detection_begin_timestamp is not None
+                and state.last_raw_bark_end_timestamp is None
             ):
-                # barking stopped.
-                self.last_raw_bark_end_timestamp = datetime.now(tz=timezone.utc)
+                state.last_raw_bark_end_timestamp = self.get_clock().now()
+            self.update_state(state, None)
 
     def update(self, elapsed_time_ms: int) -> None:
+        if self.get_clock().is_virtual:
+            # Driven by the frame timestamps in `recv_dclasses` instead.
+            return
+        now = datetime.now(tz=timezone.utc)
+        for state in self.states.values():
+            self.update_state(state, now)
+
+    def update_state(self, state: DetectionState, now: datetime) -> None:
+        """
+        Ends the episode of `state` if the sound stopped at least its rule's
+        `end_wait_s` before `now`, or right away if `now` is `None`.
+        """
         evt_mgr = self.get_event_manager()
+        rule = state.rule
 
-        if self.last_raw_bark_end_timestamp is not None:
-            now = datetime.now(tz=timezone.utc)
-            dur_since_last_raw_bark_end = now - self.last_raw_bark_end_timestamp
-            wait_s = 1.0
-            if dur_since_last_raw_bark_end.seconds >= wait_s:
-                self.raw_detection_end_timestamp = self.last_raw_bark_end_timestamp
+        if state.last_raw_bark_end_timestamp is not None:
+            if now is None:
+                ended = True
+            else:
+                dur_since_last_raw_bark_end = now - state.last_raw_bark_end_timestamp
+                ended = dur_since_last_raw_bark_end.total_seconds() >= rule.end_wait_s
+            if ended:
+                state.raw_detection_end_timestamp = state.last_raw_bark_end_timestamp
 
                 evt_mgr.queue_event(
-                    "audio_event_dogbark",
+                    rule.episode_event,
                     {
-                        "begin_timestamp": self.raw_detection_begin_timestamp,
-                        "end_timestamp": self.raw_detection_end_timestamp,
-                        "trigger_classes": self.initial_trigger_classes,
-                        "dog_class_threshold": self.animal_class_threshold,
-                        "dog_audio_class_threshold": self.dog_audio_class_threshold,
+                        "source": state.source,
+                        "rule": rule.name,
+                        "begin_timestamp": state.raw_detection_begin_timestamp,
+                        "end_timestamp": state.raw_detection_end_timestamp,
+                        "trigger_classes": state.initial_trigger_classes,
+                        **rule.event_fields,
                     },
                 )
 
                 evt_mgr.queue_event(
-                    "dog_bark_end",
+                    rule.end_event,
                     {
-                        "end_timestamp": self.raw_detection_end_timestamp,
-                        "dog_class_threshold": self.animal_class_threshold,
-                        "dog_audio_class_threshold": self.dog_audio_class_threshold,
+                        "source": state.source,
+                        "rule": rule.name,
+                        "end_timestamp": state.raw_detection_end_timestamp,
+                        **rule.event_fields,
                     },
                 )
 
-                self.last_raw_bark_end_timestamp = None
-                self.raw_detection_begin_timestamp = None
-                self.raw_detection_end_timestamp = None
-                self.initial_trigger_classes = None
+                state.last_raw_bark_end_timestamp = None
+                state.raw_detection_begin_timestamp = None
+                state.raw_detection_end_timestamp = None
+                state.initial_trigger_classes = None
@@ -1,9 +1,12 @@
 from datetime import datetime
 from typing import Sequence, Tuple
+import numpy as np
 from .BaseSystem import BaseSystem
 import pygame as pg
 import pygame.freetype as pgft
 
+from gromtector.score_frame import ScoreFrame
+
 
 def blit_text(
     surface: pg.Surface, text: str, pos: Tuple[int, int], font: pgft.Font
@@ -37,6 +40,14 @@ def blit_text(
 
 
 class HudSystem(BaseSystem):
+    """
+    Renders the overlay text a few times a second into its own transparent
+    surface, which is put on the window every frame.
+    """
+
+    update_rate_hz: float = 5.0
+    hud_surface: pg.Surface = None
+
     font: pgft.SysFont = None
     default_font_size: int = 12
     dog_audio_status_font = None
@@ -48,20 +59,30 @@ class HudSystem(BaseSystem):
     times_max: float = 0.0
     times_min: float = 0.0
     sample_rate: int = 0
+    audio_sources: set = None
 
-    detected_classes: Sequence = []
+    latest_score_frame: ScoreFrame = None
     score_thredshold: float = 0.05
 
     dog_audio_active: bool = False
+    dog_audio_active_sources: set = None
     latest_event_dogbark_begin: datetime = None
     latest_event_dogbark_end: datetime = None
+    latest_event_dogbark_source: str = None
 
     last_trigger_classes: Sequence = (
         None  # classes that triggered the dog/bark detected event.
     )
+    system_stats: Sequence = None
 
     def init(self):
         self.last_trigger_classes = []
+        self.system_stats = []
+        self.hud_surface = pg.Surface(
+            self.get_app().window.window_surface.get_size(), pg.SRCALPHA
+        )
+        self.audio_sources = set()
+        self.dog_audio_active_sources = set()
 
         txt_color = (0xFF, 0xFF, 0xFF)
         self.font = pgft.SysFont(pgft.get_default_font(), size=self.default_font_size)
@@ -80,6 +101,10 @@ class HudSystem(BaseSystem):
         evt_mgr.add_listener("dog_bark_begin", self.recv_dog_bark_detected)
         evt_mgr.add_listener("dog_bark_end", self.recv_dog_bark_detected)
         evt_mgr.add_listener("audio_event_dogbark", self.recv_highlvl_audio_evt)
+        evt_mgr.add_listener("system_stats", self.recv_system_stats)
+
+    def recv_system_stats(self, event_type, stats):
+        self.system_stats = stats
 
     def receive_app_fps(self, event_type, event):
         self.app_fps = event
@@ -93,36 +118,60 @@ class HudSystem(BaseSystem):
 
     def receive_audio_data(self, event_type, new_audio_data):
         self.sample_rate = new_audio_data.rate
+        self.audio_sources.add(new_audio_data.source)
 
-    def recev_detected_classes(self, event_type, event):
-        detected_classes = event["classes"]
-        detected_classes = [
-            dc for dc in detected_classes if dc["score"] > self.score_thredshold
-        ]
-        detected_classes = sorted(
-            detected_classes, key=lambda dc: dc["score"], reverse=True
-        )
-        self.detected_classes = detected_classes
+    def recev_detected_classes(self, event_type, frame: ScoreFrame):
+        # Only keep the frame, the labels are looked up when drawing.
+        self.latest_score_frame = frame
+
+    def get_top_detected_classes(self) -> Sequence:
+        frame = self.latest_score_frame
+        if frame is None:
+            return []
+        top = frame.top_indices[frame.top_scores > self.score_thredshold]
+        top = top[np.argsort(-frame.scores[top], kind="stable")]
+        return frame.classes(top)
 
     def recv_dog_bark_detected(self, event_type, evt):
-        self.dog_audio_active = event_type == "dog_bark_begin"
         if event_type == "dog_bark_begin":
+            self.dog_audio_active_sources.add(evt["source"])
             self.last_trigger_classes = evt["detected_classes"]
+        else:
+            self.dog_audio_active_sources.discard(evt["source"])
+        self.dog_audio_active = bool(self.dog_audio_active_sources)
 
     def recv_highlvl_audio_evt(self, event_type, evt: dict):
         if event_type == "audio_event_dogbark":
             self.latest_event_dogbark_begin = evt["begin_timestamp"]
             self.latest_event_dogbark_end = evt["end_timestamp"]
+            self.latest_event_dogbark_source = evt["source"]
+
+    def draw(self) -> None:
+        self.get_app().window.window_surface.blit(self.hud_surface, (0, 0))
 
     def update(self, elapsed_time_ms: int) -> None:
-        render_surface = self.get_app().window.window_surface
+        render_surface = self.hud_surface
+        render_surface.fill((0, 0, 0, 0))
         offset_margin = 4
 
+        if self.system_stats:
+            self.font.render_to(
+                surf=render_surface,
+                dest=(0, render_surface.get_height() - self.default_font_size),
+                text="SYSTEMS: "
+                + "  ".join(
+                    "{} {:.0f}Hz {:.1f}ms".format(
+                        st["name"].replace("System", ""), st["rate_hz"], st["avg_ms"]
+                    )
+                    for st in self.system_stats
+                ),
+            )
+
         fps_rect = self.font.render_to(
             surf=render_surface,
             dest=(0, 0),
-            text="FPS: {:.2f}  ORIGINAL SAMPLE RATE: {}".format(
-                self.app_fps, self.sample_rate
+            text="FPS: {:.2f}  ORIGINAL SAMPLE RATE: {}  SOURCES: {}".format(
+                self.app_fps, self.sample_rate, len(self.audio_sources)
             ),
         )
 
@@ -144,7 +193,7 @@ class HudSystem(BaseSystem):
         detected_classes_txt = "TOP DETECTED:\n" + "\n".join(
             [
                 "{} ({:.3f})".format(dcls["label"], dcls["score"])
-                for dcls in self.detected_classes
+                for dcls in self.get_top_detected_classes()
             ]
         )
         detected_clses_rect = blit_text(
@@ -184,7 +233,8 @@ class HudSystem(BaseSystem):
             # DT_FORMAT =
             blit_text(
                 render_surface,
-                "LAST:\n{}\n{}\n{}".format(
+                "LAST ({}):\n{}\n{}\n{}".format(
+                    self.latest_event_dogbark_source,
                     self.latest_event_dogbark_begin.astimezone(tz=None),
                     self.latest_event_dogbark_end.astimezone(tz=None),
                     trigger_classes_txt,
@@ -0,0 +1,144 @@
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import tracemalloc
+from typing import Optional
+
+from .BaseSystem import BaseSystem
+
+logger = logging.getLogger(__name__)
+
+
+def get_rss_bytes(pid: Optional[int] = None) -> int:
+    """
+    Resident set size of the process `pid` (this one by default). Falls back to
+    this process's peak RSS where there is no `/proc`, and 0 on Windows.
+    """
+    try:
+        with open("/proc/{}/statm".format(pid or "self")) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if pid is not None:
+            return 0
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS.
+    return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+class MemoryDiagnosticsSystem(BaseSystem):
+    """
+    Samples the process RSS, the top tracemalloc allocation sites and what every
+    system reports through `get_memory_stats()` each `--memory-interval` seconds,
+    to find out which part of the app grows on long runs.
+
+    Every sample is logged, queued as a `memory_stats` event and appended as one
+    JSON line to the `--memory-report` timeline. Allocation sites are ranked by
+    their growth since the previous sample. tracemalloc only sees Python
+    allocations (numpy buffers included), native ones like TensorFlow's only show
+    in the RSS.
+    """
+
+    update_rate_hz: float = 1 / 30
+    main_thread: bool = False
+
+    report_path: str = None
+    report_file = None
+    tracemalloc_frames: int = 1
+    top_sites: int = 10
+    started_tracemalloc: bool = False
+    last_snapshot: tracemalloc.Snapshot = None
+    first_rss_bytes: int = None
+
+    def init(self) -> None:
+        configs = self.get_config()
+        if configs.get("--memory-interval"):
+            self.update_rate_hz = 1 / float(configs["--memory-interval"])
+        self.report_path = configs.get("--memory-report")
+        if self.report_path:
+            self.report_file = open(self.report_path, "a")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self.started_tracemalloc = True
+
+    def shutdown(self) -> None:
+        self.sample()
+        if self.report_file is not None:
+            self.report_file.close()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def update(self, elapsed_time_ms: int) -> None:
+        self.sample()
+
+    def sample(self) -> dict:
+        app = self.get_app()
+        rss_bytes = get_rss_bytes()
+        if self.first_rss_bytes is None:
+            self.first_rss_bytes = rss_bytes
+        traced_bytes, traced_peak_bytes = tracemalloc.get_traced_memory()
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        if self.last_snapshot is None:
+            top = snapshot.statistics("lineno")
+        else:
+            top = snapshot.compare_to(self.last_snapshot, "lineno")
+        self.last_snapshot = snapshot
+
+        stats = {
+            "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+            "rss_bytes": rss_bytes,
+            "traced_bytes": traced_bytes,
+            "traced_peak_bytes": traced_peak_bytes,
+            "app": app.get_memory_stats(),
+            "systems": {
+                sys.__class__.__name__: sys.get_memory_stats()
+                for sys in app.get_systems()
+            },
+            "top_sites": [
+                {
+                    "site": str(stat.traceback[0]),
+                    "size_bytes": stat.size,
+                    "size_diff_bytes": getattr(stat, "size_diff", stat.size),
+                    "count": stat.count,
+                }
+                for stat in top[: self.top_sites]
+            ],
+        }
+
+        logger.info(
+            "RSS %.1fMiB (%+.1fMiB since start), traced %.1fMiB, peak %.1fMiB.",
+            rss_bytes / 2 ** 20,
+            (rss_bytes - self.first_rss_bytes) / 2 ** 20,
+            traced_bytes / 2 ** 20,
+            traced_peak_bytes / 2 ** 20,
+        )
+        logger.info(
+            "Buffers: %s",
+            ", ".join(
+                "{}.{}={}".format(name, key, value)
+                for name, sys_stats in [("app", stats["app"])]
+                + list(stats["systems"].items())
+                for key, value in sys_stats.items()
+            ),
+        )
+        for site in stats["top_sites"][:3]:
+            logger.info(
+                "Allocations at %s: %.1fKiB (%+.1fKiB).",
+                site["site"],
+                site["size_bytes"] / 1024,
+                site["size_diff_bytes"] / 1024,
+            )
+
+        if self.report_file is not None:
+            self.report_file.write(json.dumps(stats) + "\n")
+            self.report_file.flush()
+        self.get_event_manager().queue_event("memory_stats", stats)
+        return stats
@@ -1,78 +1,269 @@
 from datetime import datetime, timezone
 import logging
-import threading
-import queue
+import time
 from collections import namedtuple
-import numpy as np
+from typing import Sequence
 
 from .BaseSystem import BaseSystem
 
-from gromtector.audio_mic import AudioMic, CallbackAudioMic
+from gromtector import tracing
+from gromtector.audio_mic import CallbackAudioMic, find_input_device, pick_sample_rate
 
 logger = logging.getLogger(__name__)
 
 
+MODEL_SAMPLE_RATE = 16000  # YAMNet's input rate, capturing at it skips resampling.
+
+
 InputAudioDataEvent = namedtuple(
-    "InputAudioDataEvent", ["data", "rate", "begin_timestamp"]
+    "InputAudioDataEvent",
+    ["data", "rate", "begin_timestamp", "source"],
+    defaults=["mic0"],
 )
 
 
+class MicSource:
+    """
+    One capture device, its loss accounting and its watchdog state. Each source's
+    PortAudio stream runs its own callback thread.
+    """
+
+    def __init__(
+        self, source: str, device: str, device_info: dict, mic: CallbackAudioMic
+    ):
+        self.source = source
+        self.device = device  # As given, to find the device again after a loss.
+        self.device_info = device_info
+        self.mic = mic
+        self.reported_dropped_frames = 0
+        self.reported_input_overflows = 0
+
+        self.last_data_time = time.monotonic()
+        self.lost_time: float = None  # Set while capture is down.
+        self.lost_timestamp: datetime = None
+        self.retry_time = 0.0
+        self.retry_backoff_s = 0.0
+        self.num_losses = 0
+        self.total_down_s = 0.0
+
+
 class AudioMicSystem(BaseSystem):
+    """
+    Streams live mic audio from one or more input devices. Each PortAudio callback
+    writes into its mic's ring buffer and `update()` drains whatever has accumulated
+    since the last frame, so there's no capture thread to poll the streams.
+
+    Every `new_audio_data` event is tagged with the id of the source ("mic0",
+    "mic1", ...) it came from, in the order the devices were given.
+
+    A watchdog checks every source each update. A stream that went inactive or
+    delivered nothing for `capture_stall_s` is lost: `capture_lost` is queued and
+    the device is looked up and reopened with an exponential backoff until it
+    works again, which queues `capture_restored` with how long capture was down.
+    Devices are found and mics created through `find_device()` and `create_mic()`.
+    """
+
+    sources: Sequence[MicSource] = None
+
+    capture_stall_s: float = 2.0
+    retry_min_backoff_s: float = 1.0
+    retry_max_backoff_s: float = 30.0
+
+    stats_interval_s: float = 10.0
+    stats_wall_time: float = 0.0
+    stats_cpu_time: float = 0.0
+
     def init(self):
-        self.mic = AudioMic(channels=1, sample_rate=44100)
-        self.mic.open()
-        self.running = True
-        self.audio_thread = None
-        self.audio_data_queue = queue.Queue()
+        configs = self.get_config()
+        devices = configs.get("--input-device") or [None]
+        if isinstance(devices, str):
+            devices = [devices]
 
-    def shutdown(self):
-        self.running = False
-        self.audio_thread.join()
-        self.mic.close()
+        self.sources = []
+        for idx, device in enumerate(devices):
+            device_info = self.find_device(device)
+            mic = self.create_mic(device_info)
+            mic.open()
+            source = MicSource("mic{}".format(idx), device, device_info, mic)
+            self.sources.append(source)
 
-    def update(self, elapsed_time_ms: int) -> None:
-        dataset = []
-        dataset_utcbegin = None
-        while not self.audio_data_queue.empty():
-            audio_raw, utc_begin = self.audio_data_queue.get()
-            if not dataset_utcbegin:
-                dataset_utcbegin = utc_begin
-            dataset.append(audio_raw)
-        if dataset:
-            data = np.concatenate(dataset)
-            self.get_event_manager().queue_event(
-                "new_audio_data",
-                InputAudioDataEvent(
-                    data=data,
-                    rate=self.mic.sample_rate,
-                    begin_timestamp=dataset_utcbegin,
-                ),
+            logger.info(
+                '%s: capturing from "%s" at %d Hz, %d frames per buffer, latency %.1fms%s.',
+                source.source,
+                device_info["name"],
+                mic.sample_rate,
+                mic.frames_per_buffer,
+                mic.latency_s * 1000,
+                " (no resampling needed)" if mic.sample_rate == MODEL_SAMPLE_RATE else "",
             )
-        pass
 
-    def run(self):
-        self.audio_thread = threading.Thread(
-            target=self.__class__.run_audio_mic_thread, args=(self,)
+        self.stats_wall_time = time.monotonic()
+        self.stats_cpu_time = time.process_time()
+
+    def find_device(self, device: str) -> dict:
+        return find_input_device(device)
+
+    def create_mic(self, device_info: dict) -> CallbackAudioMic:
+        configs = self.get_config()
+        sample_rate = configs.get("--sample-rate") or "auto"
+        if sample_rate == "auto":
+            sample_rate = pick_sample_rate(device_info, [MODEL_SAMPLE_RATE], channels=1)
+        else:
+            sample_rate = int(sample_rate)
+
+        frames_per_buffer = configs.get("--frames-per-buffer")
+        return CallbackAudioMic(
+            channels=1,
+            sample_rate=sample_rate,
+            frames_per_buffer=int(frames_per_buffer) if frames_per_buffer else None,
+            device_index=device_info["index"],
         )
-        self.audio_thread.start()
-
-    @classmethod
-    def run_audio_mic_thread(cls, system):
-        while system.running:
-            if not system.mic.stream.is_active():
-                logger.info("Audio mic is no longer active.")
-                break
-            if system.mic.stream.is_stopped():
-                logger.info("Audio mic stream has stopped.")
-                break
-            if hasattr(system.mic, "buffer") and not system.mic.buffer:
+
+    def shutdown(self):
+        for source in self.sources:
+            if source.lost_time is None:
+                source.mic.close()
+
+    def get_memory_stats(self) -> dict:
+        stats = {}
+        for source in self.sources:
+            ring = source.mic.ring
+            if ring is None:
+                continue
+            stats[source.source + "_ring_bytes"] = ring.buffer.nbytes
+            stats[source.source + "_ring_len"] = ring.available
+        return stats
+
+    def update(self, elapsed_time_ms: int) -> None:
+        evt_mgr = self.get_event_manager()
+        now = time.monotonic()
+        for source in self.sources:
+            if source.lost_time is not None:
+                if now >= source.retry_time:
+                    self.restore_capture(source, now)
                 continue
 
-            utcnow = datetime.now(tz=timezone.utc)
-            data = system.mic.read()
+            with tracing.span("capture.read", "audio", {"source": source.source}):
+                data, begin_timestamp = source.mic.drain()
             if data.size:
-                system.audio_data_queue.put((data, utcnow))
+                source.last_data_time = now
+                evt_mgr.queue_event(
+                    "new_audio_data",
+                    InputAudioDataEvent(
+                        data=data,
+                        rate=source.mic.sample_rate,
+                        begin_timestamp=begin_timestamp,
+                        source=source.source,
+                    ),
+                )
+            self.report_capture_losses(source)
+            self.check_capture(source, now)
+        self.report_capture_stats()
 
-            # logger.debug("Just read {} bytes of audio data.".format(len(data)))
+    def check_capture(self, source: MicSource, now: float) -> None:
+        if not source.mic.is_active():
+            reason = "stream inactive"
+        elif now - source.last_data_time > self.capture_stall_s:
+            reason = "no audio for {:.1f}s".format(now - source.last_data_time)
+        else:
+            return
 
-        logger.debug("Reaching the end of the audio mic thread.")
+        source.lost_time = now
+        source.lost_timestamp = datetime.now(tz=timezone.utc)
+        source.num_losses += 1
+        source.retry_backoff_s = self.retry_min_backoff_s
+        source.retry_time = now
+        source.mic.abandon()
+        logger.error("%s: capture lost (%s), reopening it.", source.source, reason)
+        self.get_event_manager().queue_event(
+            "capture_lost",
+            {
+                "source": source.source,
+                "reason": reason,
+                "timestamp": source.lost_timestamp,
+            },
+        )
+
+    def restore_capture(self, source: MicSource, now: float) -> None:
+        mic = None
+        try:
+            device_info = self.find_device(source.device)
+            mic = self.create_mic(device_info)
+            mic.open()
+        except Exception as e:
+            if mic is not None:
+                mic.abandon()
+            logger.warning(
+                "%s: cannot reopen capture (%s), retrying in %.0fs.",
+                source.source,
+                e,
+                source.retry_backoff_s,
+            )
+            source.retry_time = now + source.retry_backoff_s
+            source.retry_backoff_s = min(
+                source.retry_backoff_s * 2, self.retry_max_backoff_s
+            )
+            return
+
+        down_s = now - source.lost_time
+        source.total_down_s += down_s
+        source.device_info = device_info
+        source.mic = mic
+        source.reported_dropped_frames = 0
+        source.reported_input_overflows = 0
+        source.last_data_time = now
+        source.lost_time = None
+        logger.warning(
+            '%s: capture restored on "%s" after %.1fs (%d losses, %.1fs down in total).',
+            source.source,
+            device_info["name"],
+            down_s,
+            source.num_losses,
+            source.total_down_s,
+        )
+        self.get_event_manager().queue_event(
+            "capture_restored",
+            {
+                "source": source.source,
+                "lost_timestamp": source.lost_timestamp,
+                "timestamp": datetime.now(tz=timezone.utc),
+                "down_s": down_s,
+            },
+        )
+
+    def report_capture_stats(self) -> None:
+        now = time.monotonic()
+        wall_elapsed_s = now - self.stats_wall_time
+        if wall_elapsed_s < self.stats_interval_s:
+            return
+        cpu_now = time.process_time()
+        cpu_elapsed_s = cpu_now - self.stats_cpu_time
+        for source in self.sources:
+            logger.info(
+                "%s: capture %d Hz / %d frames per buffer, latency %.1fms.",
+                source.source,
+                source.mic.sample_rate,
+                source.mic.frames_per_buffer,
+                source.mic.latency_s * 1000,
+            )
+        logger.info("Process CPU %.1f%%.", 100.0 * cpu_elapsed_s / wall_elapsed_s)
+        self.stats_wall_time = now
+        self.stats_cpu_time = cpu_now
+
+    def report_capture_losses(self, source: MicSource) -> None:
+        mic = source.mic
+        if mic.dropped_frames != source.reported_dropped_frames:
+            logger.warning(
+                "%s: ring overrun, %d frames dropped so far (%d overruns).",
+                source.source,
+                mic.dropped_frames,
+                mic.overruns,
+            )
+            source.reported_dropped_frames = mic.dropped_frames
+        if mic.input_overflows != source.reported_input_overflows:
+            logger.warning(
+                "%s: input overflow/underflow reported %d times so far.",
+                source.source,
+                mic.input_overflows,
+            )
+            source.reported_input_overflows = mic.input_overflows
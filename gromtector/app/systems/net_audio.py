@@ -0,0 +1,268 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .BaseSystem import BaseSystem
+from .mic import InputAudioDataEvent
+
+from gromtector.net_audio import (
+    FRAME_HEADER,
+    FrameError,
+    JitterBuffer,
+    decode_frame,
+    decode_header,
+    decode_payload,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(
+    address: str, default_host: str = "0.0.0.0", default_port: int = 5005
+) -> Tuple[str, int]:
+    """
+    Parses "HOST:PORT", "HOST" or "PORT".
+    """
+    host, _, port = address.rpartition(":")
+    if not host:
+        if port.isdigit():
+            return default_host, int(port)
+        return port or default_host, default_port
+    return host, int(port)
+
+
+class RemoteSource:
+    """
+    One remote sensor stream: its jitter buffer and stream timeline.
+    """
+
+    def __init__(self, source: str, sample_rate: int, jitter_depth: int):
+        self.source = source
+        self.sample_rate = sample_rate
+        self.jitter = JitterBuffer(depth=jitter_depth)
+        self.begin_timestamp: datetime = None
+        self.num_samples = 0  # Samples released so far, silence for gaps included.
+        self.reported_gaps = 0
+        self.reported_resets = 0
+
+    def next_timestamp(self, num_samples: int) -> datetime:
+        if self.begin_timestamp is None:
+            self.begin_timestamp = datetime.now(tz=timezone.utc)
+        timestamp = self.begin_timestamp + timedelta(
+            seconds=self.num_samples / self.sample_rate
+        )
+        self.num_samples += num_samples
+        return timestamp
+
+
+class NetworkAudioSystem(BaseSystem):
+    """
+    Ingests framed PCM streams from remote sensors over TCP and UDP (see
+    `gromtector.net_audio`) and turns every stream into its own source of
+    `new_audio_data` events.
+
+    The asyncio server runs on its own thread; frames that come out of the per
+    source jitter buffers are handed to the main thread through a queue.
+    """
+
+    listen_host: str = "0.0.0.0"
+    listen_port: int = 5005
+    jitter_depth: int = 4
+
+    loop: asyncio.AbstractEventLoop = None
+    server_thread: threading.Thread = None
+    stop_future: asyncio.Future = None
+    audio_data_queue: queue.Queue = None
+    remote_sources: Dict[str, RemoteSource] = None
+
+    stats_interval_s: float = 10.0
+    stats_time: float = 0.0
+    stats_frames: int = 0
+    stats_max_loop_lag_s: float = 0.0
+
+    def init(self) -> None:
+        configs = self.get_config()
+        self.listen_host, self.listen_port = parse_address(configs["--listen"])
+        if configs.get("--jitter-frames"):
+            self.jitter_depth = int(configs["--jitter-frames"])
+        self.audio_data_queue = queue.Queue()
+        self.remote_sources = {}
+        self.loop = asyncio.new_event_loop()
+        self.stop_future = self.loop.create_future()
+        self.stats_time = time.monotonic()
+
+    def run(self) -> None:
+        self.server_thread = threading.Thread(
+            target=self.__class__.run_server_thread, args=(self,)
+        )
+        self.server_thread.start()
+
+    def shutdown(self) -> None:
+        self.loop.call_soon_threadsafe(self.stop_future.set_result, None)
+        if self.server_thread is not None:
+            self.server_thread.join()
+
+    def get_memory_stats(self) -> dict:
+        stats = {"audio_data_queue_len": self.audio_data_queue.qsize()}
+        for source_id, source in list(self.remote_sources.items()):
+            stats[source_id + "_jitter_len"] = len(source.jitter.pending)
+        return stats
+
+    def update(self, elapsed_time_ms: int) -> None:
+        evt_mgr = self.get_event_manager()
+        batches: Dict[str, list] = {}
+        while not self.audio_data_queue.empty():
+            source, samples = self.audio_data_queue.get()
+            batches.setdefault(source, []).append(samples)
+
+        for source_id, chunks in batches.items():
+            source = self.remote_sources[source_id]
+            data = np.concatenate(chunks)
+            evt_mgr.queue_event(
+                "new_audio_data",
+                InputAudioDataEvent(
+                    data=data,
+                    rate=source.sample_rate,
+                    begin_timestamp=source.next_timestamp(data.size),
+                    source=source_id,
+                ),
+            )
+            if source.jitter.gaps != source.reported_gaps:
+                logger.warning(
+                    "%s: %d sequence gaps, %d frames lost, %d late so far.",
+                    source_id,
+                    source.jitter.gaps,
+                    source.jitter.lost_frames,
+                    source.jitter.late_frames,
+                )
+                source.reported_gaps = source.jitter.gaps
+            if source.jitter.resets != source.reported_resets:
+                logger.warning(
+                    "%s: sequence restarted or jumped, %d stream resets so far.",
+                    source_id,
+                    source.jitter.resets,
+                )
+                source.reported_resets = source.jitter.resets
+
+        self.report_stats()
+
+    def report_stats(self) -> None:
+        now = time.monotonic()
+        elapsed_s = now - self.stats_time
+        if elapsed_s < self.stats_interval_s:
+            return
+        logger.info(
+            "Network audio: %d streams, %.1f frames/s, max event loop lag %.1fms.",
+            len(self.remote_sources),
+            self.stats_frames / elapsed_s,
+            self.stats_max_loop_lag_s * 1000,
+        )
+        self.stats_time = now
+        self.stats_frames = 0
+        self.stats_max_loop_lag_s = 0.0
+
+    def recv_frame(self, source_id: str, seq: int, sample_rate: int, samples) -> None:
+        """
+        Called on the server thread for every decoded frame.
+        """
+        source = self.remote_sources.get(source_id)
+        if source is None:
+            logger.info("New remote audio source %s at %d Hz.", source_id, sample_rate)
+            source = RemoteSource(source_id, sample_rate, self.jitter_depth)
+            self.remote_sources[source_id] = source
+        self.stats_frames += 1
+        for released in source.jitter.push(seq, samples):
+            self.audio_data_queue.put((source_id, released))
+
+    def end_stream(self, source_id: str) -> None:
+        """
+        Called on the server thread when the connection a source streamed over
+        goes away, so its last frames aren't held back until it reconnects.
+        """
+        source = self.remote_sources.get(source_id)
+        if source is None:
+            return
+        for released in source.jitter.flush():
+            self.audio_data_queue.put((source_id, released))
+
+    async def handle_tcp_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        peer = writer.get_extra_info("peername")
+        logger.debug("Sensor connected from %s.", peer)
+        sources = set()
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                codec, channels, sample_rate, seq, source, payload_size = decode_header(
+                    header
+                )
+                payload = await reader.readexactly(payload_size)
+                sources.add(source)
+                self.recv_frame(
+                    source, seq, sample_rate, decode_payload(codec, channels, payload)
+                )
+        except asyncio.IncompleteReadError:
+            pass
+        except FrameError as e:
+            logger.warning("Dropping sensor connection from %s: %s", peer, e)
+        finally:
+            writer.close()
+            for source in sources:
+                self.end_stream(source)
+        logger.debug("Sensor disconnected from %s.", peer)
+
+    async def monitor_loop_lag(self, interval_s: float = 0.1) -> None:
+        while True:
+            begin = time.monotonic()
+            await asyncio.sleep(interval_s)
+            lag_s = time.monotonic() - begin - interval_s
+            self.stats_max_loop_lag_s = max(self.stats_max_loop_lag_s, lag_s)
+
+    async def serve(self) -> None:
+        system = self
+
+        class UdpProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                try:
+                    frame = decode_frame(data)
+                except FrameError as e:
+                    logger.debug("Dropping datagram from %s: %s", addr, e)
+                    return
+                system.recv_frame(
+                    frame.source, frame.seq, frame.sample_rate, frame.samples
+                )
+
+        tcp_server = await asyncio.start_server(
+            self.handle_tcp_client, self.listen_host, self.listen_port
+        )
+        udp_transport, _ = await self.loop.create_datagram_endpoint(
+            UdpProtocol, local_addr=(self.listen_host, self.listen_port)
+        )
+        lag_task = self.loop.create_task(self.monitor_loop_lag())
+        logger.info(
+            "Listening for sensor audio on %s:%d (TCP and UDP).",
+            self.listen_host,
+            self.listen_port,
+        )
+
+        await self.stop_future
+
+        lag_task.cancel()
+        udp_transport.close()
+        tcp_server.close()
+        await tcp_server.wait_closed()
+
+    @classmethod
+    def run_server_thread(cls, system: NetworkAudioSystem) -> None:
+        asyncio.set_event_loop(system.loop)
+        system.loop.run_until_complete(system.serve())
+        system.loop.close()
+        logger.debug("Reaching the end of the network audio server thread.")
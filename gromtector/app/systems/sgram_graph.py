@@ -6,10 +6,13 @@ from .BaseSystem import BaseSystem
 
 
 class SpectrogramGraphSystem(BaseSystem):
+    update_rate_hz: float = 30.0
+
     Sxx = None
     freqs = None
     times = None
     palette = [(max((x - 128) * 2, 0), x, min(x * 2, 255)) for x in range(256)]
+    graph_surface: pg.Surface = None  # The latest graph, scaled to the window.
 
     def init(self):
         configs = self.get_config()
@@ -49,9 +52,11 @@ class SpectrogramGraphSystem(BaseSystem):
 
         render_surface = self.get_app().window.window_surface
         # target_surface = pg.transform.scale2x(target_surface)
-        target_surface = pg.transform.scale(
+        self.graph_surface = pg.transform.scale(
             target_surface,
             (render_surface.get_width(), render_surface.get_height()),
         )
-        
-        render_surface.blit(target_surface, (0, 0))
+
+    def draw(self) -> None:
+        if self.graph_surface is not None:
+            self.get_app().window.window_surface.blit(self.graph_surface, (0, 0))
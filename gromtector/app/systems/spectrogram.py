@@ -3,25 +3,74 @@ import numpy as np
 
 from .BaseSystem import BaseSystem
 
+from gromtector.features import STFT_HOP_SAMPLES, mel_center_frequencies
 from gromtector.spectrogram import get_spectrogram
+from gromtector.yamnet import MODEL_SAMPLE_RATE
 
 logger = logging.getLogger(__name__)
 
 
+DB_PER_LOG_UNIT = 20 / np.log(10)  # Natural log magnitude to amplitude dB.
+
+
 class SpectrogramSystem(BaseSystem):
+    """
+    Computes the spectrogram of the latest audio off the main thread. Each result
+    is published whole through the event queue, so readers always see a complete
+    spectrogram while the next one is computed.
+
+    With `--spectrogram=log-mel` there's no STFT here at all: the graph shows
+    log-mel frames the inference system computes with YAMNet's frontend settings
+    (see `new_log_mel_frames`), which is closer to what the model hears.
+    """
+
+    update_rate_hz: float = 30.0
+    main_thread: bool = False
+
     audio_data_buffer: np.ndarray = None
     sample_rate: int = None
     sample_interval_to_keep_s: float = 2.0
+    display_source: str = None  # Only the first input source seen is graphed.
+
+    log_mel: bool = False
+    log_mel_buffer: np.ndarray = None
+    log_mel_updated: bool = False
 
     def init(self):
         evt_mgr = self.get_event_manager()
-        evt_mgr.add_listener("new_audio_data", self.receive_audio_data)
+        self.log_mel = self.get_config().get("--spectrogram") == "log-mel"
+        if self.log_mel:
+            evt_mgr.add_listener("new_log_mel_frames", self.receive_log_mel_frames)
+        else:
+            evt_mgr.add_listener("new_audio_data", self.receive_audio_data)
         evt_mgr.add_listener("input_audio_data_ended", self.handle_input_audio_ended)
 
     def handle_input_audio_ended(self, event_type, evt):
         self.audio_data_buffer = None
+        self.log_mel_buffer = None
+
+    def receive_log_mel_frames(self, event_type, evt):
+        if self.display_source is None:
+            self.display_source = evt["source"]
+        elif evt["source"] != self.display_source:
+            return
+
+        if self.log_mel_buffer is None:
+            self.log_mel_buffer = evt["frames"]
+        else:
+            self.log_mel_buffer = np.concatenate([self.log_mel_buffer, evt["frames"]])
+        num_frames_to_keep = int(
+            self.sample_interval_to_keep_s * MODEL_SAMPLE_RATE / STFT_HOP_SAMPLES
+        )
+        self.log_mel_buffer = self.log_mel_buffer[-num_frames_to_keep:]
+        self.log_mel_updated = True
 
     def receive_audio_data(self, event_type, audio_mic_evt):
+        if self.display_source is None:
+            self.display_source = audio_mic_evt.source
+        elif audio_mic_evt.source != self.display_source:
+            return
+
         self.sample_rate = audio_mic_evt.rate
         if self.audio_data_buffer is None:
             self.audio_data_buffer = audio_mic_evt.data
@@ -34,18 +83,52 @@ class SpectrogramSystem(BaseSystem):
 
         # logger.debug("Received {} len of audio data.".format(len(audio_mic_data)))
 
+    def get_memory_stats(self) -> dict:
+        audio_data_buffer = self.audio_data_buffer
+        log_mel_buffer = self.log_mel_buffer
+        return {
+            "audio_data_buffer_bytes": (
+                audio_data_buffer.nbytes if audio_data_buffer is not None else 0
+            ),
+            "log_mel_buffer_bytes": (
+                log_mel_buffer.nbytes if log_mel_buffer is not None else 0
+            ),
+        }
+
     def update(self, elapsed_time_ms: int) -> None:
-        if self.audio_data_buffer is None:
+        if self.log_mel:
+            self.update_log_mel()
+            return
+
+        # The buffer is replaced, never modified, by the main thread.
+        audio_data_buffer = self.audio_data_buffer
+        if audio_data_buffer is None:
             return
 
         # logger.debug("{}ms elapsed.".format(elapsed_time_ms))
         nfft = 512
         noverlap = nfft // 2
         Sxx, freqs, times = get_spectrogram(
-            signal=self.audio_data_buffer,
+            signal=audio_data_buffer,
             rate=self.sample_rate,
             mod_spec=True,
         )
+        self.queue_spectrogram(Sxx, freqs, times)
+
+    def update_log_mel(self) -> None:
+        log_mel_buffer = self.log_mel_buffer
+        if log_mel_buffer is None or not self.log_mel_updated:
+            return
+        self.log_mel_updated = False
+        self.queue_spectrogram(
+            log_mel_buffer.T * DB_PER_LOG_UNIT,
+            mel_center_frequencies(),
+            np.arange(log_mel_buffer.shape[0]) * STFT_HOP_SAMPLES / MODEL_SAMPLE_RATE,
+        )
+
+    def queue_spectrogram(
+        self, Sxx: np.ndarray, freqs: np.ndarray, times: np.ndarray
+    ) -> None:
         self.get_event_manager().queue_event(
             "new_spectrogram_info",
             {
@@ -1,29 +1,192 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import queue
 import threading
 import time
-import zipfile
-from typing import Sequence
+from typing import Dict, List, Sequence, Tuple
 import numpy as np
-import tensorflow as tf
 import audiosegment as ad
-from sklearn.preprocessing import minmax_scale
 
 from .BaseSystem import BaseSystem
+from .memory_diagnostics import get_rss_bytes
+
+from gromtector import tracing
+from gromtector.features import (
+    NUM_MEL_BINS,
+    PATCH_FRAMES,
+    PATCH_HOP_FRAMES,
+    STFT_HOP_SAMPLES,
+    STFT_WINDOW_SAMPLES,
+    LogMelStream,
+)
+from gromtector.inference_process import InferenceProcess
+from gromtector.inference_server import InferenceClient, InferenceServerError
+from gromtector.score_frame import LabelTable, ScoreFrame
+from gromtector.yamnet import (
+    MODEL_SAMPLE_RATE,
+    PATCH_HOP_SAMPLES,
+    WINDOW_NUM_SAMPLES,
+    YamnetModel,
+    prepare_waveform,
+    resolve_backend,
+    select_backend,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+class AudioSourceBuffer:
+    """
+    The most recent model-rate audio of one input source.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.lock = threading.Lock()
+        self.raw_audio_buffer = b""
+        self.raw_audio_utc_begin: datetime = None
+        self.num_samples = 0  # Received so far, the buffer holds the tail.
+        self.log_mel: LogMelStream = None
+        self.log_mel_shown_until = 0  # Stream sample the displayed frames reach.
+        self.patches: PatchStream = None
+
+
+class ReplayStream:
+    """
+    Model-rate audio of one source during a replay, indexed by absolute sample
+    position so windows and timestamps only depend on the input.
+    """
+
+    def __init__(self, source: str, origin: datetime):
+        self.source = source
+        self.origin = origin  # Timestamp of sample 0.
+        self.buffer = np.zeros(0, dtype=np.int16)
+        self.num_samples = 0  # Samples received so far, the buffer holds the tail.
+        self.next_window_end: int = None
+
+
+class PatchStream:
+    """
+    Tracks which of the model's hop-aligned patches (0.975s windows every 0.48s,
+    counted from the source's first sample) have been scored, so every patch is
+    run through the model exactly once, and keeps the scores of the last
+    `history` patches.
+
+    Audio is pushed from the main thread and patches are taken from the inference
+    thread. With `use_frames` the patches are cut out of log-mel frames from the
+    shared frontend instead of being waveforms.
+    """
+
+    def __init__(self, history: int, use_frames: bool = False):
+        self.lock = threading.Lock()
+        self.use_frames = use_frames
+        self.pcm = np.zeros(0, dtype=np.int16)
+        self.pcm_begin = 0  # Stream sample index of `pcm[0]`.
+        self.frames = np.zeros((0, NUM_MEL_BINS), dtype=np.float32)
+        self.frames_begin = 0  # Stream frame index of `frames[0]`.
+        self.num_samples = 0
+        self.next_patch = 0
+        self.skipped_patches = 0
+        # Timestamp of a recent sample, to stamp patches through capture gaps.
+        self.anchor_sample = 0
+        self.anchor_timestamp: datetime = None
+
+        self.history = history
+        self.scores: np.ndarray = None  # `[history, classes]` ring.
+        self.num_scored = 0
+
+    def push(
+        self, pcm_int16: np.ndarray, begin_timestamp: datetime, frames: np.ndarray = None
+    ) -> None:
+        with self.lock:
+            self.anchor_sample = self.num_samples
+            self.anchor_timestamp = begin_timestamp
+            self.pcm = np.concatenate((self.pcm, pcm_int16))
+            self.num_samples += pcm_int16.size
+            if self.use_frames:
+                self.frames = np.concatenate((self.frames, frames))
+
+    def timestamp(self, sample: int) -> datetime:
+        return self.anchor_timestamp + timedelta(
+            seconds=(sample - self.anchor_sample) / MODEL_SAMPLE_RATE
+        )
+
+    def take_patches(self, max_backlog: int = None) -> List[Tuple[datetime, np.ndarray]]:
+        """
+        `(timestamp, model input)` of every patch completed since the last call,
+        stamped with the time of their newest hop. Only the newest `max_backlog`
+        are returned if inference fell further behind.
+        """
+        with self.lock:
+            if self.num_samples < WINDOW_NUM_SAMPLES:
+                return []
+            num_patches = 1 + (self.num_samples - WINDOW_NUM_SAMPLES) // PATCH_HOP_SAMPLES
+            first_patch = self.next_patch
+            if max_backlog is not None and num_patches - first_patch > max_backlog:
+                self.skipped_patches += num_patches - max_backlog - first_patch
+                first_patch = num_patches - max_backlog
+
+            patches = []
+            for patch in range(first_patch, num_patches):
+                begin = patch * PATCH_HOP_SAMPLES
+                if self.use_frames:
+                    frame = patch * PATCH_HOP_FRAMES - self.frames_begin
+                    model_input = self.frames[frame : frame + PATCH_FRAMES].copy()
+                else:
+                    model_input = prepare_waveform(
+                        self.pcm[
+                            begin - self.pcm_begin : begin
+                            - self.pcm_begin
+                            + WINDOW_NUM_SAMPLES
+                        ]
+                    )
+                patches.append(
+                    (
+                        self.timestamp(begin + WINDOW_NUM_SAMPLES - PATCH_HOP_SAMPLES),
+                        model_input,
+                    )
+                )
+            self.next_patch = num_patches
+
+            # Keep just what the next patches can still reach.
+            keep_sample = num_patches * PATCH_HOP_SAMPLES
+            self.pcm = self.pcm[keep_sample - self.pcm_begin :]
+            self.pcm_begin = keep_sample
+            keep_frame = num_patches * PATCH_HOP_FRAMES
+            self.frames = self.frames[max(0, keep_frame - self.frames_begin) :]
+            self.frames_begin = max(self.frames_begin, keep_frame)
+        return patches
+
+    def add_scores(self, scores: np.ndarray) -> None:
+        if self.scores is None:
+            self.scores = np.zeros((self.history, scores.size), dtype=np.float32)
+        self.scores[self.num_scored % self.history] = scores
+        self.num_scored += 1
+
+    def aggregate(self, method: str = "max") -> np.ndarray:
+        """
+        The max or mean scores over the last `history` patches.
+        """
+        scores = self.scores[: min(self.num_scored, self.history)]
+        return scores.max(axis=0) if method == "max" else scores.mean(axis=0)
+
+
 class BaseTfYamnetSystem(BaseSystem):
+    """
+    Keeps a separate audio buffer per input source and runs all of them through the
+    one loaded model, interleaving the sources each inference tick.
+    """
+
     audio_sample_width: int = 2
     model_path: str = None
-    model: tf.lite.Interpreter = None
+    model: YamnetModel = None
     model_sample_rate: int = 16000  # The model required audio sample rate.
     model_labels: Sequence[str] = None
-    raw_audio_buffer = b""
-    raw_audio_utc_begin: datetime = None
+    model_ready: bool = False  # Whether inference can run right now.
+    label_table: LabelTable = None
+    sources: Dict[str, AudioSourceBuffer] = None
 
     running: bool = False
     inference_thread: threading.Thread = None
@@ -31,173 +194,232 @@ class BaseTfYamnetSystem(BaseSystem):
     sleep: bool = True
     inference_max_fps: float = 10.0
 
+    replay: bool = False
+    replay_queue: queue.Queue = None
+    replay_max_queued_chunks: int = 64
+
+    log_mel_display: bool = False
+    model_log_mel: bool = False  # The display gets the model's own log-mel frames.
+
+    patch_inference: bool = False
+    patch_history: int = 2
+    patch_aggregate: str = "max"
+    uses_log_mel_patches: bool = False  # The model scores the shared frontend's patches.
+
+    def init_audio_input(self) -> None:
+        configs = self.get_config()
+        evt_mgr = self.get_event_manager()
+        evt_mgr.add_listener("new_audio_data", self._recv_audio_data)
+        self.log_mel_display = configs.get("--spectrogram") == "log-mel"
+
+        self.patch_inference = bool(configs.get("--patch-inference"))
+        if configs.get("--patch-history"):
+            self.patch_history = int(configs["--patch-history"])
+        if configs.get("--patch-aggregate"):
+            self.patch_aggregate = configs["--patch-aggregate"]
+        if self.patch_aggregate not in ("max", "mean"):
+            raise RuntimeError(
+                'Unknown patch aggregate "{}", use max or mean.'.format(
+                    self.patch_aggregate
+                )
+            )
+
+        self.replay = bool(self.get_config().get("--replay"))
+        if self.replay:
+            self.replay_queue = queue.Queue(maxsize=self.replay_max_queued_chunks)
+            evt_mgr.add_listener("input_audio_data_ended", self._recv_audio_data_ended)
+
     def shutdown(self):
         self.running = False
         if self.inference_thread is not None:
             self.inference_thread.join()
 
     def run(self):
-        self.inference_thread = threading.Thread(
-            target=self.__class__.run_inference_thread, args=(self,)
-        )
+        if self.replay:
+            target = self.__class__.run_replay_inference_thread
+        elif self.patch_inference:
+            target = self.__class__.run_patch_inference_thread
+        else:
+            target = self.__class__.run_inference_thread
+        self.inference_thread = threading.Thread(target=target, args=(self,))
         self.inference_thread.start()
 
-    def _recv_audio_data(self, event_type, audio_event) -> None:
-        self.raw_audio_utc_begin = audio_event.begin_timestamp
+    def get_memory_stats(self) -> dict:
+        stats = {
+            "audio_buffers_bytes": sum(
+                len(source.raw_audio_buffer)
+                for source in list((self.sources or {}).values())
+            )
+        }
+        if self.replay_queue is not None:
+            stats["replay_queue_len"] = self.replay_queue.qsize()
+        if self.patch_inference:
+            stats["patch_streams_bytes"] = sum(
+                source.patches.pcm.nbytes + source.patches.frames.nbytes
+                for source in self.get_patch_sources()
+            )
+        return stats
+
+    def infer_pcm(self, pcm_int16: np.ndarray):
+        """
+        Runs up to a second of model-rate audio through the model and returns
+        `(scores, top class indices)`.
+        """
+        raise NotImplementedError()
+
+    def infer_patch(self, model_input: np.ndarray) -> np.ndarray:
+        """
+        Scores one patch taken from a `PatchStream`: a float32 window, or a log-mel
+        patch if `uses_log_mel_patches`.
+        """
+        raise NotImplementedError()
+
+    def put_replay_data(self, replay_data) -> None:
+        # Blocks the main loop while inference is behind, which in turn holds the
+        # file reader back, so a replay never drops audio. Unless the inference
+        # thread has died, nothing would drain the queue then.
+        while self.running and self.inference_thread.is_alive():
+            try:
+                self.replay_queue.put(replay_data, timeout=0.5)
+                return
+            except queue.Full:
+                continue
 
-        audio_seg = ad.from_numpy_array(audio_event.data, framerate=audio_event.rate)
+    def _recv_audio_data_ended(self, event_type, event) -> None:
+        self.put_replay_data(None)
 
-        # resample the audio to rate needed by the model.
-        resampled_audio_seg = audio_seg.resample(
-            sample_rate_Hz=16000, sample_width=self.audio_sample_width, channels=1
-        )
-        if self.raw_audio_buffer is None:
-            self.raw_audio_buffer = resampled_audio_seg.seg.raw_data
+    def _recv_audio_data(self, event_type, audio_event) -> None:
+        if self.sources is None:
+            self.sources = {}
+        source = self.sources.get(audio_event.source)
+        if source is None:
+            source = AudioSourceBuffer(audio_event.source)
+            self.sources[audio_event.source] = source
+
+        source.raw_audio_utc_begin = audio_event.begin_timestamp
+
+        if audio_event.rate == self.model_sample_rate:
+            # Captured at the model rate already, nothing to resample.
+            raw_data = audio_event.data.astype(np.int16, copy=False).tobytes()
         else:
-            temp = self.raw_audio_buffer + resampled_audio_seg.seg.raw_data
-            self.raw_audio_buffer = temp[
+            audio_seg = ad.from_numpy_array(
+                audio_event.data, framerate=audio_event.rate
+            )
+
+            # resample the audio to rate needed by the model.
+            with tracing.span("resample", "audio", {"rate": audio_event.rate}):
+                resampled_audio_seg = audio_seg.resample(
+                    sample_rate_Hz=self.model_sample_rate,
+                    sample_width=self.audio_sample_width,
+                    channels=1,
+                )
+            raw_data = resampled_audio_seg.seg.raw_data
+        pcm_int16 = np.frombuffer(raw_data, dtype=np.int16)
+        frames = None
+        if (self.log_mel_display and not self.model_log_mel) or (
+            self.patch_inference and self.uses_log_mel_patches
+        ):
+            frames = self.push_log_mel_frames(source, pcm_int16)
+        if self.replay:
+            self.put_replay_data(
+                (audio_event.source, pcm_int16, audio_event.begin_timestamp, frames)
+            )
+            return
+        if self.patch_inference:
+            if source.patches is None:
+                source.patches = PatchStream(
+                    self.patch_history, use_frames=self.uses_log_mel_patches
+                )
+            source.patches.push(pcm_int16, audio_event.begin_timestamp, frames)
+            return
+
+        self.buffer_audio(source, raw_data)
+
+    def buffer_audio(self, source: AudioSourceBuffer, raw_data: bytes) -> None:
+        with source.lock:
+            temp = source.raw_audio_buffer + raw_data
+            source.raw_audio_buffer = temp[
                 -self.model_sample_rate * self.audio_sample_width :
             ]  # Only keep the most recent second of audio.
-
-
-class TfYamnetLiteSystem(BaseTfYamnetSystem):
-    """
-    Reference: https://tfhub.dev/google/lite-model/yamnet/classification/tflite/1
-    """
-
-    def init(self):
-        self.model_path = self.get_config().get("--tf-model", "model/")
-        logger.debug('Tensorflow model: "{}"'.format(self.model_path))
-        logger.debug("Loading model...")
-        self.model = tf.lite.Interpreter(self.model_path)
-        logger.debug("Loading model... DONE")
-
-        logger.debug("Loading model labels...")
-        labels_file = zipfile.ZipFile(self.model_path).open("yamnet_label_list.txt")
-        self.model_labels = [l.decode("utf-8").strip() for l in labels_file.readlines()]
-        logger.debug("Loading model labels... DONE")
-
-        logger.debug("Setting model stuff up...")
-        interpreter = self.model
-        self.input_details = interpreter.get_input_details()
-        self.waveform_input_index = self.input_details[0]["index"]
-        self.output_details = interpreter.get_output_details()
-        self.scores_output_index = self.output_details[0]["index"]
-        interpreter.allocate_tensors()
-        logger.debug("Setting model stuff up... DONE")
-
-        self.get_event_manager().add_listener("new_audio_data", self._recv_audio_data)
-
-        self.running = True
-
-    @classmethod
-    def run_inference_thread(cls, system: TfYamnetLiteSystem):
-        while system.running:
-            if not system.model or not system.model_labels:
-                logger.warning("Model not ready.")
-                continue
-
-            if not system.raw_audio_buffer:
-                continue
-
-            interpreter = system.model
-
-            pcm_int16 = np.frombuffer(system.raw_audio_buffer, dtype=np.int16)
-            num_samples = int(0.975 * system.model_sample_rate)
-            num_to_pad = num_samples - pcm_int16.size
-            if num_to_pad < 0:
-                num_to_pad = 0
-            num_to_pad += 2
-            waveform = np.pad(pcm_int16, (0, num_to_pad))
-            int16_iinfo = np.iinfo(np.int16)
-            waveform[-1] = int16_iinfo.max
-            waveform[-2] = int16_iinfo.min
-
-            waveform = waveform.astype(np.float32)
-            waveform = minmax_scale(waveform, feature_range=(-1, 1), copy=False)
-            waveform = waveform[:num_samples]
-
-            # interpreter.resize_tensor_input(
-            #     system.waveform_input_index, [waveform.size], strict=True
-            # )
-            # interpreter.allocate_tensors()
-            interpreter.set_tensor(system.waveform_input_index, waveform)
-            start = time.time()
-            interpreter.invoke()
-            scores = interpreter.get_tensor(system.scores_output_index)
-            end = time.time()
-
-            top_class_index = scores.argmax()
-            top_results = tf.math.top_k(scores, k=10)
-            top_class_indices = top_results.indices[0].numpy()
-            top_class_probs = top_results.values[0].numpy()
-            # logger.debug("Detected: {}".format(system.model_labels[top_class_index]))
-            # logger.debug(
-            #     "Detected (took {:.3f}s): {}".format(
-            #         (end - start),
-            #         ", ".join(
-            #             [
-            #                 "{} ({:.3f})".format(
-            #                     system.model_labels[idx], scores[0][idx]
-            #                 )
-            #                 for idx in top_class_indices
-            #             ]
-            #         ),
-            #     )
-            # )
-            system.get_event_manager().queue_event(
-                "detected_classes",
-                {
-                    "begin_timestamp": system.raw_audio_utc_begin,
-                    "classes": [
-                        {
-                            "label": system.model_labels[idx],
-                            "score": scores[0][idx],
-                        }
-                        for idx in top_class_indices
-                    ],
-                },
+            source.num_samples += len(raw_data) // self.audio_sample_width
+
+    def push_log_mel_frames(
+        self, source: AudioSourceBuffer, pcm_int16: np.ndarray
+    ) -> np.ndarray:
+        """
+        Runs the source's model-rate audio through a streaming copy of the YAMNet
+        log-mel frontend, a hop at a time, and returns the new frames for the
+        spectrogram display. Only backends that score log-mel patches
+        (`supports_patches`) infer from these frames too. When the model returns
+        the frames its own frontend computed (`model_log_mel`), the display gets
+        those instead and this isn't run.
+        """
+        if source.log_mel is None:
+            source.log_mel = LogMelStream()
+        frames = source.log_mel.push(prepare_waveform(pcm_int16))
+        if self.log_mel_display and frames.size:
+            self.get_event_manager().queue_event(
+                "new_log_mel_frames", {"source": source.source, "frames": frames}
             )
-
-        logger.debug("Reaching the end of the model inference thread.")
-
-
-class TfYamnetSavedmodelSystem(BaseTfYamnetSystem):
-    def init(self) -> None:
-        self.model_path = self.get_config().get("--tf-model", "model/")
-        logger.debug('Tensorflow model: "{}"'.format(self.model_path))
-        logger.debug("Loading model...")
-        self.model = tf.saved_model.load(self.model_path)
-        logger.debug("Loading model... DONE")
-
-        def class_names_from_csv(class_map_csv_text):
-            """Returns list of class names corresponding to score vector."""
-            import csv
-            import io
-
-            class_map_csv = io.StringIO(class_map_csv_text)
-            class_names = [
-                display_name
-                for (class_index, mid, display_name) in csv.reader(class_map_csv)
-            ]
-            class_names = class_names[1:]  # Skip CSV header
-            return class_names
-
-        class_map_path = self.model.class_map_path().numpy()
-        self.model_labels = class_names_from_csv(
-            tf.io.read_file(class_map_path).numpy().decode("utf-8")
+        return frames
+
+    def get_sources(self) -> Sequence[AudioSourceBuffer]:
+        """
+        Snapshot of the sources with buffered audio, safe to iterate on the inference
+        thread while new sources are being added.
+        """
+        if not self.sources:
+            return []
+        return [src for src in list(self.sources.values()) if src.raw_audio_buffer]
+
+    def get_patch_sources(self) -> Sequence[AudioSourceBuffer]:
+        if not self.sources:
+            return []
+        return [src for src in list(self.sources.values()) if src.patches is not None]
+
+    def queue_detected_classes(
+        self, source: str, begin_timestamp: datetime, scores, top_class_indices
+    ) -> None:
+        if self.label_table is None:
+            self.label_table = LabelTable(self.model_labels)
+        self.get_event_manager().queue_event(
+            "detected_classes",
+            ScoreFrame(
+                begin_timestamp=begin_timestamp,
+                source=source,
+                scores=np.asarray(scores, dtype=np.float32),
+                top_indices=np.asarray(top_class_indices, dtype=np.intp),
+                label_table=self.label_table,
+            ),
         )
 
-        self.get_event_manager().add_listener("new_audio_data", self._recv_audio_data)
+    def score_patches(
+        self,
+        source_id: str,
+        stream: PatchStream,
+        patches: Sequence[Tuple[datetime, np.ndarray]],
+    ) -> None:
+        for timestamp, model_input in patches:
+            with tracing.span("infer_patch", "inference", {"source": source_id}):
+                stream.add_scores(self.infer_patch(model_input))
+            scores = stream.aggregate(self.patch_aggregate)
+            self.queue_detected_classes(
+                source_id, timestamp, scores, np.argsort(-scores)[:10]
+            )
 
-        self.running = True
+    def infer_source(self, source: AudioSourceBuffer) -> None:
+        pcm_int16 = np.frombuffer(source.raw_audio_buffer, dtype=np.int16)
+        with tracing.span("infer", "inference", {"source": source.source}):
+            scores, top_class_indices = self.infer_pcm(pcm_int16)
+        self.queue_detected_classes(
+            source.source, source.raw_audio_utc_begin, scores, top_class_indices
+        )
 
     @classmethod
-    def run_inference_thread(cls, system: TfYamnetSavedmodelSystem):
+    def run_inference_thread(cls, system: BaseTfYamnetSystem):
         last_time = time.time()
         cumu_time_s = 0.
         while system.running:
-
             now_time = time.time()
             target_time_per_frame_s = 1.0 / system.inference_max_fps
             frame_time_so_far_s = now_time - last_time
@@ -209,72 +431,338 @@ class TfYamnetSavedmodelSystem(BaseTfYamnetSystem):
             else:
                 cumu_time_s -= target_time_per_frame_s
 
-            if not system.model or not system.model_labels:
+            if not system.model_ready or not system.model_labels:
                 logger.warning("Model not ready.")
                 continue
 
-            if not system.raw_audio_buffer:
+            for source in system.get_sources():
+                system.infer_source(source)
+
+        logger.debug("Reaching the end of the model inference thread.")
+
+    @classmethod
+    def run_patch_inference_thread(cls, system: BaseTfYamnetSystem):
+        """
+        Runs every patch of every source through the model once, as soon as it is
+        complete, and sleeps while there's none. A `detected_classes` frame is
+        queued per patch with the scores aggregated over the last `patch_history`
+        patches. Patches older than that are skipped if inference falls behind.
+        """
+        while system.running:
+            num_patches = 0
+            for source in system.get_patch_sources():
+                stream = source.patches
+                skipped_patches = stream.skipped_patches
+                patches = stream.take_patches(max_backlog=system.patch_history)
+                if stream.skipped_patches != skipped_patches:
+                    logger.warning(
+                        "%s: inference fell behind, %d patches skipped so far.",
+                        source.source,
+                        stream.skipped_patches,
+                    )
+                system.score_patches(source.source, stream, patches)
+                num_patches += len(patches)
+            if not num_patches:
+                time.sleep(1.0 / system.inference_max_fps)
+
+        logger.debug("Reaching the end of the patch inference thread.")
+
+    @classmethod
+    def run_replay_inference_thread(cls, system: BaseTfYamnetSystem):
+        """
+        Scores every source on a fixed hop (`model_sample_rate / inference_max_fps`
+        samples) over the last second of audio, like the live loop does on average
+        but independent of how fast the audio arrives. Frames are stamped with the
+        stream time of their newest hop, and `inference_ended` is queued once the
+        input has ended and every window has been scored.
+
+        With `patch_inference` the model's own patches are scored instead, each
+        one once, like the live patch loop does.
+        """
+        hop = int(system.model_sample_rate / system.inference_max_fps)
+        window = system.model_sample_rate
+        streams: Dict[str, ReplayStream] = {}
+        patch_streams: Dict[str, PatchStream] = {}
+
+        while system.running:
+            try:
+                replay_data = system.replay_queue.get(timeout=0.5)
+            except queue.Empty:
                 continue
+            if replay_data is None:
+                system.get_event_manager().queue_event("inference_ended", None)
+                break
+
+            source_id, pcm_int16, begin_timestamp, frames = replay_data
+            if system.patch_inference:
+                patch_stream = patch_streams.get(source_id)
+                if patch_stream is None:
+                    patch_stream = PatchStream(
+                        system.patch_history, use_frames=system.uses_log_mel_patches
+                    )
+                    patch_streams[source_id] = patch_stream
+                patch_stream.push(pcm_int16, begin_timestamp, frames)
+                system.score_patches(
+                    source_id, patch_stream, patch_stream.take_patches()
+                )
+                continue
+
+            stream = streams.get(source_id)
+            if stream is None:
+                stream = ReplayStream(source_id, begin_timestamp)
+                stream.next_window_end = hop
+                streams[source_id] = stream
+            stream.buffer = np.concatenate((stream.buffer, pcm_int16))
+            stream.num_samples += pcm_int16.size
+
+            while stream.next_window_end <= stream.num_samples:
+                # Buffer index of the window end.
+                end = stream.buffer.size - (stream.num_samples - stream.next_window_end)
+                scores, top_class_indices = system.infer_pcm(
+                    stream.buffer[max(0, end - window) : end]
+                )
+                system.queue_detected_classes(
+                    source_id,
+                    stream.origin
+                    + timedelta(
+                        seconds=(stream.next_window_end - hop) / system.model_sample_rate
+                    ),
+                    scores,
+                    top_class_indices,
+                )
+                stream.next_window_end += hop
+            # Keep just what the next windows can still reach.
+            stream.buffer = stream.buffer[-window:]
+
+        logger.debug("Reaching the end of the replay inference thread.")
+
+
+class TfYamnetLocalSystem(BaseTfYamnetSystem):
+    """
+    Runs the model in this process on the backend picked by `--backend` (see
+    `gromtector.yamnet.select_backend`).
+    """
+
+    def init(self) -> None:
+        self.model_path = self.get_config().get("--tf-model")
+        self.model = select_backend(self.get_config().get("--backend"), self.model_path)
+        self.model_labels = self.model.labels
+        self.uses_log_mel_patches = self.model.supports_patches
+        self.model_ready = True
+
+        self.init_audio_input()
+        # Only the live window loop keeps track of where its windows lie in the
+        # stream, the patch and replay loops show the NumPy frontend's frames.
+        self.model_log_mel = (
+            self.log_mel_display
+            and self.model.provides_log_mel
+            and not self.patch_inference
+            and not self.replay
+        )
+
+        self.running = True
+
+    def infer_pcm(self, pcm_int16: np.ndarray):
+        scores, _ = self.model.infer(prepare_waveform(pcm_int16, WINDOW_NUM_SAMPLES))
+        return scores, np.argsort(-scores)[:10]
+
+    def infer_source(self, source: AudioSourceBuffer) -> None:
+        if not self.model_log_mel:
+            super().infer_source(source)
+            return
+        with source.lock:
+            pcm_int16 = np.frombuffer(source.raw_audio_buffer, dtype=np.int16)
+            end_sample = source.num_samples
+        with tracing.span("infer", "inference", {"source": source.source}):
+            scores, _, log_mel = self.model.infer_with_log_mel(
+                prepare_waveform(pcm_int16, WINDOW_NUM_SAMPLES)
+            )
+        self.queue_model_log_mel_frames(
+            source, end_sample - pcm_int16.size, pcm_int16.size, log_mel
+        )
+        self.queue_detected_classes(
+            source.source, source.raw_audio_utc_begin, scores, np.argsort(-scores)[:10]
+        )
+
+    def queue_model_log_mel_frames(
+        self,
+        source: AudioSourceBuffer,
+        window_begin: int,
+        num_samples: int,
+        log_mel: np.ndarray,
+    ) -> None:
+        """
+        Queues the frames of a window, beginning at stream sample `window_begin`,
+        that the display hasn't got yet. Windows overlap, so only the frames past
+        the last ones shown are new; frames over the silence a short window was
+        padded with are left for a later window.
+        """
+        num_audio_samples = min(num_samples, WINDOW_NUM_SAMPLES)
+        if num_audio_samples < STFT_WINDOW_SAMPLES:
+            return
+        # First frame starting at or after the last shown one's hop, rounded up.
+        first = max(
+            0, -(-(source.log_mel_shown_until - window_begin) // STFT_HOP_SAMPLES)
+        )
+        end = min(
+            log_mel.shape[0],
+            1 + (num_audio_samples - STFT_WINDOW_SAMPLES) // STFT_HOP_SAMPLES,
+        )
+        if first >= end:
+            return
+        source.log_mel_shown_until = window_begin + end * STFT_HOP_SAMPLES
+        self.get_event_manager().queue_event(
+            "new_log_mel_frames",
+            {"source": source.source, "frames": log_mel[first:end]},
+        )
+
+    def infer_patch(self, model_input: np.ndarray) -> np.ndarray:
+        if self.uses_log_mel_patches:
+            return self.model.infer_patch(model_input)
+        return self.model.infer(model_input)[0]
+
+
+class TfYamnetRemoteSystem(BaseTfYamnetSystem):
+    """
+    Sends the audio to a `gromtector serve` inference server instead of loading
+    the model in this process, so several capture nodes can share one warm model.
+
+    The server has to be up at startup. If it goes away later (an error, a timeout,
+    a restart), the connection is dropped and the request retried on a new one,
+    backing off between attempts, so inference resumes once the server is back.
+    """
+
+    server_address: str = None
+    client: InferenceClient = None
+    reconnect_min_s: float = 0.5
+    reconnect_max_s: float = 30.0
+
+    def init(self) -> None:
+        self.server_address = self.get_config()["--inference-server"]
+        logger.debug(
+            'Connecting to inference server "{}"...'.format(self.server_address)
+        )
+        self.client = InferenceClient(self.server_address)
+        self.model_labels = self.client.get_labels()
+        self.model_ready = True
+        logger.debug(
+            'Connecting to inference server "{}"... DONE'.format(self.server_address)
+        )
+
+        self.init_audio_input()
+
+        self.running = True
+
+    def shutdown(self):
+        super().shutdown()
+        if self.client is not None:
+            self.client.close()
+
+    def classify(self, waveform: np.ndarray):
+        delay_s = self.reconnect_min_s
+        while True:
+            try:
+                if self.client is None:
+                    self.client = InferenceClient(self.server_address)
+                    logger.info(
+                        'Reconnected to inference server "%s".', self.server_address
+                    )
+                    self.model_ready = True
+                return self.client.classify(waveform, top_k=10, full_scores=True)
+            except (InferenceServerError, OSError) as e:
+                if self.client is not None:
+                    # A late response would be read as the next one's, start over.
+                    self.client.close()
+                    self.client = None
+                    self.model_ready = False
+                if not self.running:
+                    raise
+                logger.warning(
+                    'Inference server "%s" failed (%s), retrying in %.1fs.',
+                    self.server_address,
+                    e,
+                    delay_s,
+                )
+            deadline = time.monotonic() + delay_s
+            while self.running and time.monotonic() < deadline:
+                time.sleep(0.1)
+            delay_s = min(delay_s * 2, self.reconnect_max_s)
+
+    def infer_pcm(self, pcm_int16: np.ndarray):
+        result = self.classify(prepare_waveform(pcm_int16, WINDOW_NUM_SAMPLES))
+        return result.scores, result.top_indices
+
+    def infer_patch(self, model_input: np.ndarray) -> np.ndarray:
+        return self.classify(model_input).scores
+
+
+class TfYamnetProcessSystem(BaseTfYamnetSystem):
+    """
+    Runs the model in a supervised child process (see `gromtector.inference_process`)
+    so inference and its preprocessing never hold this process's GIL. Model-rate
+    audio is handed over through shared memory rings and the inference thread here
+    only waits on the results pipe.
+    """
+
+    inference_process: InferenceProcess = None
+
+    def init(self) -> None:
+        # Auto selection runs here once, not in every (re)started child.
+        backend, self.model_path, num_threads = resolve_backend(
+            self.get_config().get("--backend"), self.get_config()["--tf-model"]
+        )
+        logger.debug("Starting the inference process...")
+        self.inference_process = InferenceProcess(
+            self.model_path,
+            max_fps=self.inference_max_fps,
+            backend=backend,
+            num_threads=num_threads,
+        )
+        self.inference_process.start()
+        self.model_labels = self.inference_process.labels
+        self.model_ready = True
+        logger.debug("Starting the inference process... DONE")
+
+        self.init_audio_input()
+
+        self.running = True
 
-            pcm_int16 = np.frombuffer(system.raw_audio_buffer, dtype=np.int16)
-            num_samples = int(0.975 * system.model_sample_rate)
-
-            # Pad the waveform to the model required sample length + 2 so we can
-            # add the integer min and max to make sure scaling is relative to the
-            # the type min/max.
-            num_to_pad = num_samples - pcm_int16.size
-            if num_to_pad < 0:
-                num_to_pad = 0
-            num_to_pad += 2
-            waveform = np.pad(pcm_int16, (0, num_to_pad))
-            int16_iinfo = np.iinfo(np.int16)
-            waveform[-1] = int16_iinfo.max
-            waveform[-2] = int16_iinfo.min
-
-            waveform = waveform.astype(np.float32)
-            waveform = minmax_scale(waveform, feature_range=(-1, 1), copy=False)
-            waveform = waveform[:-2]
-
-            # Run the model, check the output.
-            start = time.time()
-            scores, embeddings, log_mel_spectrogram = system.model(waveform)
-            end = time.time()
-            scores.shape.assert_is_compatible_with([None, 521])
-            embeddings.shape.assert_is_compatible_with([None, 1024])
-            log_mel_spectrogram.shape.assert_is_compatible_with([None, 64])
-            scores_max = tf.reduce_max(scores, axis=0)
-
-            top_results = tf.math.top_k(scores_max, k=10)
-            top_class_indices = top_results.indices.numpy()
-            top_class_probs = top_results.values.numpy()
-            # logger.debug("Detected: {}".format(system.model_labels[top_class_index]))
-            # logger.debug(
-            #     "Detected (took {:.3f}s): {}".format(
-            #         (end - start),
-            #         ", ".join(
-            #             [
-            #                 "{} ({:.3f})".format(
-            #                     system.model_labels[idx], scores_max[idx]
-            #                 )
-            #                 for idx in top_class_indices
-            #             ]
-            #         ),
-            #     )
-            # )
-            system.get_event_manager().queue_event(
-                "detected_classes",
-                {
-                    "begin_timestamp": system.raw_audio_utc_begin,
-                    "classes": [
-                        {
-                            "label": system.model_labels[idx],
-                            "score": scores_max[idx],
-                        }
-                        for idx in top_class_indices
-                    ],
-                },
+    def shutdown(self):
+        super().shutdown()
+        self.inference_process.stop()
+
+    def get_memory_stats(self) -> dict:
+        stats = super().get_memory_stats()
+        stats["shared_rings_bytes"] = sum(
+            ring.shm.size for ring in list(self.inference_process.rings.values())
+        )
+        process = self.inference_process.process
+        if process is not None and process.pid is not None:
+            # The model's memory lives in the child.
+            stats["inference_process_rss_bytes"] = get_rss_bytes(process.pid)
+        return stats
+
+    def buffer_audio(self, source: AudioSourceBuffer, raw_data: bytes) -> None:
+        self.inference_process.write(
+            source.source, np.frombuffer(raw_data, dtype=np.int16)
+        )
+
+    @classmethod
+    def run_inference_thread(cls, system: TfYamnetProcessSystem):
+        while system.running:
+            result = system.inference_process.recv_result(timeout_s=0.5)
+            if result is None:
+                continue
+            source_id, scores, top_class_indices = result
+            system.queue_detected_classes(
+                source_id,
+                system.sources[source_id].raw_audio_utc_begin,
+                scores,
+                top_class_indices,
             )
 
+        logger.debug("Reaching the end of the model inference thread.")
+
 
 class TfYamnetSystem(BaseSystem):
     """
@@ -284,13 +772,20 @@ class TfYamnetSystem(BaseSystem):
     _system: BaseSystem = None
 
     def init(self) -> None:
-        model_path = self.get_config()["--tf-model"]
-        if model_path.endswith("tflite"):
-            self._system = TfYamnetLiteSystem(
+        if self.get_config().get("--inference-server"):
+            self._system = TfYamnetRemoteSystem(
+                app=self.get_app(), config=self.get_config()
+            )
+        elif (
+            self.get_config().get("--inference-process")
+            and not self.get_config().get("--replay")
+            and not self.get_config().get("--patch-inference")
+        ):
+            self._system = TfYamnetProcessSystem(
                 app=self.get_app(), config=self.get_config()
             )
         else:
-            self._system = TfYamnetSavedmodelSystem(
+            self._system = TfYamnetLocalSystem(
                 app=self.get_app(), config=self.get_config()
             )
         return self._system.init()
@@ -298,18 +793,8 @@ class TfYamnetSystem(BaseSystem):
     def shutdown(self) -> None:
         self._system.shutdown()
 
-    def recv_audio_data(self, event_type, audio_event) -> None:
-        audio_seg = ad.from_numpy_array(audio_event.data, framerate=audio_event.rate)
-
-        # resample the audio to rate needed by the model.
-        resampled_audio_seg = audio_seg.resample(
-            sample_rate_Hz=16000, sample_width=2, channels=1
-        )
-        if self.raw_audio_buffer is None:
-            self.raw_audio_buffer = resampled_audio_seg.seg.raw_data
-        else:
-            temp = self.raw_audio_buffer + resampled_audio_seg.seg.raw_data
-            self.raw_audio_buffer = temp[-self.model_sample_rate :]
+    def get_memory_stats(self) -> dict:
+        return self._system.get_memory_stats()
 
     def run(self) -> None:
         self._system.run()
@@ -3,47 +3,129 @@ gromtector
 
 Usage:
   gromtector
-    [--file=<INPUT_FILE>]
-    [--tf-model=<MODEL_PATH>] [--graph-palette=<GRAPH_PALETTE>]
+    [--file=<INPUT_FILE> [--file-start=<SEC>] [--replay [--replay-speed=<X>]] | --listen=<ADDR> [--jitter-frames=<JF>]]
+    [--input-device=<DEV>...] [--sample-rate=<RATE>] [--frames-per-buffer=<FPB>]
+    [--tf-model=<MODEL_PATH> [--backend=<BACKEND>] [--inference-process] | --inference-server=<ADDR>]
+    [--patch-inference [--patch-history=<N>] [--patch-aggregate=<AGG>]]
+    [--graph-palette=<GRAPH_PALETTE>] [--spectrogram=<MODE>]
     [--dog-class-threshold=<DCTH> --dog-audio-class-threshold=<DACTH>]
     [--bark-response-audio=<BARKRA>... --bark-notify-email=<BARKNE> --gmail-app-pw=<GMAIL_PW>]
+    [--clip-dir=<CLIP_DIR> [--clip-format=<FMT>] [--clip-pre-roll=<SEC>] [--clip-post-roll=<SEC>]]
+    [--db=<DB_PATH>]
+    [--archive-dir=<DIR> [--archive-segment=<SEC>] [--archive-days=<DAYS>] [--archive-max-mb=<MB>]]
+    [--config=<CONFIG_FILE>]
+    [--memory-report=<JSONL>] [--memory-interval=<SEC>]
+    [--trace=<JSON>]
     [--max-fps=<MAX_FPS>] [--log-level=<log_lvl>]
-  gromtector extract <AUDIO_PATH> [--log-level=<log_lvl>]
+  gromtector extract <AUDIO_PATH> [--extensions=<EXTS>] [--jobs=<N>] [--feature-cache] [--log-level=<log_lvl>]
+  gromtector evaluate <LABELS_CSV> [--tf-model=<MODEL_PATH>] [--scores=<NPZ>] [--rescore] [--grid-step=<STEP>] [--top=<N>] [--output=<CSV>] [--log-level=<log_lvl>]
+  gromtector report --db=<DB_PATH> [--since=<DATE>] [--until=<DATE>] [--source=<SRC>] [--by=<BUCKET>] [--top=<N>] [--log-level=<log_lvl>]
+  gromtector archive-export --archive-dir=<DIR> --since=<DATE> --until=<DATE> [--source=<SRC>] --output=<WAV> [--log-level=<log_lvl>]
+  gromtector serve --tf-model=<MODEL_PATH> [--backend=<BACKEND>] [--serve-address=<ADDR>] [--max-batch=<N>] [--max-delay-ms=<MS>] [--log-level=<log_lvl>]
+  gromtector bench-inference --tf-model=<MODEL_PATH> [--seconds=<SEC>] [--log-level=<log_lvl>]
+  gromtector fake-sensor <ADDR> [--streams=<N>] [--seconds=<SEC>] [--udp] [--codec=<CODEC>] [--file=<INPUT_FILE>] [--log-level=<log_lvl>]
+  gromtector --list-devices
   gromtector -h | --help
 
 Options:
   --file=<INPUT_FILE>       Input audio/video file path. The app runs on the input file instead of streaming audio from a live mic.
+  --file-start=<SEC>                    Start the input file from this many seconds in [default: 0].
+  --replay                              Run the input file through detection as fast as possible on its own stream time, without playing it, and exit once done. Needs a model.
+  --replay-speed=<X>                    Replay at X times real time instead, 0 for as fast as possible [default: 0].
+  --extensions=<EXTS>                   Comma separated extensions of the files to extract audio from, searched recursively [default: m4a,mp4].
+  --jobs=<N>                            Number of extract processes, 0 for one per CPU core [default: 0].
+  --feature-cache                       Also cache each extracted WAV's model waveform and log-mel frames as memory-mappable .npy files.
+  --listen=<ADDR>                       Ingest audio streamed by remote sensors on [HOST:]PORT (TCP and UDP) instead of a local mic.
+  --jitter-frames=<JF>                  Frames to hold per sensor stream to reorder late network frames [default: 4].
+  --streams=<N>                         Number of concurrent fake sensor streams [default: 1].
+  --seconds=<SEC>                       How long the fake sensors stream, or each inference benchmark runs, for [default: 10].
+  --udp                                 Stream fake sensor audio over UDP instead of TCP.
+  --codec=<CODEC>                       Fake sensor payload codec, "pcm" or "zlib" [default: pcm].
+  --input-device=<DEV>                  Mic input device index or name, see --list-devices. Repeat it to capture from several mics at once, each one becomes its own source (mic0, mic1, ...) sharing the one model. Uses the default input device if not given.
+  --sample-rate=<RATE>                  Mic capture rate in Hz. "auto" captures at the model's 16kHz when the device supports it [default: auto].
+  --frames-per-buffer=<FPB>             Mic frames per capture callback [default: 1024].
+  --list-devices                        List the available audio input devices.
   --tf-model=<MODEL_PATH>   Tensorflow audio classification model path.
+  --backend=<BACKEND>                   Inference backend, "tflite", "savedmodel", "stub" (deterministic NumPy stand-in, use --tf-model=stub), "dsp" (classical bark detector without Tensorflow, use --tf-model=dsp or a directory of one bark WAV per dog to detect only those dogs) "auto" to benchmark the given model at a few thread counts at startup and use the fastest, or "auto-any" to also benchmark the bundled models and use the fastest model instead of the given one. Defaults to the backend matching the model path.
+  --inference-process                   Run the model in a supervised child process fed through shared memory, off this process's GIL. Not used with --replay or --patch-inference.
+  --patch-inference                     Score each of the model's 0.96s patches (one every 0.48s) once as it completes, instead of re-running the latest second of audio at a fixed rate.
+  --patch-history=<N>                   Number of latest patch scores aggregated into each detection frame [default: 2].
+  --patch-aggregate=<AGG>               How patch scores are aggregated, "max" or "mean" [default: max].
+  --inference-server=<ADDR>             Classify audio with a "gromtector serve" inference server instead of loading a model.
+  --serve-address=<ADDR>                Address the inference server listens on, HOST:PORT or unix:PATH [default: 127.0.0.1:5006].
+  --max-batch=<N>                       Max number of requests the inference server runs in one batch [default: 8].
+  --max-delay-ms=<MS>                   Max time a request waits for its batch to fill up [default: 10].
   --graph-palette=<GRAPH_PALETTE>       Optional palette name for graphs.
+  --spectrogram=<MODE>                  Spectrogram display, "stft" of the captured audio or "log-mel" to show log-mel frames computed like YAMNet's frontend, incrementally once per 10ms hop. "log-mel" needs a model [default: stft].
   --dog-class-threshold=<DCTH>          Inference threshold for detecting dog classes [default: 0.9].
   --dog-audio-class-threshold=<DACTH>   Inference threshold for detecting dog audio classes [default: 0.85].
   --bark-response-audio=<BARKRA>        The audio to playback when Gromit's barking is detected.
   --bark-notify-email=<BARKNE>          Email address to send email when Gromit's barking is detected.
   --gmail-app-pw=<GMAIL_PW>             Gmail app password for sending email notifications.
+  --clip-dir=<CLIP_DIR>                 Save a clip of every bark episode into this directory.
+  --clip-format=<FMT>                   Bark clip file format, "flac" or "wav" [default: flac].
+  --clip-pre-roll=<SEC>                 Seconds of audio to keep from before the barking started [default: 5].
+  --clip-post-roll=<SEC>                Seconds of audio to keep from after the barking ended [default: 2].
+  --db=<DB_PATH>                        SQLite database to record every bark episode into.
+  --since=<DATE>                        Only report barks, or export archived audio, from this local ISO date/time on.
+  --until=<DATE>                        Only report barks, or export archived audio, before this local ISO date/time.
+  --source=<SRC>                        Only report barks from this input source, or export this source's archived audio (needed when several sources were archived).
+  --by=<BUCKET>                         Report bark counts per "hour", "day" or "month" [default: day].
+  --top=<N>                             Number of longest episodes and busiest hours to report, or best threshold pairs to evaluate [default: 10].
+  --scores=<NPZ>                        Evaluation score matrix file, reused by later evaluations of the same clips.
+  --rescore                             Run the model over the clips again even if --scores exists.
+  --grid-step=<STEP>                    Step of the evaluated threshold grid [default: 0.02].
+  --output=<CSV>                        Write the metrics of every evaluated threshold pair to this CSV, or the exported archive audio to this WAV.
+  --archive-dir=<DIR>                   Keep the raw capture audio in compressed segments with a time index in this directory, see archive-export.
+  --archive-segment=<SEC>               Length of each archive segment [default: 60].
+  --archive-days=<DAYS>                 Delete archived audio older than this many days [default: 7].
+  --archive-max-mb=<MB>                 Delete the oldest archived audio beyond this total size, 0 for no limit [default: 4096].
+  --trace=<JSON>                        Record spans of system updates, event listeners, inference, resampling, capture reads and display flips from every thread into this Chrome trace-event JSON file, to open in ui.perfetto.dev.
+  --config=<CONFIG_FILE>                TOML (or .yaml/.yml) file of settings that override the options of the same name and are reloaded live when it changes: dog_class_threshold, dog_audio_class_threshold, animal_classes, dog_noise_classes, bark_response_audio, bark_notify_email, gmail_app_pw and rules, extra detection rules (see gromtector/rules.py).
+  --memory-report=<JSONL>               Sample the process RSS, the top Python allocation sites and every system's buffer sizes and queue lengths, log them and append them to this JSON lines timeline.
+  --memory-interval=<SEC>               Seconds between memory samples [default: 30].
   --max-fps=<MAX_FPS>       Set the max app FPS [default: 60].
   --log-level=<log_lvl>     Logging level.
   -h --help                 Show this screen.
 """
 
+import asyncio
 import logging
 import os
 import platform
 
 from docopt import docopt
+import numpy as np
 
 
 from gromtector.app import Application
 from gromtector.app.systems.debug import DebugSystem
 from gromtector.app.systems.mic import AudioMicSystem
 from gromtector.app.systems.audio_file import AudioFileSystem
+from gromtector.app.systems.net_audio import NetworkAudioSystem, parse_address
 from gromtector.app.systems.spectrogram import SpectrogramSystem
 from gromtector.app.systems.sgram_graph import SpectrogramGraphSystem
 from gromtector.app.systems.hud import HudSystem
 from gromtector.app.systems.tf_yamnet import TfYamnetSystem
 from gromtector.app.systems.dog_audio_detection import DogAudioDetectionSystem
 from gromtector.app.systems.bark_react import BarkReactSystem
+from gromtector.app.systems.bark_recorder import BarkRecorderSystem
+from gromtector.app.systems.config_watcher import ConfigWatcherSystem
+from gromtector.app.systems.detection_history import DetectionHistorySystem
+from gromtector.app.systems.audio_archive import AudioArchiveSystem
+from gromtector.app.systems.memory_diagnostics import MemoryDiagnosticsSystem
 
+from gromtector.audio_archive import export_archive
 from gromtector.audio_extract import extract_audio_inplace
+from gromtector.audio_file import AudioFile, FilePlaybackFinished
+from gromtector.audio_mic import list_input_devices
+from gromtector.detection_store import print_report
+from gromtector.evaluate import run_evaluation
+from gromtector.inference_process import run_benchmark
+from gromtector.inference_server import InferenceServer
+from gromtector.net_audio import CODECS, run_fake_sensors
+from gromtector.yamnet import select_backend
+from gromtector import tracing
 
 from gromtector.logging import FORMAT
 
@@ -51,6 +133,36 @@ logging.basicConfig(format=FORMAT)
 logger = logging.getLogger(__name__)
 
 
+def run_fake_sensor(cli_params: dict) -> None:
+    host, port = parse_address(cli_params["<ADDR>"], default_host="127.0.0.1")
+    samples = None
+    sample_rate = 16000
+    if cli_params["--file"]:
+        audio_file = AudioFile(cli_params["--file"], chunk_size=16000)
+        chunks = []
+        try:
+            while True:
+                chunks.append(audio_file.read())
+        except FilePlaybackFinished:
+            pass
+        audio_file.close()
+        samples = np.concatenate(chunks)
+        sample_rate = audio_file.sample_rate
+
+    asyncio.run(
+        run_fake_sensors(
+            host,
+            port,
+            num_streams=int(cli_params["--streams"]),
+            samples=samples,
+            sample_rate=sample_rate,
+            duration_s=float(cli_params["--seconds"]),
+            use_udp=cli_params["--udp"],
+            codec=CODECS[cli_params["--codec"]],
+        )
+    )
+
+
 def main():
     cli_params = docopt(__doc__)
     if cli_params["--log-level"]:
@@ -61,16 +173,75 @@ def main():
 
     logger.debug("Hello World")
 
-    if cli_params["extract"]:
+    if cli_params["--list-devices"]:
+        for info in list_input_devices():
+            print(
+                "{}: {} ({} channels, default {:.0f} Hz)".format(
+                    info["index"],
+                    info["name"],
+                    info["maxInputChannels"],
+                    info["defaultSampleRate"],
+                )
+            )
+
+    elif cli_params["extract"]:
         extract_audio_inplace(cli_params)
-    
+
+    elif cli_params["evaluate"]:
+        run_evaluation(cli_params)
+
+    elif cli_params["report"]:
+        print_report(cli_params)
+
+    elif cli_params["archive-export"]:
+        export_archive(cli_params)
+
+    elif cli_params["serve"]:
+        server = InferenceServer(
+            model=select_backend(cli_params["--backend"], cli_params["--tf-model"]),
+            address=cli_params["--serve-address"],
+            max_batch=int(cli_params["--max-batch"]),
+            max_delay_s=float(cli_params["--max-delay-ms"]) / 1000,
+        )
+        server.run()
+
+    elif cli_params["bench-inference"]:
+        run_benchmark(cli_params)
+
+    elif cli_params["fake-sensor"]:
+        run_fake_sensor(cli_params)
+
     else:
+        if cli_params["--replay"] and not (
+            cli_params["--tf-model"] or cli_params["--inference-server"]
+        ):
+            raise RuntimeError(
+                '"--replay" needs a "--tf-model" or an "--inference-server".'
+            )
+        if cli_params["--spectrogram"] not in ("stft", "log-mel"):
+            raise RuntimeError(
+                'Unknown spectrogram mode "{}", use stft or log-mel.'.format(
+                    cli_params["--spectrogram"]
+                )
+            )
+        if cli_params["--spectrogram"] == "log-mel" and not (
+            cli_params["--tf-model"] or cli_params["--inference-server"]
+        ):
+            raise RuntimeError(
+                '"--spectrogram=log-mel" needs a "--tf-model" or an "--inference-server".'
+            )
+        # Loads the config file into `cli_params` before the other systems start.
+        system_classes = [ConfigWatcherSystem] if cli_params["--config"] else []
         if cli_params["--file"]:
-            system_classes = [
+            system_classes += [
                 AudioFileSystem,
             ]
+        elif cli_params["--listen"]:
+            system_classes += [
+                NetworkAudioSystem,
+            ]
         else:
-            system_classes = [
+            system_classes += [
                 AudioMicSystem,
             ]
         system_classes += [
@@ -81,15 +252,36 @@ def main():
             BarkReactSystem,
             HudSystem,
         ]
-        if cli_params["--tf-model"]:
+        if cli_params["--tf-model"] or cli_params["--inference-server"]:
             system_classes += [
                 TfYamnetSystem,
             ]
+        if cli_params["--clip-dir"]:
+            system_classes += [
+                BarkRecorderSystem,
+            ]
+        if cli_params["--db"]:
+            system_classes += [
+                DetectionHistorySystem,
+            ]
+        if cli_params["--archive-dir"]:
+            system_classes += [
+                AudioArchiveSystem,
+            ]
+        if cli_params["--memory-report"]:
+            system_classes += [
+                MemoryDiagnosticsSystem,
+            ]
 
-        app = Application(
-            args=cli_params,
-            system_classes=system_classes,
-        )
-        app.run()
+        if cli_params["--trace"]:
+            tracing.start(cli_params["--trace"])
+        try:
+            app = Application(
+                args=cli_params,
+                system_classes=system_classes,
+            )
+            app.run()
+        finally:
+            tracing.stop()
 
     logger.debug("Bye World")
@@ -0,0 +1,289 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+import wave
+import zlib
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gromtector.detection_store import parse_date, to_epoch
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    begin_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    rate INTEGER NOT NULL,
+    num_samples INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_source_begin_ts ON segments (source, begin_ts);
+CREATE INDEX IF NOT EXISTS segments_end_ts ON segments (end_ts);
+"""
+
+INDEX_FILE = "index.sqlite"
+COMPRESSION_LEVEL = 1  # Deltas already compress well, higher levels cost CPU.
+SILENCE_CHUNK_SAMPLES = 1 << 20
+
+
+def encode_segment(pcm: np.ndarray) -> bytes:
+    """
+    zlib compressed sample deltas of int16 PCM. Audio changes slowly from sample
+    to sample, so its deltas are small and compress far better than raw samples.
+    """
+    pcm = pcm.astype("<i2", copy=False)
+    deltas = np.diff(pcm, prepend=np.int16(0)).astype("<i2", copy=False)
+    return zlib.compress(deltas.tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_segment(data: bytes) -> np.ndarray:
+    deltas = np.frombuffer(zlib.decompress(data), dtype="<i2")
+    # Sums wrap around like the differences did, so the samples come back exactly.
+    return np.cumsum(deltas, dtype=np.int16)
+
+
+def iter_silence(num_samples: int) -> Iterator[np.ndarray]:
+    zeros = np.zeros(min(num_samples, SILENCE_CHUNK_SAMPLES), dtype=np.int16)
+    while num_samples > 0:
+        yield zeros[:num_samples]
+        num_samples -= zeros.size
+
+
+class AudioArchive:
+    """
+    Continuous audio as compressed segment files, one contiguous run of samples
+    each, with a SQLite index of their sources and time spans. Any sample's
+    segment and offset follow from the index: the segment covering a time, then
+    `(time - begin) * rate` samples in.
+    """
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(archive_dir, INDEX_FILE), check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add_segment(
+        self, source: str, begin_timestamp: datetime, rate: int, pcm: np.ndarray
+    ) -> int:
+        """
+        Writes a segment and indexes it, returns its compressed size.
+        """
+        begin_ts = to_epoch(begin_timestamp)
+        local_begin = begin_timestamp.astimezone(tz=None)
+        # Network sources are named after their address.
+        day_dir = os.path.join(
+            self.archive_dir,
+            re.sub(r"[^\w.-]", "_", source),
+            local_begin.strftime("%Y%m%d"),
+        )
+        os.makedirs(day_dir, exist_ok=True)
+        path = os.path.join(day_dir, local_begin.strftime("%H%M%S-%f.seg"))
+        data = encode_segment(pcm)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO segments (source, begin_ts, end_ts, rate, num_samples,"
+                " path, size_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source,
+                    begin_ts,
+                    begin_ts + pcm.size / rate,
+                    rate,
+                    pcm.size,
+                    os.path.relpath(path, self.archive_dir),
+                    len(data),
+                ),
+            )
+        return len(data)
+
+    def sources(self, since: datetime, until: datetime) -> Sequence[str]:
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT DISTINCT source FROM segments"
+                " WHERE end_ts > ? AND begin_ts < ?",
+                (to_epoch(since), to_epoch(until)),
+            )
+        ]
+
+    def read_range(
+        self, source: str, since: datetime, until: datetime
+    ) -> Tuple[Optional[int], Iterator[np.ndarray]]:
+        """
+        Returns the capture rate of `source` and an iterator over its int16 PCM from
+        `since` to `until`, in order, with silence where nothing was archived. Only
+        the segments overlapping the range are read, found by an index range scan,
+        and only one of them is held in memory at a time.
+        """
+        since_ts = to_epoch(since)
+        until_ts = to_epoch(until)
+        # No segment is longer than `max_len_s`, so bounding `begin_ts` on both
+        # sides keeps the lookup a range scan of the index.
+        max_len_s = self.conn.execute(
+            "SELECT MAX(end_ts - begin_ts) FROM segments WHERE source = ?", (source,)
+        ).fetchone()[0]
+        if max_len_s is None:
+            return None, iter(())
+        segments = self.conn.execute(
+            "SELECT begin_ts, rate, num_samples, path FROM segments"
+            " WHERE source = ? AND begin_ts >= ? AND begin_ts < ? AND end_ts > ?"
+            " ORDER BY begin_ts",
+            (source, since_ts - max_len_s, until_ts, since_ts),
+        ).fetchall()
+        if not segments:
+            return None, iter(())
+        rate = segments[-1][1]
+        num_samples = int(round((until_ts - since_ts) * rate))
+        return rate, self.iter_segments(source, segments, since_ts, rate, num_samples)
+
+    def iter_segments(
+        self,
+        source: str,
+        segments: List[tuple],
+        since_ts: float,
+        rate: int,
+        num_samples: int,
+    ) -> Iterator[np.ndarray]:
+        position = 0  # Samples yielded so far.
+        for begin_ts, segment_rate, _, path in segments:
+            if segment_rate != rate:
+                logger.warning(
+                    "Skipping the %s segment at %s, it was captured at %dHz, not %dHz.",
+                    source,
+                    datetime.fromtimestamp(begin_ts),
+                    segment_rate,
+                    rate,
+                )
+                continue
+            offset = int(round((begin_ts - since_ts) * rate))
+            if offset >= num_samples:
+                break
+            if offset > position:
+                yield from iter_silence(offset - position)
+                position = offset
+            try:
+                with open(os.path.join(self.archive_dir, path), "rb") as f:
+                    samples = decode_segment(f.read())
+            except OSError as e:
+                logger.warning("Skipping a missing segment: %s", e)
+                continue
+            samples = samples[position - offset : num_samples - offset]
+            if samples.size:
+                yield samples
+                position += samples.size
+        yield from iter_silence(num_samples - position)
+
+    def total_size_bytes(self) -> int:
+        return int(
+            self.conn.execute("SELECT TOTAL(size_bytes) FROM segments").fetchone()[0]
+        )
+
+    def enforce_retention(
+        self,
+        max_age_s: Optional[float],
+        max_size_bytes: Optional[int],
+        now: datetime = None,
+    ) -> int:
+        """
+        Deletes the segments that ended more than `max_age_s` ago, then the oldest
+        ones until the archive fits in `max_size_bytes`. Returns the number of
+        segments deleted.
+        """
+        expired = []
+        if max_age_s:
+            now_ts = to_epoch(now or datetime.now(tz=timezone.utc))
+            expired += self.conn.execute(
+                "SELECT id, path, size_bytes FROM segments WHERE end_ts < ?",
+                (now_ts - max_age_s,),
+            ).fetchall()
+        if max_size_bytes:
+            excess_bytes = self.total_size_bytes() - max_size_bytes
+            excess_bytes -= sum(size_bytes for _, _, size_bytes in expired)
+            if excess_bytes > 0:
+                expired_ids = {row[0] for row in expired}
+                for row in self.conn.execute(
+                    "SELECT id, path, size_bytes FROM segments ORDER BY end_ts"
+                ):
+                    if excess_bytes <= 0:
+                        break
+                    if row[0] in expired_ids:
+                        continue
+                    expired.append(row)
+                    excess_bytes -= row[2]
+
+        for _, path, _ in expired:
+            try:
+                os.remove(os.path.join(self.archive_dir, path))
+            except FileNotFoundError:
+                pass
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM segments WHERE id = ?", [(row[0],) for row in expired]
+            )
+        return len(expired)
+
+
+def export_archive(args: dict) -> None:
+    archive = AudioArchive(args["--archive-dir"])
+    since = parse_date(args["--since"])
+    until = parse_date(args["--until"])
+    if until <= since:
+        raise RuntimeError("--until has to be after --since.")
+    source = args["--source"]
+    if source is None:
+        sources = archive.sources(since, until)
+        if len(sources) != 1:
+            raise RuntimeError(
+                "Pick a --source, archived ones in that range: {}.".format(
+                    ", ".join(sources) or "none"
+                )
+            )
+        source = sources[0]
+
+    start = time.time()
+    rate, chunks = archive.read_range(source, since, until)
+    if rate is None:
+        archive.close()
+        raise RuntimeError(
+            "Nothing archived from {} between {} and {}.".format(source, since, until)
+        )
+
+    num_samples = 0
+    with wave.open(args["--output"], "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        for chunk in chunks:
+            wav_file.writeframes(chunk.astype("<i2", copy=False).tobytes())
+            num_samples += chunk.size
+    archive.close()
+    logger.info(
+        "Exported %.1fs of audio in %.1fms.",
+        num_samples / rate,
+        (time.time() - start) * 1000,
+    )
+    print(
+        'Exported {:.1f}s of {} audio to "{}".'.format(
+            num_samples / rate, source, args["--output"]
+        )
+    )
@@ -1,40 +1,275 @@
-import glob
-from gromtector import app
-import os
+import hashlib
+import json
 import logging
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional, Sequence
 
-import audiosegment as ad
+from gromtector.feature_cache import ensure_feature_cache
 
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_EXTENSIONS = ("m4a", "mp4")
+MANIFEST_FILE_NAME = ".gromtector-extract.json"
+MANIFEST_SAVE_INTERVAL_S = 10.0
+OUTPUT_SAMPLE_RATE = 16000
+
+
+def file_sha256(file_path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_source_files(input_path: Path, extensions: Sequence[str]) -> List[Path]:
+    """
+    Returns the files under `input_path`, recursively, with one of `extensions`.
+    """
+    if input_path.is_file():
+        return [input_path]
+    suffixes = {"." + ext.lower().lstrip(".") for ext in extensions}
+    return sorted(
+        path
+        for path in input_path.rglob("*")
+        if path.suffix.lower() in suffixes and path.is_file()
+    )
+
+
+def output_path_for(source_path: Path) -> Path:
+    return source_path.with_suffix(".wav")
+
+
+def check_output_collisions(source_paths: Sequence[Path]) -> None:
+    """
+    Raises if several sources would be extracted to the same WAV, like "foo.m4a"
+    and "foo.mp4" both to "foo.wav".
+    """
+    sources_by_output: Dict[Path, List[Path]] = {}
+    for source_path in source_paths:
+        sources_by_output.setdefault(output_path_for(source_path), []).append(
+            source_path
+        )
+    collisions = [
+        "{} <- {}".format(output_path, ", ".join(path.name for path in paths))
+        for output_path, paths in sources_by_output.items()
+        if len(paths) > 1
+    ]
+    if collisions:
+        raise RuntimeError(
+            "Several sources would be extracted to the same WAV, rename them or"
+            " narrow --extensions:\n  " + "\n  ".join(collisions)
+        )
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, dict]:
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning('Ignoring the corrupt manifest "%s".', manifest_path)
+        return {}
+
+
+def save_manifest(manifest_path: Path, manifest: Dict[str, dict]) -> None:
+    tmp_path = str(manifest_path) + ".part"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def extract_file(source_path: str, output_path: str) -> dict:
+    """
+    Decodes `source_path` into a 16kHz mono 16 bit WAV at `output_path`. The WAV is
+    written to a temporary file first and renamed, so an interrupted run never
+    leaves a partial output behind. Runs in the worker processes.
+    """
+    stat = os.stat(source_path)
+    sha256 = file_sha256(source_path)
+    # A unique name per job, so concurrent jobs never share a temporary file.
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(output_path) + ".",
+        suffix=".part",
+        dir=os.path.dirname(output_path),
+    )
+    os.close(fd)
+    try:
+        _run_ffmpeg(source_path, tmp_path)
+        # mkstemp files are private, give the WAV the usual permissions.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "output": os.path.basename(output_path),
+    }
+
+
+def _run_ffmpeg(source_path: str, output_path: str) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-v",
+            "error",
+            "-y",
+            "-i",
+            source_path,
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            str(OUTPUT_SAMPLE_RATE),
+            "-acodec",
+            "pcm_s16le",
+            "-f",
+            "wav",
+            output_path,
+        ],
+        check=True,
+    )
+
+
+def is_up_to_date(source_path: Path, entry: Optional[dict]) -> bool:
+    """
+    Whether the manifest `entry` of `source_path` is still valid. Size and mtime
+    are checked first; if only the mtime moved the content hash decides, and the
+    entry is refreshed in place when the content is unchanged.
+    """
+    if entry is None or not output_path_for(source_path).exists():
+        return False
+    stat = source_path.stat()
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    if file_sha256(source_path) != entry["sha256"]:
+        return False
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
 def extract_audio_inplace(args: dict) -> None:
-    src_audio_paths = []
-    input_path = Path(args["<AUDIO_PATH>"])
-    logger.debug(f"Input path: {input_path}")
+    """
+    Extracts 16kHz mono WAVs next to every matching source file under
+    `<AUDIO_PATH>`. A manifest at the top of the tree keeps the size, mtime and
+    hash of every extracted source so re-runs only decode what changed.
 
-    if input_path.is_dir():
-        supported_extensions = ["m4a", "mp4"]
-        for ext in supported_extensions:
-            for ip in input_path.glob("*.{}".format(ext)):
-                src_audio_paths.append(ip)
+    With `--feature-cache` every extracted WAV also gets a memory-mapped feature
+    cache (see `FeatureCache`), rebuilt whenever its WAV changed.
+    """
+    input_path = Path(args["<AUDIO_PATH>"]).resolve()
+    logger.debug(f"Input path: {input_path}")
+    extensions = [
+        ext.strip()
+        for ext in (args.get("--extensions") or ",".join(DEFAULT_EXTENSIONS)).split(",")
+        if ext.strip()
+    ]
+    jobs = int(args.get("--jobs") or 0) or os.cpu_count() or 1
 
-    for input_file_path in src_audio_paths:
-        target_dir = input_file_path.parent
-        src_filename = input_file_path.name
-        src_fname, src_fext = os.path.splitext(src_filename)
+    root_dir = input_path if input_path.is_dir() else input_path.parent
+    manifest_path = root_dir / MANIFEST_FILE_NAME
+    manifest = load_manifest(manifest_path)
 
-        output_f_path = f"{target_dir / src_fname}.wav".format(src_fname)
-        if Path(output_f_path).exists():
+    source_paths = find_source_files(input_path, extensions)
+    check_output_collisions(source_paths)
+    # A WAV source would be extracted over itself, it's left as it is.
+    for source_path in source_paths:
+        if output_path_for(source_path) == source_path:
+            logger.warning("Skipping %s, it is a WAV already.", source_path)
+    source_paths = [path for path in source_paths if output_path_for(path) != path]
+    todo = []
+    for source_path in source_paths:
+        key = source_path.relative_to(root_dir).as_posix()
+        if is_up_to_date(source_path, manifest.get(key)):
             continue
+        todo.append((key, source_path))
+    logger.info(
+        "Extracting %d files with %d processes (%d up to date).",
+        len(todo),
+        jobs,
+        len(source_paths) - len(todo),
+    )
+    if todo:
+        extract_files(todo, jobs, manifest, manifest_path)
+    else:
+        save_manifest(manifest_path, manifest)
 
-        logger.info(f"Extracting audio from {input_file_path}")
-
-        seg = ad.from_file(input_file_path)
-        seg = seg.resample(
-            channels=1,
-            sample_rate_Hz=16000,
-            sample_width=2,
+    if args.get("--feature-cache"):
+        build_feature_caches(
+            [
+                str(output_path_for(source_path))
+                for source_path in source_paths
+                if output_path_for(source_path).exists()
+            ],
+            jobs,
         )
-        seg.export(output_f_path, format="wav")
+
+
+def extract_files(todo, jobs: int, manifest: Dict[str, dict], manifest_path: Path):
+    start = time.time()
+    last_save = start
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                extract_file, str(source_path), str(output_path_for(source_path))
+            ): key
+            for key, source_path in todo
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                manifest[key] = future.result()
+                logger.info(f"Extracted audio from {key}")
+            except Exception:
+                failed += 1
+                manifest.pop(key, None)
+                logger.exception(f"Failed to extract audio from {key}")
+            if time.time() - last_save >= MANIFEST_SAVE_INTERVAL_S:
+                # Keep the progress of long runs if they get interrupted.
+                save_manifest(manifest_path, manifest)
+                last_save = time.time()
+
+    save_manifest(manifest_path, manifest)
+    logger.info(
+        "Extracted %d files in %.1fs, %d failed.",
+        len(todo) - failed,
+        time.time() - start,
+        failed,
+    )
+
+
+def build_feature_caches(wav_paths: Sequence[str], jobs: int) -> None:
+    start = time.time()
+    num_built = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(ensure_feature_cache, wav_path): wav_path
+            for wav_path in wav_paths
+        }
+        for future in as_completed(futures):
+            try:
+                num_built += future.result()
+            except Exception:
+                logger.exception(f"Failed to cache the features of {futures[future]}")
+    logger.info(
+        "Built %d feature caches in %.1fs (%d up to date).",
+        num_built,
+        time.time() - start,
+        len(wav_paths) - num_built,
+    )
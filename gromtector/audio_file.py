@@ -1,59 +1,214 @@
+import json
 import os
+import shutil
+import struct
+import subprocess
 
-import pyaudio
 import numpy as np
-import audiosegment as ad
 
 
-DEFAULT_CHUNK_SIZE = 8192  # number of samples to take per read
-DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_CHUNK_SIZE = 1024  # number of frames to take per read
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
 
 
 class FilePlaybackFinished(Exception):
     pass
 
 
+def _find_wav_pcm16_data(file_path):
+    """
+    Returns `(data offset, num frames, sample rate, channels)` of a 16 bit PCM WAV
+    file, or `None` if the file is anything else.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        data_offset = f.tell()
+
+    if fmt is None or len(fmt) < 16:
+        return None
+    audio_format, channels, sample_rate, _, block_align, bits = struct.unpack(
+        "<HHIIHH", fmt[:16]
+    )
+    if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        audio_format = struct.unpack("<H", fmt[24:26])[0]
+    if audio_format != WAVE_FORMAT_PCM or bits != 16:
+        return None
+
+    # Streamed WAVs can have a bogus data size, trust the file size over it.
+    data_size = min(chunk_size, file_size - data_offset)
+    return data_offset, data_size // block_align, sample_rate, channels
+
+
+def _probe_audio_stream(file_path):
+    """
+    Returns `(sample rate, channels, duration in seconds or None)` of the first
+    audio stream of any file ffmpeg can decode.
+    """
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            "stream=sample_rate,channels:format=duration",
+            "-of",
+            "json",
+            file_path,
+        ],
+        check=True,
+        capture_output=True,
+    ).stdout
+    info = json.loads(output)
+    if not info.get("streams"):
+        raise RuntimeError('"{}" has no audio stream.'.format(file_path))
+    stream = info["streams"][0]
+    duration = info.get("format", {}).get("duration")
+    return (
+        int(stream["sample_rate"]),
+        int(stream["channels"]),
+        float(duration) if duration else None,
+    )
+
+
 class AudioFile:
-    def __init__(self, file_path, chunk_size=None):
+    """
+    Streams 16 bit mono audio out of a file in `chunk_size` frame chunks.
+
+    16 bit PCM WAV files are memory-mapped, anything else is decoded by an ffmpeg
+    process piping PCM to us. Either way only one chunk is in memory at a time, no
+    matter how long the file is, and multi-channel audio is downmixed chunk by chunk.
+    """
+
+    sample_width: int = 2
+    channels: int = 1  # Channels of the audio returned by `read()`.
+
+    def __init__(self, file_path, chunk_size=None, start_s=0.0):
         self.file_path = os.path.abspath(file_path)
         if not os.path.exists(self.file_path):
             raise FileNotFoundError('"{}" not found.'.format(self.file_path))
-        self.audio_segment = ad.from_file(self.file_path)
-        if self.audio_segment.seg.channels > 1:
-            self.audio_segment = self.audio_segment.resample(
-                channels=1,
-                sample_rate_Hz=self.audio_segment.seg.frame_rate,
-                sample_width=self.audio_segment.seg.sample_width,
-            )
-        self.cursor = 0
         self.chunk_size = chunk_size if chunk_size else DEFAULT_CHUNK_SIZE
 
+        self.wav_mmap = None
+        self.decoder = None
+        wav_info = _find_wav_pcm16_data(self.file_path)
+        if wav_info is not None:
+            data_offset, num_frames, self._sample_rate, self.source_channels = wav_info
+            self.num_frames = num_frames
+            self.wav_mmap = np.memmap(
+                self.file_path,
+                dtype="<i2",
+                mode="r",
+                offset=data_offset,
+                shape=(num_frames, self.source_channels),
+            )
+        else:
+            if shutil.which("ffmpeg") is None:
+                raise RuntimeError(
+                    'ffmpeg is needed to decode "{}" but is not on the PATH.'.format(
+                        self.file_path
+                    )
+                )
+            self._sample_rate, self.source_channels, duration = _probe_audio_stream(
+                self.file_path
+            )
+            self.num_frames = (
+                int(duration * self._sample_rate) if duration is not None else None
+            )
+
+        self.cursor = 0  # Frame position of the next read.
+        self.seek(start_s)
+
+    def _start_decoder(self, start_s: float) -> None:
+        self._stop_decoder()
+        self.decoder = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-v",
+                "error",
+                "-ss",
+                str(start_s),
+                "-i",
+                self.file_path,
+                "-vn",
+                "-f",
+                "s16le",
+                "-acodec",
+                "pcm_s16le",
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+        )
+
+    def _stop_decoder(self) -> None:
+        if self.decoder is not None:
+            self.decoder.kill()
+            self.decoder.stdout.close()
+            self.decoder.wait()
+            self.decoder = None
+
+    def seek(self, start_s: float) -> None:
+        self.cursor = int(start_s * self.sample_rate)
+        if self.wav_mmap is None:
+            self._start_decoder(start_s)
+
     def open(self):
-        self.cursor = 0
+        self.seek(0.0)
+
+    def _read_frames(self) -> np.ndarray:
+        if self.wav_mmap is not None:
+            return self.wav_mmap[self.cursor : self.cursor + self.chunk_size]
+
+        frame_size = self.sample_width * self.source_channels
+        raw_data = self.decoder.stdout.read(self.chunk_size * frame_size)
+        num_frames = len(raw_data) // frame_size
+        return np.frombuffer(
+            raw_data, dtype="<i2", count=num_frames * self.source_channels
+        ).reshape(num_frames, self.source_channels)
 
     def read(self):
-        end = self.cursor + self.chunk_size
-        seg_raw_data = self.audio_segment.seg.raw_data
-        if end >= len(seg_raw_data):
+        frames = self._read_frames()
+        if not frames.shape[0]:
             raise FilePlaybackFinished("All over")
-
-        if end > len(seg_raw_data):
-            end = len(seg_raw_data)
-        raw_data = seg_raw_data[self.cursor : end]
-        self.cursor = end
-        return np.frombuffer(raw_data, dtype=np.int16)
+        self.cursor += frames.shape[0]
+        if self.source_channels > 1:
+            return frames.mean(axis=1).astype(np.int16)
+        return np.array(frames[:, 0], dtype=np.int16)
 
     def close(self):
+        self._stop_decoder()
         self.cursor = 0
 
     @property
     def sample_rate(self):
-        return self.audio_segment.frame_rate
+        return self._sample_rate
+
+    @property
+    def position_s(self) -> float:
+        return self.cursor / self.sample_rate
 
     @property
     def desireable_sample_interval_ms(self):
         sample_per_ms = self.sample_rate / 1000  # sample per ms
-        sample_length = int(
-            self.chunk_size / self.audio_segment.seg.frame_width / sample_per_ms
-        )  # chunk duration.
+        sample_length = int(self.chunk_size / sample_per_ms)  # chunk duration.
         return sample_length
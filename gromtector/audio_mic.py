@@ -1,19 +1,21 @@
 from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from random import sample
-from typing import Dict, Tuple, ByteString
+from typing import Dict, List, Optional, Sequence, Tuple, ByteString
 import logging
 
 import pyaudio
 import numpy as np
 
+from gromtector.audio_ring import AudioRingBuffer
+
 logger = logging.getLogger(__name__)
 
 DEFAULT_SAMPLE_WIDTH = 2  # pyaudio.paInt16  # conversion format for PyAudio stream
 DEFAULT_CHANNELS = 1  # microphone audio channels
-DEFAULT_SAMPLE_RATE = 48_000  # num audio sample per sec
-DEFAULT_SAMPLE_RATE = 44_100
-DEFAULT_CHUNK_SIZE = 8192  # number of samples to take per read
-DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_SAMPLE_RATE = 44_100  # num audio sample per sec
+DEFAULT_CHUNK_SIZE = 1024  # number of frames to take per read/callback
+DEFAULT_RING_SECONDS = 5.0  # capacity of the callback mic ring buffer
 
 # SAMPLE_LENGTH = int(CHUNK_SIZE * 1_000 / SAMPLE_RATE)  # length of each sample in ms
 DEFAULT_SAMPLE_PER_MS = DEFAULT_SAMPLE_RATE / 1000  # sample per ms
@@ -41,7 +43,14 @@ def _open_mic(sample_rate, channels, chunk_size, sample_width):
     return stream, pa
 
 
-def _open_callback_mic(sample_rate, channels, sample_width, callback):
+def _open_callback_mic(
+    sample_rate,
+    channels,
+    sample_width,
+    callback,
+    frames_per_buffer=None,
+    input_device_index=None,
+):
     """
     open_mic:
     creates a PyAudio object and initializes the mic stream
@@ -50,17 +59,99 @@ def _open_callback_mic(sample_rate, channels, sample_width, callback):
     """
 
     pa = pyaudio.PyAudio()
-    stream = pa.open(
-        format=pyaudio.get_format_from_width(sample_width),
-        channels=channels,
-        rate=sample_rate,
-        input=True,
-        # frames_per_buffer=chunk_size,
-        stream_callback=callback,
-    )
+    try:
+        stream = pa.open(
+            format=pyaudio.get_format_from_width(sample_width),
+            channels=channels,
+            rate=sample_rate,
+            input=True,
+            frames_per_buffer=(
+                frames_per_buffer
+                if frames_per_buffer
+                else pyaudio.paFramesPerBufferUnspecified
+            ),
+            input_device_index=input_device_index,
+            stream_callback=callback,
+        )
+    except Exception:
+        pa.terminate()
+        raise
     return stream, pa
 
 
+def list_input_devices() -> List[dict]:
+    """
+    Returns the PyAudio device info of every device that can capture audio.
+    """
+    pa = pyaudio.PyAudio()
+    try:
+        return [
+            info
+            for info in (
+                pa.get_device_info_by_index(idx) for idx in range(pa.get_device_count())
+            )
+            if info["maxInputChannels"] > 0
+        ]
+    finally:
+        pa.terminate()
+
+
+def find_input_device(device: Optional[str]) -> dict:
+    """
+    Finds an input device by index or by (case insensitive) name substring. The
+    default input device is returned when `device` is empty.
+    """
+    if not device:
+        pa = pyaudio.PyAudio()
+        try:
+            return pa.get_default_input_device_info()
+        finally:
+            pa.terminate()
+
+    devices = list_input_devices()
+    if device.isdigit():
+        for info in devices:
+            if info["index"] == int(device):
+                return info
+    else:
+        for info in devices:
+            if device.lower() in info["name"].lower():
+                return info
+    raise RuntimeError('Cannot find an audio input device matching "{}".'.format(device))
+
+
+def is_sample_rate_supported(
+    device_info: dict, sample_rate: int, channels: int = DEFAULT_CHANNELS
+) -> bool:
+    pa = pyaudio.PyAudio()
+    try:
+        return pa.is_format_supported(
+            sample_rate,
+            input_device=device_info["index"],
+            input_channels=channels,
+            input_format=pyaudio.get_format_from_width(DEFAULT_SAMPLE_WIDTH),
+        )
+    except ValueError:
+        return False
+    finally:
+        pa.terminate()
+
+
+def pick_sample_rate(
+    device_info: dict,
+    preferred_rates: Sequence[int],
+    channels: int = DEFAULT_CHANNELS,
+) -> int:
+    """
+    Returns the first of `preferred_rates` the device can capture at natively, or
+    the device's default rate if it supports none of them.
+    """
+    for rate in preferred_rates:
+        if is_sample_rate_supported(device_info, rate, channels):
+            return rate
+    return int(device_info["defaultSampleRate"])
+
+
 def get_data(stream: pyaudio.Stream, chunk_size: int = 0) -> np.ndarray:
     """
     get_data:
@@ -148,12 +239,34 @@ def open_mic(chunk_size=None):
 
 
 class CallbackAudioMic:
-    def __init__(self, open=False, sample_rate=None, channels=None):
+    """
+    A mic whose PortAudio callback writes straight into a preallocated
+    `AudioRingBuffer`. The consumer drains the ring with `read()`/`drain()`; frames
+    that don't fit are dropped and counted instead of growing a buffer without bound.
+    """
+
+    def __init__(
+        self,
+        open=False,
+        sample_rate=None,
+        channels=None,
+        ring_seconds=None,
+        frames_per_buffer=None,
+        device_index=None,
+    ):
         self.sample_rate = sample_rate if sample_rate else DEFAULT_SAMPLE_RATE
         self.channels = channels if channels else DEFAULT_CHANNELS
         self.sample_width = DEFAULT_SAMPLE_WIDTH
+        self.ring_seconds = ring_seconds if ring_seconds else DEFAULT_RING_SECONDS
+        self.frames_per_buffer = (
+            frames_per_buffer if frames_per_buffer else DEFAULT_CHUNK_SIZE
+        )
+        self.device_index = device_index
         self.stream = None
         self.pa = None
+        self.ring: AudioRingBuffer = None
+        self.stream_begin_timestamp: datetime = None
+        self.input_overflows = 0  # Overflows reported by PortAudio itself.
         if open:
             self.open()
 
@@ -180,40 +293,75 @@ class CallbackAudioMic:
         flag must be either paContinue, paComplete or paAbort (one of PortAudio Callback Return Code).
         When `output=True` and `out_data` does not contain at least `frame_count` frames, `paComplete` is assumed for flag.
         """
-        # logger.debug("CallbackAudioMic callback()")
-        self.buffer += input_data
+        # No logging or allocation in here, this runs on the PortAudio thread.
+        if status_flag & (pyaudio.paInputUnderflow | pyaudio.paInputOverflow):
+            self.input_overflows += 1
+        self.ring.write(np.frombuffer(input_data, dtype=np.int16))
         out_data = None  # null coz this is an input stream.
-        # logger.debug("Mic flag: {}".format(status_flag))
-        if status_flag in [
-            pyaudio.paInputUnderflow,
-            pyaudio.paInputOverflow,
-        ]:
-            logger.warning("Some sort of audio mic input overflow/underflow has occurred.")
         return (out_data, pyaudio.paContinue)
 
     def open(self):
         if self.stream is not None or self.pa is not None:
             raise RuntimeError("Opening an open mic.")
+        self.ring = AudioRingBuffer(
+            capacity=int(self.sample_rate * self.ring_seconds), channels=self.channels
+        )
         stream, pa = _open_callback_mic(
             sample_rate=self.sample_rate,
             channels=self.channels,
             sample_width=self.sample_width,
             callback=self.callback,
+            frames_per_buffer=self.frames_per_buffer,
+            input_device_index=self.device_index,
         )
         self.stream = stream
         self.pa = pa
+        self.stream_begin_timestamp = datetime.now(tz=timezone.utc)
         self.stream.start_stream()
-        self.buffer = b""
+
+    def drain(self, timeout: float = None) -> Tuple[np.ndarray, datetime]:
+        """
+        Returns all the frames currently in the ring and the timestamp of the first
+        one, derived from the stream sample count. Waits up to `timeout` seconds for
+        data if the ring is empty (doesn't wait if `timeout` is `None`).
+        """
+        if timeout is not None:
+            self.ring.wait(timeout)
+        data, stream_index = self.ring.read()
+        begin_timestamp = self.stream_begin_timestamp + timedelta(
+            seconds=stream_index / self.sample_rate
+        )
+        return data, begin_timestamp
 
     def read(self):
-        buf = np.frombuffer(self.buffer, dtype=np.int16)
-        self.buffer = b""
-        return buf
+        data, _ = self.drain()
+        return data
+
+    def is_active(self) -> bool:
+        return self.stream is not None and self.stream.is_active()
+
+    @property
+    def latency_s(self) -> float:
+        """
+        Capture latency: one callback buffer plus the device input latency.
+        """
+        latency_s = self.frames_per_buffer / self.sample_rate
+        if self.stream is not None:
+            latency_s += self.stream.get_input_latency()
+        return latency_s
+
+    @property
+    def dropped_frames(self) -> int:
+        return self.ring.dropped_frames if self.ring else 0
+
+    @property
+    def overruns(self) -> int:
+        return self.ring.overruns if self.ring else 0
 
     def get_desireable_sample_interval_ms(self):
         sample_per_ms = self.sample_rate / 1000  # sample per ms
         sample_length = int(
-            self.chunk_size / self.sample_width / sample_per_ms
+            self.frames_per_buffer / sample_per_ms
         )  # chunk duration.
         return sample_length
 
@@ -231,3 +379,23 @@ class CallbackAudioMic:
         self.stream = None
         self.pa.terminate()
         self.pa = None
+
+    def abandon(self) -> None:
+        """
+        Closes a mic whose device failed as far as PortAudio lets it, without
+        raising, so a new one can be opened in its place.
+        """
+        stream, pa = self.stream, self.pa
+        self.stream = None
+        self.pa = None
+        for close in (
+            stream.stop_stream if stream else None,
+            stream.close if stream else None,
+            pa.terminate if pa else None,
+        ):
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.debug("Ignoring %r while abandoning the mic.", e)
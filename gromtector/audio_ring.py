@@ -0,0 +1,152 @@
+from collections import deque
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring of audio frames.
+
+    The producer (e.g. a PortAudio callback) calls `write()` and the consumer calls
+    `read()`. Both sides only ever advance their own counter, so no lock is needed
+    between them. When the ring is full the newest frames are dropped and accounted
+    for, so timestamps derived from the frame counters stay aligned with the stream.
+    """
+
+    def __init__(self, capacity: int, channels: int = 1, dtype=np.int16):
+        if capacity <= 0:
+            raise ValueError("Ring buffer capacity must be positive.")
+        self.capacity = int(capacity)
+        self.channels = int(channels)
+        self.buffer = np.zeros((self.capacity, self.channels), dtype=dtype)
+
+        # Monotonic frame counters. Only the producer writes `write_index` and only
+        # the consumer writes `read_index`.
+        self.write_index = 0
+        self.read_index = 0
+
+        # Stream frame position of the consumer, i.e. `read_index` plus all the frames
+        # dropped before it. Used to derive timestamps.
+        self.stream_index = 0
+
+        self.dropped_frames = 0
+        self.overruns = 0
+        self._gaps = deque()  # (write_index at the drop, num frames dropped)
+        self._data_ready = threading.Event()
+
+    @property
+    def available(self) -> int:
+        return self.write_index - self.read_index
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def write(self, data: np.ndarray) -> int:
+        """
+        Producer side. Copies as much of `data` into the ring as fits and returns the
+        number of frames written.
+        """
+        frames = data.reshape(-1, self.channels)
+        num_frames = frames.shape[0]
+        num_to_write = min(num_frames, self.free)
+        if num_to_write < num_frames:
+            num_dropped = num_frames - num_to_write
+            self.dropped_frames += num_dropped
+            self.overruns += 1
+            self._gaps.append((self.write_index + num_to_write, num_dropped))
+
+        start = self.write_index % self.capacity
+        first = min(num_to_write, self.capacity - start)
+        self.buffer[start : start + first] = frames[:first]
+        if num_to_write > first:
+            self.buffer[: num_to_write - first] = frames[first:num_to_write]
+
+        # Publish only after the data is in place.
+        self.write_index += num_to_write
+        if num_to_write:
+            self._data_ready.set()
+        return num_to_write
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Consumer side. Block until there is data to read or `timeout` elapses.
+        """
+        if self.available:
+            return True
+        self._data_ready.clear()
+        if self.available:  # Written between the check and the clear.
+            return True
+        return self._data_ready.wait(timeout)
+
+    def read(self, max_frames: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """
+        Consumer side. Returns `(frames, stream_index)` where `stream_index` is the
+        position of the first returned frame in the stream, dropped frames included.
+        """
+        num_to_read = self.available
+        if max_frames is not None:
+            num_to_read = min(num_to_read, max_frames)
+
+        # Account for frames dropped before the data we're about to return.
+        while self._gaps and self._gaps[0][0] <= self.read_index:
+            _, num_dropped = self._gaps.popleft()
+            self.stream_index += num_dropped
+
+        # Don't read across a gap so the returned frames stay contiguous in time.
+        if self._gaps:
+            num_to_read = min(num_to_read, self._gaps[0][0] - self.read_index)
+
+        out = np.empty((num_to_read, self.channels), dtype=self.buffer.dtype)
+        start = self.read_index % self.capacity
+        first = min(num_to_read, self.capacity - start)
+        out[:first] = self.buffer[start : start + first]
+        if num_to_read > first:
+            out[first:] = self.buffer[: num_to_read - first]
+
+        stream_index = self.stream_index
+        self.read_index += num_to_read
+        self.stream_index += num_to_read
+        if self.channels == 1:
+            out = out.reshape(-1)
+        return out, stream_index
+
+
+class RollingAudioBuffer:
+    """
+    Preallocated buffer that always holds the most recent `capacity` samples,
+    overwriting the oldest ones. Single threaded.
+    """
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        if capacity <= 0:
+            raise ValueError("Rolling buffer capacity must be positive.")
+        self.capacity = int(capacity)
+        self.buffer = np.zeros(self.capacity, dtype=dtype)
+        self.write_index = 0  # Total number of samples ever written.
+
+    @property
+    def size(self) -> int:
+        return min(self.write_index, self.capacity)
+
+    def write(self, data: np.ndarray) -> None:
+        num_skipped = max(0, data.size - self.capacity)
+        self.write_index += num_skipped
+        data = data[num_skipped:]
+        start = self.write_index % self.capacity
+        first = min(data.size, self.capacity - start)
+        self.buffer[start : start + first] = data[:first]
+        if data.size > first:
+            self.buffer[: data.size - first] = data[first:]
+        self.write_index += data.size
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Returns a copy of the buffered samples, oldest first.
+        """
+        if self.write_index <= self.capacity:
+            return self.buffer[: self.write_index].copy()
+        start = self.write_index % self.capacity
+        return np.concatenate([self.buffer[start:], self.buffer[:start]])
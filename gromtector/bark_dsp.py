@@ -0,0 +1,203 @@
+import glob
+import logging
+import os
+from typing import Dict, Sequence
+
+import numpy as np
+import scipy.signal as scipy_signal
+from scipy.io import wavfile
+
+from gromtector.spectrogram import get_spectrogram
+from gromtector.yamnet import MODEL_SAMPLE_RATE, prepare_waveform
+
+logger = logging.getLogger(__name__)
+
+
+STFT_NFFT = 256  # 16ms frames, 62.5Hz bins at the model rate.
+BARK_BAND_HZ = (300.0, 3000.0)  # Where most of a bark's energy is.
+FULL_BAND_HZ = (50.0, 8000.0)
+PITCH_RANGE_HZ = (250.0, 1000.0)  # Bark fundamental frequencies.
+MIN_LEVEL_DB = -75.0  # Quieter windows are never barks.
+LOUD_FRAMES_DB = 10.0  # Frames within this of the window's loudest one.
+TEMPLATE_MAX_S = 0.5
+
+# Logistic weights of the bark score over the window features. They were set by
+# hand on synthetic barks against noise, tones, hum, claps and voiced sounds;
+# check them on real clips with `gromtector evaluate --tf-model=dsp`.
+FEATURE_WEIGHTS = {
+    "band_ratio": 5.0,
+    "onset": 1.5,
+    "flux": 1.0,
+    "harmonicity": 6.0,
+    "burstiness": 2.0,
+}
+FEATURE_BIAS = -12.5
+
+
+def bark_band_spectrogram(waveforms: np.ndarray):
+    """
+    `[..., bins, frames]` power spectrogram of model-rate float32 waveforms (any
+    leading batch axes), with its frequency axis.
+    """
+    Sxx, freqs, _ = get_spectrogram(waveforms, MODEL_SAMPLE_RATE, nfft=STFT_NFFT)
+    return Sxx.astype(np.float32), freqs
+
+
+def window_features(waveforms: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per window of a `[windows, samples]` batch:
+
+    - `level_db`: the mean power, gating out near silence;
+    - `band_ratio`: the share of the energy in the bark band;
+    - `onset`: the strongest bark band onset over the window's median flux;
+    - `flux`: the mean positive log spectral flux of the bark band, per frame;
+    - `harmonicity`: the normalised autocorrelation peak at bark pitches,
+      averaged over the loud frames;
+    - `burstiness`: the share of quiet frames, as barks are short loud bursts
+      and engines, fans or rain are not.
+    """
+    waveforms = np.atleast_2d(np.asarray(waveforms, dtype=np.float32))
+    Sxx, freqs = bark_band_spectrogram(waveforms)
+    bark_bins = (freqs >= BARK_BAND_HZ[0]) & (freqs < BARK_BAND_HZ[1])
+    full_bins = (freqs >= FULL_BAND_HZ[0]) & (freqs <= FULL_BAND_HZ[1])
+
+    frame_power = Sxx[:, full_bins, :].sum(axis=1)  # [windows, frames]
+    bark_power = Sxx[:, bark_bins, :].sum(axis=1)
+    tiny = np.float32(1e-12)
+    level_db = 10 * np.log10(frame_power.mean(axis=1) + tiny)
+    band_ratio = bark_power.sum(axis=1) / (frame_power.sum(axis=1) + tiny)
+
+    log_bark = np.log(Sxx[:, bark_bins, :] + tiny)
+    # [windows, frames - 1]
+    flux = np.maximum(np.diff(log_bark, axis=2), 0.0).mean(axis=1)
+    onset = flux.max(axis=1) / (np.median(flux, axis=1) + 1e-3)
+
+    # The autocorrelation of each frame is the inverse FFT of its power spectrum.
+    autocorr = np.fft.irfft(Sxx, axis=1)
+    lags = np.arange(autocorr.shape[1])
+    pitch_lags = (lags >= MODEL_SAMPLE_RATE / PITCH_RANGE_HZ[1]) & (
+        lags <= MODEL_SAMPLE_RATE / PITCH_RANGE_HZ[0]
+    )
+    frame_harmonicity = autocorr[:, pitch_lags, :].max(axis=1) / (
+        autocorr[:, 0, :] + tiny
+    )
+    frame_db = 10 * np.log10(frame_power + tiny)
+    loud = frame_db >= frame_db.max(axis=1, keepdims=True) - LOUD_FRAMES_DB
+    harmonicity = (frame_harmonicity * loud).sum(axis=1) / loud.sum(axis=1)
+
+    return {
+        "level_db": level_db,
+        "band_ratio": band_ratio,
+        "onset": np.log1p(onset),
+        "flux": flux.mean(axis=1),
+        "harmonicity": np.clip(harmonicity, 0.0, 1.0),
+        "burstiness": 1.0 - loud.mean(axis=1),
+    }
+
+
+def bark_probability(features: Dict[str, np.ndarray]) -> np.ndarray:
+    logits = FEATURE_BIAS + sum(
+        weight * features[name] for name, weight in FEATURE_WEIGHTS.items()
+    )
+    probability = 1.0 / (1.0 + np.exp(-logits))
+    return np.where(features["level_db"] >= MIN_LEVEL_DB, probability, 0.0)
+
+
+def _normalised_bark_band(waveform: np.ndarray, loud_only: bool = False) -> np.ndarray:
+    Sxx, freqs = bark_band_spectrogram(waveform)
+    bark_bins = (freqs >= BARK_BAND_HZ[0]) & (freqs < BARK_BAND_HZ[1])
+    log_bark = np.log(Sxx[bark_bins, :] + 1e-12)
+    if loud_only:
+        # Templates are cut down to the bark itself, from its first to its last
+        # loud frame, so the silence around it doesn't take part in matches.
+        frame_db = 10 * np.log10(Sxx[bark_bins, :].sum(axis=0) + 1e-12)
+        loud = np.flatnonzero(frame_db >= frame_db.max() - LOUD_FRAMES_DB)
+        log_bark = log_bark[:, loud[0] : loud[-1] + 1]
+    return log_bark - log_bark.mean(axis=0, keepdims=True)
+
+
+class BarkTemplates:
+    """
+    Barks of known dogs, one 16kHz WAV clip each (named after the dog), matched
+    against windows by normalised cross-correlation of their bark band log
+    spectrograms over time.
+    """
+
+    def __init__(self, templates: Dict[str, np.ndarray]):
+        self.names = list(templates)
+        self.templates = [
+            _normalised_bark_band(waveform, loud_only=True)
+            for waveform in templates.values()
+        ]
+
+    @classmethod
+    def load(cls, templates_dir: str) -> "BarkTemplates":
+        templates = {}
+        for path in sorted(glob.glob(os.path.join(templates_dir, "*.wav"))):
+            rate, pcm = wavfile.read(path)
+            if pcm.ndim > 1:
+                pcm = pcm.mean(axis=1).astype(pcm.dtype)
+            if pcm.dtype == np.int16:
+                waveform = prepare_waveform(pcm)
+            else:
+                waveform = pcm.astype(np.float32)
+            if rate != MODEL_SAMPLE_RATE:
+                waveform = scipy_signal.resample_poly(waveform, MODEL_SAMPLE_RATE, rate)
+            waveform = waveform[: int(TEMPLATE_MAX_S * MODEL_SAMPLE_RATE)]
+            templates[os.path.splitext(os.path.basename(path))[0]] = waveform
+        if not templates:
+            raise RuntimeError('No bark template WAVs in "{}".'.format(templates_dir))
+        logger.info("Loaded bark templates of %s.", ", ".join(templates))
+        return cls(templates)
+
+    def match(self, waveform: np.ndarray) -> Dict[str, float]:
+        """
+        Each dog's best correlation, in [-1, 1], with any part of `waveform`.
+        """
+        window = _normalised_bark_band(waveform)
+        matches = {}
+        for name, template in zip(self.names, self.templates):
+            template = template[:, : window.shape[1]]
+            length = template.shape[1]
+            correlation = scipy_signal.correlate(window, template, mode="valid")[0]
+            # The norm of every window segment the template slides over.
+            energy = np.cumsum(np.r_[0.0, (window ** 2).sum(axis=0)])
+            segment_norms = np.sqrt(energy[length:] - energy[:-length])
+            matches[name] = float(
+                (
+                    correlation / (segment_norms * np.linalg.norm(template) + 1e-12)
+                ).max()
+            )
+        return matches
+
+
+def bark_scores(waveforms: np.ndarray, templates: BarkTemplates = None) -> np.ndarray:
+    """
+    `[windows]` bark scores in [0, 1]. With templates, a bark also has to look
+    like one of the known dogs: the score is the geometric mean of the generic
+    score and the best template match.
+    """
+    waveforms = np.atleast_2d(waveforms)
+    scores = bark_probability(window_features(waveforms))
+    if templates is not None:
+        best_matches = np.array(
+            [max(templates.match(waveform).values()) for waveform in waveforms]
+        )
+        scores = np.sqrt(scores * np.clip(best_matches, 0.0, 1.0))
+    return scores.astype(np.float32)
+
+
+def score_vectors(
+    bark_scores: np.ndarray, labels: Sequence[str], bark_classes: Sequence[str]
+) -> np.ndarray:
+    """
+    `[windows, classes]` score vectors over `labels` with the bark score on every
+    one of `bark_classes` and zero elsewhere, the shape YAMNet's scores have.
+    """
+    lower_labels = [label.lower() for label in labels]
+    indices = [
+        lower_labels.index(c.lower()) for c in bark_classes if c.lower() in lower_labels
+    ]
+    scores = np.zeros((bark_scores.size, len(labels)), dtype=np.float32)
+    scores[:, indices] = bark_scores[:, np.newaxis]
+    return scores
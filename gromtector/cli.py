@@ -191,11 +191,9 @@ def main():
         global AUDIO_OUTPUT, AUDIO_OUTPUT_STREAM
         AUDIO_OUTPUT = pyaudio.PyAudio()
         AUDIO_OUTPUT_STREAM = AUDIO_OUTPUT.open(
-            format=AUDIO_OUTPUT.get_format_from_width(
-                aud_input.audio_segment.seg.sample_width,  # or maybe frame_width?
-            ),
-            channels=aud_input.audio_segment.channels,
-            rate=aud_input.audio_segment.frame_rate,
+            format=AUDIO_OUTPUT.get_format_from_width(aud_input.sample_width),
+            channels=aud_input.channels,
+            rate=aud_input.sample_rate,
             output=True,
         )
 
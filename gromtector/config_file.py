@@ -0,0 +1,110 @@
+import logging
+import os
+from typing import Any, Callable, Dict, Sequence
+
+from gromtector.rules import parse_rules
+
+logger = logging.getLogger(__name__)
+
+
+def _threshold(value: Any) -> float:
+    value = float(value)
+    if not 0.0 <= value <= 1.0:
+        raise ValueError("{} is not between 0 and 1".format(value))
+    return value
+
+
+def _string_list(value: Any) -> Sequence[str]:
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError("{!r} is not a list of strings".format(value))
+    return value
+
+
+def _optional_string(value: Any) -> str:
+    if value is not None and not isinstance(value, str):
+        raise ValueError("{!r} is not a string".format(value))
+    return value or None
+
+
+# The settings a config file can hold, by the CLI option they override, and how
+# their values are checked. They can all change while the app runs.
+RELOADABLE_OPTIONS: Dict[str, Callable[[Any], Any]] = {
+    "--dog-class-threshold": _threshold,
+    "--dog-audio-class-threshold": _threshold,
+    "--animal-classes": _string_list,
+    "--dog-noise-classes": _string_list,
+    "--bark-response-audio": _string_list,
+    "--bark-notify-email": _optional_string,
+    "--gmail-app-pw": _optional_string,
+    "--rules": parse_rules,
+}
+
+
+def _parse(config_path: str, text: str) -> dict:
+    if config_path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError(
+                'Reading "{}" needs PyYAML, "pip install pyyaml" or use TOML.'.format(
+                    config_path
+                )
+            )
+        return yaml.safe_load(text) or {}
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11.
+        import tomli as tomllib
+    return tomllib.loads(text)
+
+
+def load_config_file(config_path: str) -> Dict[str, Any]:
+    """
+    Reads a TOML (or YAML, by extension) config file into CLI option keys, e.g.
+    `dog_class_threshold = 0.8` becomes `{"--dog-class-threshold": 0.8}`.
+
+    The whole file is checked before anything is returned, so a half-edited or
+    invalid file raises `RuntimeError` and never applies partially.
+    """
+    with open(config_path) as f:
+        text = f.read()
+    try:
+        raw_config = _parse(config_path, text)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError('Cannot parse "{}": {}'.format(config_path, e))
+    if not isinstance(raw_config, dict):
+        raise RuntimeError('"{}" is not a table of settings.'.format(config_path))
+
+    config = {}
+    for key, value in raw_config.items():
+        option = "--" + key.replace("_", "-")
+        check = RELOADABLE_OPTIONS.get(option)
+        if check is None:
+            raise RuntimeError(
+                'Unknown setting "{}" in "{}", expected one of: {}.'.format(
+                    key,
+                    config_path,
+                    ", ".join(o[2:].replace("-", "_") for o in RELOADABLE_OPTIONS),
+                )
+            )
+        try:
+            config[option] = check(value)
+        except (TypeError, ValueError) as e:
+            raise RuntimeError('Invalid "{}" in "{}": {}'.format(key, config_path, e))
+
+    if bool(config.get("--bark-notify-email")) != bool(config.get("--gmail-app-pw")):
+        raise RuntimeError(
+            '"{}" needs both bark_notify_email and gmail_app_pw, or neither.'.format(
+                config_path
+            )
+        )
+    return config
+
+
+def config_file_stamp(config_path: str):
+    stat = os.stat(config_path)
+    return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,210 @@
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Iterable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS barks (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    begin_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    duration_s REAL NOT NULL,
+    trigger_classes TEXT,
+    dog_class_threshold REAL,
+    dog_audio_class_threshold REAL,
+    clip_path TEXT
+);
+CREATE INDEX IF NOT EXISTS barks_begin_ts ON barks (begin_ts);
+CREATE INDEX IF NOT EXISTS barks_source_begin_ts ON barks (source, begin_ts);
+CREATE INDEX IF NOT EXISTS barks_duration_s ON barks (duration_s);
+"""
+
+BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+
+def to_epoch(timestamp: Optional[datetime]) -> Optional[float]:
+    return None if timestamp is None else timestamp.timestamp()
+
+
+class DetectionStore:
+    """
+    SQLite store of bark episodes. Timestamps are stored as UTC epoch seconds so
+    time range filters are plain index range scans; grouping happens in local time.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add_barks(self, events: Iterable[dict]) -> None:
+        rows = [
+            (
+                evt["source"],
+                to_epoch(evt["begin_timestamp"]),
+                to_epoch(evt["end_timestamp"]),
+                (evt["end_timestamp"] - evt["begin_timestamp"]).total_seconds(),
+                json.dumps(
+                    [
+                        {"label": cl["label"], "score": float(cl["score"])}
+                        for cl in evt["trigger_classes"] or []
+                    ]
+                ),
+                evt["dog_class_threshold"],
+                evt["dog_audio_class_threshold"],
+                evt.get("clip_path"),
+            )
+            for evt in events
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO barks (source, begin_ts, end_ts, duration_s,"
+                " trigger_classes, dog_class_threshold, dog_audio_class_threshold,"
+                " clip_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def set_clip_paths(self, clips: Iterable[Tuple[str, datetime, str]]) -> None:
+        """
+        Attaches clip paths to the barks with the given `(source, begin timestamp)`.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE barks SET clip_path = ? WHERE source = ? AND begin_ts = ?",
+                [(path, source, to_epoch(begin)) for source, begin, path in clips],
+            )
+
+    def _where(
+        self,
+        since: Optional[datetime],
+        until: Optional[datetime],
+        source: Optional[str],
+    ) -> Tuple[str, list]:
+        clauses = []
+        params = []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if since is not None:
+            clauses.append("begin_ts >= ?")
+            params.append(to_epoch(since))
+        if until is not None:
+            clauses.append("begin_ts < ?")
+            params.append(to_epoch(until))
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def barks_per_bucket(
+        self,
+        bucket: str = "day",
+        since: datetime = None,
+        until: datetime = None,
+        source: str = None,
+    ) -> Sequence[Tuple[str, int, float]]:
+        """
+        Returns `(bucket, number of barks, total bark seconds)` rows in time order.
+        """
+        where, params = self._where(since, until, source)
+        return self.conn.execute(
+            "SELECT strftime(?, begin_ts, 'unixepoch', 'localtime') AS bucket,"
+            " COUNT(*), SUM(duration_s) FROM barks {} GROUP BY bucket"
+            " ORDER BY bucket".format(where),
+            [BUCKET_FORMATS[bucket]] + params,
+        ).fetchall()
+
+    def longest_barks(
+        self,
+        limit: int = 10,
+        since: datetime = None,
+        until: datetime = None,
+        source: str = None,
+    ) -> Sequence[Tuple[str, float, float, Optional[str]]]:
+        """
+        Returns `(source, begin epoch, duration seconds, clip path)` rows.
+        """
+        where, params = self._where(since, until, source)
+        return self.conn.execute(
+            "SELECT source, begin_ts, duration_s, clip_path FROM barks {}"
+            " ORDER BY duration_s DESC LIMIT ?".format(where),
+            params + [limit],
+        ).fetchall()
+
+    def busiest_hours_of_day(
+        self, since: datetime = None, until: datetime = None, source: str = None
+    ) -> Sequence[Tuple[str, int, float]]:
+        """
+        Returns `(hour of day, number of barks, total bark seconds)` rows, busiest
+        first.
+        """
+        where, params = self._where(since, until, source)
+        return self.conn.execute(
+            "SELECT strftime('%H', begin_ts, 'unixepoch', 'localtime') AS hour,"
+            " COUNT(*), SUM(duration_s) FROM barks {} GROUP BY hour"
+            " ORDER BY COUNT(*) DESC".format(where),
+            params,
+        ).fetchall()
+
+
+def parse_date(text: Optional[str]) -> Optional[datetime]:
+    """
+    Parses an ISO 8601 date/time in local time unless it has a timezone.
+    """
+    if not text:
+        return None
+    timestamp = datetime.fromisoformat(text)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.astimezone()
+    return timestamp
+
+
+def print_report(args: dict) -> None:
+    store = DetectionStore(args["--db"])
+    since = parse_date(args["--since"])
+    until = parse_date(args["--until"])
+    source = args["--source"]
+    bucket = args["--by"]
+    if bucket not in BUCKET_FORMATS:
+        raise RuntimeError(
+            'Unknown report bucket "{}", use one of {}.'.format(
+                bucket, ", ".join(BUCKET_FORMATS)
+            )
+        )
+    top = int(args["--top"])
+
+    print("Barks per {}:".format(bucket))
+    for bucket_name, count, total_s in store.barks_per_bucket(
+        bucket, since, until, source
+    ):
+        print("  {}  {:5d} barks  {:8.1f}s".format(bucket_name, count, total_s))
+
+    print("\nLongest episodes:")
+    for bark_source, begin_ts, duration_s, clip_path in store.longest_barks(
+        top, since, until, source
+    ):
+        print(
+            "  {}  {}  {:8.1f}s  {}".format(
+                datetime.fromtimestamp(begin_ts).strftime("%Y-%m-%d %H:%M:%S"),
+                bark_source,
+                duration_s,
+                clip_path or "",
+            )
+        )
+
+    print("\nBusiest hours of the day:")
+    for hour, count, total_s in store.busiest_hours_of_day(since, until, source)[:top]:
+        print("  {}:00  {:5d} barks  {:8.1f}s".format(hour, count, total_s))
+
+    store.close()
@@ -0,0 +1,319 @@
+import csv
+import logging
+import os
+import time
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from gromtector.app.systems.dog_audio_detection import (
+    ANIMAL_CLASSES_OF_INTEREST,
+    DOG_NOISE_OF_INTEREST,
+)
+from gromtector.app.systems.memory_diagnostics import get_rss_bytes
+from gromtector.audio_file import AudioFile, FilePlaybackFinished
+from gromtector.feature_cache import FeatureCache
+from gromtector.yamnet import (
+    MODEL_SAMPLE_RATE,
+    WINDOW_NUM_SAMPLES,
+    load_yamnet,
+    prepare_waveform,
+)
+
+logger = logging.getLogger(__name__)
+
+
+WINDOW_HOP_SAMPLES = int(0.48 * MODEL_SAMPLE_RATE)
+TOP_K = 10  # The detection rule only sees the top classes of each window.
+MIN_ANIMAL_CLASSES = 3  # More than two animal classes need to clear the threshold.
+INFER_BATCH_SIZE = 64
+MAX_SWEEP_CELLS = 50_000_000  # Window x threshold pairs evaluated per block.
+
+
+def load_labelled_clips(labels_path: str) -> Tuple[Sequence[str], np.ndarray]:
+    """
+    Reads a `path,label` CSV, `label` being 1 for clips with barking and 0 for
+    clips without. Relative paths are relative to the CSV.
+    """
+    base_dir = os.path.dirname(os.path.abspath(labels_path))
+    paths = []
+    labels = []
+    with open(labels_path, newline="") as f:
+        for row in csv.DictReader(f):
+            paths.append(os.path.join(base_dir, row["path"]))
+            labels.append(int(row["label"]))
+    return paths, np.array(labels, dtype=bool)
+
+
+def load_clip_pcm(clip_path: str) -> np.ndarray:
+    """
+    The clip's model-rate float32 waveform, straight from its feature cache when
+    it has one.
+    """
+    cache = FeatureCache.open(clip_path)
+    if cache is not None:
+        return cache.waveform
+    audio_file = AudioFile(clip_path, chunk_size=MODEL_SAMPLE_RATE * 60)
+    if audio_file.sample_rate != MODEL_SAMPLE_RATE:
+        raise RuntimeError(
+            '"{}" is not {}Hz, run "gromtector extract" on it first.'.format(
+                clip_path, MODEL_SAMPLE_RATE
+            )
+        )
+    chunks = []
+    try:
+        while True:
+            chunks.append(audio_file.read())
+    except FilePlaybackFinished:
+        pass
+    audio_file.close()
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return prepare_waveform(np.concatenate(chunks))
+
+
+def clip_windows(waveform: np.ndarray) -> np.ndarray:
+    """
+    `[windows, WINDOW_NUM_SAMPLES]` model windows every 0.48s, the last one padded.
+    """
+    if waveform.size < WINDOW_NUM_SAMPLES:
+        waveform = np.pad(waveform, (0, WINDOW_NUM_SAMPLES - waveform.size))
+    num_windows = 1 + (waveform.size - WINDOW_NUM_SAMPLES) // WINDOW_HOP_SAMPLES
+    return np.lib.stride_tricks.sliding_window_view(waveform, WINDOW_NUM_SAMPLES)[
+        ::WINDOW_HOP_SAMPLES
+    ][:num_windows]
+
+
+def score_clips(model_path: str, clip_paths: Sequence[str]) -> dict:
+    """
+    Runs the model once over every window of every clip and returns the full
+    score matrix with the window-to-clip mapping, and what scoring cost: the
+    backend's time per window and the process RSS once done, to compare backends
+    on the same clips.
+    """
+    model = load_yamnet(model_path)
+    scores = []
+    window_clips = []
+    durations_s = []
+    infer_s = 0.0
+    start = time.time()
+    for clip_index, clip_path in enumerate(clip_paths):
+        waveform = load_clip_pcm(clip_path)
+        durations_s.append(waveform.size / MODEL_SAMPLE_RATE)
+        windows = clip_windows(waveform)
+        for begin in range(0, len(windows), INFER_BATCH_SIZE):
+            batch = np.ascontiguousarray(windows[begin : begin + INFER_BATCH_SIZE])
+            infer_start = time.perf_counter()
+            batch_scores, _ = model.infer_batch(batch)
+            infer_s += time.perf_counter() - infer_start
+            scores.append(batch_scores.astype(np.float32))
+        window_clips.append(np.full(len(windows), clip_index, dtype=np.int32))
+        logger.debug("Scored %s (%d windows).", clip_path, len(windows))
+    logger.info("Scored %d clips in %.1fs.", len(clip_paths), time.time() - start)
+    window_clips = np.concatenate(window_clips)
+    return {
+        "scores": np.concatenate(scores),
+        "window_clips": window_clips,
+        "durations_s": np.array(durations_s),
+        "labels": np.array(model.labels),
+        "backend": np.array(model.name),
+        "ms_per_window": np.array(1000 * infer_s / max(1, window_clips.size)),
+        "rss_bytes": np.array(get_rss_bytes()),
+    }
+
+
+def rule_features(
+    scores: np.ndarray, labels: Sequence[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces `[windows, classes]` scores to the two numbers the detection rule
+    thresholds per window, counting only the top `TOP_K` classes like the live
+    detector does:
+
+    - the `MIN_ANIMAL_CLASSES`-th highest animal class score, so "enough animal
+      classes clear t" is "this score >= t";
+    - the highest dog noise class score.
+    """
+    lower_labels = np.char.lower(np.asarray(labels, dtype=str))
+    animal_idx = np.flatnonzero(np.isin(lower_labels, ANIMAL_CLASSES_OF_INTEREST))
+    noise_idx = np.flatnonzero(np.isin(lower_labels, DOG_NOISE_OF_INTEREST))
+
+    top_k_floor = -np.partition(-scores, TOP_K - 1, axis=1)[:, TOP_K - 1 : TOP_K]
+    in_top_k = scores >= top_k_floor
+    masked = np.where(in_top_k, scores, -np.inf)
+
+    animal = np.sort(masked[:, animal_idx], axis=1)[:, -MIN_ANIMAL_CLASSES]
+    noise = masked[:, noise_idx].max(axis=1)
+    return animal, noise
+
+
+def sweep_thresholds(
+    animal: np.ndarray,
+    noise: np.ndarray,
+    window_clips: np.ndarray,
+    clip_labels: np.ndarray,
+    durations_s: np.ndarray,
+    animal_thresholds: np.ndarray,
+    noise_thresholds: np.ndarray,
+) -> dict:
+    """
+    Evaluates every `(animal threshold, noise threshold)` pair at once. Returns
+    `[len(animal_thresholds), len(noise_thresholds)]` metric arrays; a clip is
+    detected if any of its windows fires, false alarms are bark episodes (runs of
+    firing windows) in clips without barking.
+
+    Animal thresholds are swept in blocks to bound the memory used by the
+    `[windows, thresholds, thresholds]` intermediates.
+    """
+    block_size = max(1, MAX_SWEEP_CELLS // max(1, animal.size * noise_thresholds.size))
+    blocks = [
+        _sweep_block(
+            animal,
+            noise,
+            window_clips,
+            clip_labels,
+            durations_s,
+            animal_thresholds[begin : begin + block_size],
+            noise_thresholds,
+        )
+        for begin in range(0, animal_thresholds.size, block_size)
+    ]
+    return {
+        name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]
+    }
+
+
+def _sweep_block(
+    animal: np.ndarray,
+    noise: np.ndarray,
+    window_clips: np.ndarray,
+    clip_labels: np.ndarray,
+    durations_s: np.ndarray,
+    animal_thresholds: np.ndarray,
+    noise_thresholds: np.ndarray,
+) -> dict:
+    # [windows, animal thresholds, noise thresholds]
+    fired = (animal[:, None, None] >= animal_thresholds[None, :, None]) & (
+        noise[:, None, None] >= noise_thresholds[None, None, :]
+    )
+
+    clip_starts = np.flatnonzero(np.r_[True, window_clips[1:] != window_clips[:-1]])
+    clip_ids = window_clips[clip_starts]
+    detected = np.logical_or.reduceat(fired, clip_starts, axis=0)
+    positive = clip_labels[clip_ids][:, None, None]
+    tp = (detected & positive).sum(axis=0)
+    fp = (detected & ~positive).sum(axis=0)
+    fn = (~detected & positive).sum(axis=0)
+
+    precision = np.divide(tp, tp + fp, out=np.ones(tp.shape), where=(tp + fp) > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros(tp.shape), where=(tp + fn) > 0)
+    f1 = np.divide(
+        2 * precision * recall,
+        precision + recall,
+        out=np.zeros(tp.shape),
+        where=(precision + recall) > 0,
+    )
+
+    episode_starts = fired.copy()
+    episode_starts[1:] &= ~fired[:-1]
+    episode_starts[clip_starts] = fired[clip_starts]
+    negative_windows = ~clip_labels[window_clips]
+    false_alarms = episode_starts[negative_windows].sum(axis=0)
+    negative_hours = durations_s[~clip_labels].sum() / 3600
+    false_alarms_per_hour = (
+        false_alarms / negative_hours if negative_hours else np.zeros(tp.shape)
+    )
+
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "false_alarms_per_hour": false_alarms_per_hour,
+    }
+
+
+def run_evaluation(args: dict) -> None:
+    clip_paths, clip_labels = load_labelled_clips(args["<LABELS_CSV>"])
+    scores_path = args["--scores"]
+    if scores_path and os.path.exists(scores_path) and not args["--rescore"]:
+        logger.info('Loading scores from "%s".', scores_path)
+        scored = dict(np.load(scores_path))
+        if scored["durations_s"].size != len(clip_paths):
+            raise RuntimeError(
+                '"{}" was scored from a different clip list, use --rescore.'.format(
+                    scores_path
+                )
+            )
+    else:
+        if not args["--tf-model"]:
+            raise RuntimeError('Scoring the clips needs a "--tf-model".')
+        scored = score_clips(args["--tf-model"], clip_paths)
+        if scores_path:
+            np.savez(scores_path, **scored)
+
+    step = float(args["--grid-step"])
+    thresholds = np.round(np.arange(step, 1.0 + step / 2, step), 6)
+
+    start = time.time()
+    animal, noise = rule_features(scored["scores"], scored["labels"])
+    metrics = sweep_thresholds(
+        animal,
+        noise,
+        scored["window_clips"],
+        clip_labels,
+        scored["durations_s"],
+        thresholds,
+        thresholds,
+    )
+    logger.info(
+        "Swept %d threshold pairs over %d windows in %.2fs.",
+        thresholds.size ** 2,
+        animal.size,
+        time.time() - start,
+    )
+
+    rows = [
+        (
+            thresholds[i],
+            thresholds[j],
+            metrics["precision"][i, j],
+            metrics["recall"][i, j],
+            metrics["f1"][i, j],
+            metrics["false_alarms_per_hour"][i, j],
+        )
+        for i in range(thresholds.size)
+        for j in range(thresholds.size)
+    ]
+    rows.sort(key=lambda row: (-row[4], row[5]))
+
+    if args["--output"]:
+        with open(args["--output"], "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "dog_class_threshold",
+                    "dog_audio_class_threshold",
+                    "precision",
+                    "recall",
+                    "f1",
+                    "false_alarms_per_hour",
+                ]
+            )
+            writer.writerows(rows)
+
+    print(
+        "{} clips ({} with barking), {} windows.".format(
+            clip_labels.size, clip_labels.sum(), animal.size
+        )
+    )
+    if "backend" in scored:  # Not in score files from before it was recorded.
+        print(
+            "Scored by the {} backend in {:.2f}ms per window, {:.0f}MiB RSS.".format(
+                scored["backend"],
+                float(scored["ms_per_window"]),
+                scored["rss_bytes"] / 2 ** 20,
+            )
+        )
+    print("  dog_class  dog_audio  precision  recall     f1  false alarms/h")
+    for row in rows[: int(args["--top"])]:
+        print("  {:9.2f}  {:9.2f}  {:9.3f}  {:6.3f}  {:5.3f}  {:14.2f}".format(*row))
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+
+from gromtector.audio_file import _find_wav_pcm16_data
+from gromtector.features import (
+    NUM_MEL_BINS,
+    STFT_HOP_SAMPLES,
+    STFT_WINDOW_SAMPLES,
+    frame_patches,
+    log_mel_frames,
+    num_log_mel_frames,
+)
+from gromtector.yamnet import MODEL_SAMPLE_RATE, prepare_waveform
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 1
+WAVEFORM_SUFFIX = ".waveform.npy"
+LOG_MEL_SUFFIX = ".logmel.npy"
+META_SUFFIX = ".features.json"
+BLOCK_FRAMES = 6000  # Log-mel frames computed per block, a minute of audio.
+
+
+def _source_stamp(wav_path: str) -> dict:
+    stat = os.stat(wav_path)
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+class FeatureCache:
+    """
+    Memory-mapped features of one extracted 16kHz mono WAV, stored next to it:
+
+    - `<wav>.waveform.npy`: the float32 model input waveform.
+    - `<wav>.logmel.npy`: `[frames, 64]` float32 YAMNet log-mel frames, 10ms apart.
+
+    `patches` cuts the frames into the model's 0.96s/0.48s patches as a view, so
+    windows are sliced straight out of the page cache without decoding or copies.
+    The cache is tied to the WAV's size and mtime and is stale once it changes.
+    """
+
+    def __init__(self, wav_path: str):
+        self.wav_path = wav_path
+        self.waveform = np.load(wav_path + WAVEFORM_SUFFIX, mmap_mode="r")
+        self.log_mel = np.load(wav_path + LOG_MEL_SUFFIX, mmap_mode="r")
+
+    @property
+    def patches(self) -> np.ndarray:
+        return frame_patches(self.log_mel)
+
+    def window(self, begin_s: float, duration_s: float) -> np.ndarray:
+        begin = int(begin_s * MODEL_SAMPLE_RATE)
+        return self.waveform[begin : begin + int(duration_s * MODEL_SAMPLE_RATE)]
+
+    @classmethod
+    def is_valid(cls, wav_path: str) -> bool:
+        try:
+            with open(wav_path + META_SUFFIX) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        return meta == _source_stamp(wav_path)
+
+    @classmethod
+    def open(cls, wav_path: str) -> Optional["FeatureCache"]:
+        """
+        Returns the cache of `wav_path`, or `None` if it is missing or stale.
+        """
+        if not cls.is_valid(wav_path):
+            return None
+        return cls(wav_path)
+
+    @classmethod
+    def build(cls, wav_path: str) -> None:
+        """
+        (Re)writes the cache of `wav_path` in constant memory, a block at a time.
+        Files are written under temporary names and renamed, and the stamp goes
+        last, so an interrupted build just leaves a stale cache.
+        """
+        wav_info = _find_wav_pcm16_data(wav_path)
+        if wav_info is None:
+            raise RuntimeError('"{}" is not a 16 bit PCM WAV.'.format(wav_path))
+        data_offset, num_samples, sample_rate, channels = wav_info
+        if sample_rate != MODEL_SAMPLE_RATE or channels != 1:
+            raise RuntimeError(
+                '"{}" is not {}Hz mono, extract it first.'.format(
+                    wav_path, MODEL_SAMPLE_RATE
+                )
+            )
+        stamp = _source_stamp(wav_path)
+        pcm = np.memmap(
+            wav_path, dtype="<i2", mode="r", offset=data_offset, shape=(num_samples,)
+        )
+
+        waveform_tmp = wav_path + WAVEFORM_SUFFIX + ".part"
+        log_mel_tmp = wav_path + LOG_MEL_SUFFIX + ".part"
+        waveform = np.lib.format.open_memmap(
+            waveform_tmp, mode="w+", dtype=np.float32, shape=(num_samples,)
+        )
+        num_frames = num_log_mel_frames(num_samples)
+        log_mel = np.lib.format.open_memmap(
+            log_mel_tmp, mode="w+", dtype=np.float32, shape=(num_frames, NUM_MEL_BINS)
+        )
+
+        block_samples = BLOCK_FRAMES * STFT_HOP_SAMPLES
+        for begin in range(0, num_samples, block_samples):
+            waveform[begin : begin + block_samples] = prepare_waveform(
+                pcm[begin : begin + block_samples]
+            )
+        for begin in range(0, num_frames, BLOCK_FRAMES):
+            end = min(begin + BLOCK_FRAMES, num_frames)
+            log_mel[begin:end] = log_mel_frames(
+                waveform[
+                    begin * STFT_HOP_SAMPLES : (end - 1) * STFT_HOP_SAMPLES
+                    + STFT_WINDOW_SAMPLES
+                ]
+            )
+        waveform.flush()
+        log_mel.flush()
+        del waveform, log_mel, pcm
+
+        os.replace(waveform_tmp, wav_path + WAVEFORM_SUFFIX)
+        os.replace(log_mel_tmp, wav_path + LOG_MEL_SUFFIX)
+        meta_tmp = wav_path + META_SUFFIX + ".part"
+        with open(meta_tmp, "w") as f:
+            json.dump(stamp, f)
+        os.replace(meta_tmp, wav_path + META_SUFFIX)
+
+
+def ensure_feature_cache(wav_path: str) -> bool:
+    """
+    Builds the cache of `wav_path` unless it is up to date. Returns whether it was
+    (re)built. Runs in the extract worker processes.
+    """
+    if FeatureCache.is_valid(wav_path):
+        return False
+    FeatureCache.build(wav_path)
+    return True
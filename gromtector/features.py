@@ -0,0 +1,128 @@
+import numpy as np
+
+from gromtector.yamnet import MODEL_SAMPLE_RATE
+
+
+# YAMNet's log-mel frontend parameters.
+STFT_WINDOW_SAMPLES = int(0.025 * MODEL_SAMPLE_RATE)
+STFT_HOP_SAMPLES = int(0.010 * MODEL_SAMPLE_RATE)
+FFT_LENGTH = 512
+NUM_MEL_BINS = 64
+MEL_MIN_HZ = 125.0
+MEL_MAX_HZ = 7500.0
+LOG_OFFSET = 0.001
+PATCH_FRAMES = 96  # 0.96s patches...
+PATCH_HOP_FRAMES = 48  # ...every 0.48s.
+
+_MEL_BREAK_FREQUENCY_HZ = 700.0
+_MEL_HIGH_FREQUENCY_Q = 1127.0
+
+
+def hertz_to_mel(frequencies_hz):
+    return _MEL_HIGH_FREQUENCY_Q * np.log1p(
+        np.asarray(frequencies_hz) / _MEL_BREAK_FREQUENCY_HZ
+    )
+
+
+def mel_weight_matrix(
+    num_mel_bins: int = NUM_MEL_BINS,
+    num_spectrogram_bins: int = FFT_LENGTH // 2 + 1,
+    sample_rate: int = MODEL_SAMPLE_RATE,
+    lower_edge_hz: float = MEL_MIN_HZ,
+    upper_edge_hz: float = MEL_MAX_HZ,
+) -> np.ndarray:
+    """
+    `[num_spectrogram_bins, num_mel_bins]` triangular HTK mel filterbank, the same
+    as `tf.signal.linear_to_mel_weight_matrix` (the DC bin gets no weight).
+    """
+    spectrogram_bins_mel = hertz_to_mel(
+        np.linspace(0.0, sample_rate / 2.0, num_spectrogram_bins)
+    )[1:, np.newaxis]
+    band_edges_mel = np.linspace(
+        hertz_to_mel(lower_edge_hz), hertz_to_mel(upper_edge_hz), num_mel_bins + 2
+    )
+    lower_edge_mel = band_edges_mel[:-2]
+    center_mel = band_edges_mel[1:-1]
+    upper_edge_mel = band_edges_mel[2:]
+
+    lower_slopes = (spectrogram_bins_mel - lower_edge_mel) / (center_mel - lower_edge_mel)
+    upper_slopes = (upper_edge_mel - spectrogram_bins_mel) / (upper_edge_mel - center_mel)
+    weights = np.maximum(0.0, np.minimum(lower_slopes, upper_slopes))
+    return np.pad(weights, ((1, 0), (0, 0))).astype(np.float32)
+
+
+_HANN_WINDOW = (
+    0.5 - 0.5 * np.cos(2 * np.pi * np.arange(STFT_WINDOW_SAMPLES) / STFT_WINDOW_SAMPLES)
+).astype(np.float32)
+_MEL_WEIGHTS = mel_weight_matrix()
+
+
+def num_log_mel_frames(num_samples: int) -> int:
+    if num_samples < STFT_WINDOW_SAMPLES:
+        return 0
+    return 1 + (num_samples - STFT_WINDOW_SAMPLES) // STFT_HOP_SAMPLES
+
+
+def log_mel_frames(waveform: np.ndarray) -> np.ndarray:
+    """
+    `[frames, NUM_MEL_BINS]` log-mel spectrogram of a float32 model-rate waveform,
+    one frame every 10ms.
+    """
+    num_frames = num_log_mel_frames(waveform.size)
+    if not num_frames:
+        return np.zeros((0, NUM_MEL_BINS), dtype=np.float32)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        waveform, STFT_WINDOW_SAMPLES
+    )[::STFT_HOP_SAMPLES][:num_frames]
+    magnitudes = np.abs(np.fft.rfft(windows * _HANN_WINDOW, n=FFT_LENGTH))
+    return np.log(magnitudes.astype(np.float32) @ _MEL_WEIGHTS + LOG_OFFSET)
+
+
+def mel_center_frequencies(num_mel_bins: int = NUM_MEL_BINS) -> np.ndarray:
+    """
+    Center frequency in Hz of every log-mel bin.
+    """
+    center_mel = np.linspace(
+        hertz_to_mel(MEL_MIN_HZ), hertz_to_mel(MEL_MAX_HZ), num_mel_bins + 2
+    )[1:-1]
+    return _MEL_BREAK_FREQUENCY_HZ * np.expm1(center_mel / _MEL_HIGH_FREQUENCY_Q)
+
+
+class LogMelStream:
+    """
+    `log_mel_frames` over a live stream of model-rate audio. Only the samples a
+    future frame still needs are kept, so every 10ms hop is transformed exactly
+    once however the audio is chunked, and the frames are the same as running
+    `log_mel_frames` over the whole stream.
+    """
+
+    def __init__(self):
+        self.pending = np.zeros(0, dtype=np.float32)  # Starts at the next frame.
+        self.num_frames = 0  # Frames produced so far.
+
+    def push(self, waveform: np.ndarray) -> np.ndarray:
+        """
+        Adds float32 samples and returns the `[frames, NUM_MEL_BINS]` frames they
+        completed.
+        """
+        samples = np.concatenate((self.pending, waveform))
+        frames = log_mel_frames(samples)
+        self.pending = samples[frames.shape[0] * STFT_HOP_SAMPLES :]
+        self.num_frames += frames.shape[0]
+        return frames
+
+
+def num_patches(num_frames: int) -> int:
+    if num_frames < PATCH_FRAMES:
+        return 0
+    return 1 + (num_frames - PATCH_FRAMES) // PATCH_HOP_FRAMES
+
+
+def frame_patches(frames: np.ndarray) -> np.ndarray:
+    """
+    `[patches, PATCH_FRAMES, NUM_MEL_BINS]` view of log-mel frames cut into the
+    model's overlapping 0.96s patches, without copying (works on memmaps too).
+    """
+    return np.lib.stride_tricks.sliding_window_view(
+        frames, PATCH_FRAMES, axis=0
+    )[::PATCH_HOP_FRAMES].transpose(0, 2, 1)[: num_patches(frames.shape[0])]
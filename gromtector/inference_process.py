@@ -0,0 +1,415 @@
+"""
+Runs a YAMNet model in a child process so inference doesn't compete for the GIL
+with capture, event dispatch and rendering.
+
+Each source's 16kHz audio goes through a `SharedAudioRing` the child reads the
+latest window from. Control messages and results go over pipes; results are sent
+as raw bytes:
+
+Result: source id length u16 | source id (utf-8) | num scores u32 | top k u16
+        | scores (f32) | top k class indices (u16)
+"""
+import logging
+import multiprocessing as mp
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gromtector.yamnet import MODEL_SAMPLE_RATE, WINDOW_NUM_SAMPLES, prepare_waveform
+
+logger = logging.getLogger(__name__)
+
+
+RING_SECONDS = 2.0
+READ_SAMPLES = MODEL_SAMPLE_RATE  # The child scores the latest second of each ring.
+RESULT_HEADER = struct.Struct("<IH")
+SOURCE_ID_LENGTH = struct.Struct("<H")
+TOP_K = 10
+RESTART_BACKOFF_S = 1.0
+MAX_RESTART_BACKOFF_S = 30.0
+
+
+class SharedAudioRing:
+    """
+    A single writer int16 ring in shared memory: an int64 count of the samples
+    written so far followed by the samples. Readers copy the latest window and
+    check the count again afterwards to detect the writer lapping them.
+    """
+
+    header_size: int = 8
+
+    def __init__(self, name: str = None, capacity: int = None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=self.header_size + capacity * 2
+            )
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.capacity = (self.shm.size - self.header_size) // 2
+        self.write_count = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray(
+            (self.capacity,), dtype=np.int16, buffer=self.shm.buf, offset=self.header_size
+        )
+        if self.owner:
+            self.write_count[0] = 0
+
+    def write(self, samples: np.ndarray, reserve: int = READ_SAMPLES) -> None:
+        """
+        Appends `samples`, at most `capacity - reserve` at a time so a reader's
+        latest `reserve` samples are never overwritten by a single write.
+        """
+        max_write = self.capacity - reserve
+        for begin in range(0, samples.size, max_write):
+            chunk = samples[begin : begin + max_write]
+            count = int(self.write_count[0])
+            start = count % self.capacity
+            first = min(chunk.size, self.capacity - start)
+            self.data[start : start + first] = chunk[:first]
+            self.data[: chunk.size - first] = chunk[first:]
+            self.write_count[0] = count + chunk.size
+
+    def read_latest(self, num_samples: int) -> Tuple[np.ndarray, int]:
+        """
+        Returns a copy of (up to) the latest `num_samples` and the write count at
+        their end.
+        """
+        while True:
+            count = int(self.write_count[0])
+            size = min(num_samples, count)
+            end = count % self.capacity
+            if size <= end:
+                samples = self.data[end - size : end].copy()
+            else:
+                samples = np.concatenate(
+                    (self.data[self.capacity - (size - end) :], self.data[:end])
+                )
+            if int(self.write_count[0]) - count <= self.capacity - size:
+                return samples, count
+
+    def close(self) -> None:
+        del self.write_count, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def encode_result(source: str, scores: np.ndarray, top_indices: np.ndarray) -> bytes:
+    source_bytes = source.encode("utf-8")
+    return b"".join(
+        (
+            SOURCE_ID_LENGTH.pack(len(source_bytes)),
+            source_bytes,
+            RESULT_HEADER.pack(scores.size, top_indices.size),
+            scores.astype("<f4", copy=False).tobytes(),
+            top_indices.astype("<u2", copy=False).tobytes(),
+        )
+    )
+
+
+def decode_result(data: bytes) -> Tuple[str, np.ndarray, np.ndarray]:
+    (source_size,) = SOURCE_ID_LENGTH.unpack_from(data)
+    offset = SOURCE_ID_LENGTH.size
+    source = data[offset : offset + source_size].decode("utf-8")
+    offset += source_size
+    num_scores, top_k = RESULT_HEADER.unpack_from(data, offset)
+    offset += RESULT_HEADER.size
+    scores = np.frombuffer(data, dtype="<f4", count=num_scores, offset=offset)
+    offset += num_scores * 4
+    top_indices = np.frombuffer(data, dtype="<u2", count=top_k, offset=offset)
+    return source, scores, top_indices.astype(np.intp)
+
+
+def run_inference_process(
+    model_path: str,
+    backend: str,
+    num_threads: Optional[int],
+    control_conn,
+    result_conn,
+    max_fps: float,
+):
+    """
+    The child process: scores the latest window of every source at `max_fps`
+    until the control pipe closes or says "stop". `backend` is a concrete one
+    (see `gromtector.yamnet.resolve_backend`), restarts never re-benchmark.
+    """
+    from gromtector.yamnet import select_backend
+
+    model = select_backend(backend, model_path, num_threads)  # Loaded and warmed up.
+    result_conn.send(("ready", list(model.labels)))
+
+    rings: Dict[str, SharedAudioRing] = {}
+    last_counts: Dict[str, int] = {}
+    interval_s = 1.0 / max_fps
+    next_time = time.monotonic()
+    try:
+        while True:
+            while control_conn.poll():
+                message = control_conn.recv()
+                if message[0] == "stop":
+                    return
+                if message[0] == "add_source":
+                    _, source, ring_name = message
+                    rings[source] = SharedAudioRing(name=ring_name)
+
+            for source, ring in rings.items():
+                pcm_int16, count = ring.read_latest(READ_SAMPLES)
+                if not pcm_int16.size or last_counts.get(source) == count:
+                    continue  # Nothing new since the last window.
+                last_counts[source] = count
+                scores, _ = model.infer(prepare_waveform(pcm_int16, WINDOW_NUM_SAMPLES))
+                top_indices = np.argsort(-scores)[:TOP_K]
+                result_conn.send_bytes(encode_result(source, scores, top_indices))
+
+            next_time = max(next_time + interval_s, time.monotonic())
+            time.sleep(max(0.0, next_time - time.monotonic()))
+    except (EOFError, BrokenPipeError):
+        pass  # The parent went away.
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+class InferenceProcess:
+    """
+    Parent side of the inference child process. Owns the shared rings (they
+    outlive child restarts) and restarts the child with a backoff when it dies.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        max_fps: float = 10.0,
+        backend: str = None,
+        num_threads: int = None,
+    ):
+        self.model_path = model_path
+        self.max_fps = max_fps
+        self.backend = backend
+        self.num_threads = num_threads
+        self.context = mp.get_context("spawn")
+        self.rings: Dict[str, SharedAudioRing] = {}
+        self.rings_lock = threading.Lock()
+        self.labels: Sequence[str] = None
+        self.process = None
+        self.control_conn = None
+        self.result_conn = None
+        self.num_restarts = 0
+        self.restart_backoff_s = RESTART_BACKOFF_S
+        self.next_start_time = 0.0
+
+    def start(self, timeout_s: float = 120.0) -> None:
+        control_recv, self.control_conn = self.context.Pipe(duplex=False)
+        self.result_conn, result_send = self.context.Pipe(duplex=False)
+        self.process = self.context.Process(
+            target=run_inference_process,
+            args=(
+                self.model_path,
+                self.backend,
+                self.num_threads,
+                control_recv,
+                result_send,
+                self.max_fps,
+            ),
+            name="gromtector-inference",
+            daemon=True,
+        )
+        self.process.start()
+        control_recv.close()
+        result_send.close()
+
+        if not self.result_conn.poll(timeout_s):
+            raise RuntimeError("The inference process didn't start in time.")
+        message = self.result_conn.recv()
+        self.labels = message[1]
+        with self.rings_lock:
+            for source, ring in self.rings.items():
+                self.control_conn.send(("add_source", source, ring.name))
+
+    def write(self, source: str, pcm_int16: np.ndarray) -> None:
+        ring = self.rings.get(source)
+        if ring is None:
+            ring = SharedAudioRing(capacity=int(RING_SECONDS * MODEL_SAMPLE_RATE))
+            with self.rings_lock:
+                self.rings[source] = ring
+                try:
+                    self.control_conn.send(("add_source", source, ring.name))
+                except (OSError, AttributeError):
+                    pass  # Sent again once the child restarts.
+        ring.write(pcm_int16)
+
+    def recv_result(
+        self, timeout_s: float
+    ) -> Optional[Tuple[str, np.ndarray, np.ndarray]]:
+        """
+        Waits up to `timeout_s` for a result. Restarts the child if it died.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.supervise()
+            return None
+        try:
+            if not self.result_conn.poll(timeout_s):
+                return None
+            return decode_result(self.result_conn.recv_bytes())
+        except (EOFError, OSError):
+            return None  # Dead child, restarted on the next call.
+
+    def supervise(self) -> None:
+        now = time.monotonic()
+        if now < self.next_start_time:
+            time.sleep(min(0.5, self.next_start_time - now))
+            return
+        if self.process is not None:
+            logger.error(
+                "Inference process died (exit code %s), restarting it.",
+                self.process.exitcode,
+            )
+            self.num_restarts += 1
+        try:
+            self.start()
+            self.restart_backoff_s = RESTART_BACKOFF_S
+        except Exception:
+            logger.exception(
+                "Failed to start the inference process, retrying in %.0fs.",
+                self.restart_backoff_s,
+            )
+            self.next_start_time = time.monotonic() + self.restart_backoff_s
+            self.restart_backoff_s = min(
+                self.restart_backoff_s * 2, MAX_RESTART_BACKOFF_S
+            )
+
+    def stop(self) -> None:
+        if self.process is not None:
+            try:
+                self.control_conn.send(("stop",))
+            except OSError:
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        with self.rings_lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings.clear()
+
+
+BENCH_CAPTURE_FRAMES = 1024  # Frames per simulated capture callback.
+BENCH_UI_FPS = 60.0
+
+
+def _benchmark_mode(model_path: str, mode: str, seconds: float) -> dict:
+    """
+    Simulates capture callbacks and a UI loop in this process while the model runs
+    either on a thread here (`mode == "thread"`) or in the child process.
+    """
+    from gromtector.spectrogram import get_spectrogram
+    from gromtector.yamnet import load_yamnet
+
+    rng = np.random.default_rng(0)
+    noise = rng.integers(-3000, 3000, MODEL_SAMPLE_RATE * 4, dtype=np.int16)
+    running = threading.Event()
+    running.set()
+    latest_audio = [np.zeros(MODEL_SAMPLE_RATE, dtype=np.int16)]
+    num_inferences = [0]
+    callback_lateness_s = []
+    threads = []
+
+    inference_process = None
+    if mode == "process":
+        inference_process = InferenceProcess(model_path)
+        inference_process.start()
+
+        def drain_results():
+            while running.is_set():
+                if inference_process.recv_result(timeout_s=0.2) is not None:
+                    num_inferences[0] += 1
+
+        threads.append(threading.Thread(target=drain_results))
+    else:
+        model = load_yamnet(model_path)
+        model.infer(np.zeros(WINDOW_NUM_SAMPLES, dtype=np.float32))
+
+        def infer_loop():
+            while running.is_set():
+                start = time.monotonic()
+                model.infer(prepare_waveform(latest_audio[0], WINDOW_NUM_SAMPLES))
+                num_inferences[0] += 1
+                time.sleep(max(0.0, 0.1 - (time.monotonic() - start)))
+
+        threads.append(threading.Thread(target=infer_loop))
+
+    def capture_loop():
+        period_s = BENCH_CAPTURE_FRAMES / MODEL_SAMPLE_RATE
+        next_time = time.monotonic() + period_s
+        offset = 0
+        while running.is_set():
+            time.sleep(max(0.0, next_time - time.monotonic()))
+            callback_lateness_s.append(time.monotonic() - next_time)
+            next_time += period_s
+            chunk = noise[offset : offset + BENCH_CAPTURE_FRAMES]
+            offset = (offset + BENCH_CAPTURE_FRAMES) % (noise.size - BENCH_CAPTURE_FRAMES)
+            latest_audio[0] = np.concatenate((latest_audio[0], chunk))[
+                -MODEL_SAMPLE_RATE:
+            ]
+            if inference_process is not None:
+                inference_process.write("bench", chunk)
+
+    threads.append(threading.Thread(target=capture_loop))
+    for thread in threads:
+        thread.start()
+
+    # The UI loop: a spectrogram and some Python-level event work per frame.
+    frame_times_s = []
+    frame_s = 1.0 / BENCH_UI_FPS
+    end_time = time.monotonic() + seconds
+    last_time = time.monotonic()
+    while time.monotonic() < end_time:
+        get_spectrogram(signal=latest_audio[0], rate=MODEL_SAMPLE_RATE, mod_spec=True)
+        events = [{"source": "bench", "score": i} for i in range(500)]
+        sorted(events, key=lambda evt: -evt["score"])
+        time.sleep(max(0.0, frame_s - (time.monotonic() - last_time)))
+        now = time.monotonic()
+        frame_times_s.append(now - last_time)
+        last_time = now
+
+    running.clear()
+    for thread in threads:
+        thread.join()
+    if inference_process is not None:
+        inference_process.stop()
+
+    lateness = np.array(callback_lateness_s)
+    frame_times = np.array(frame_times_s)
+    period_s = BENCH_CAPTURE_FRAMES / MODEL_SAMPLE_RATE
+    return {
+        "inferences_per_s": num_inferences[0] / seconds,
+        # A callback later than a whole buffer is where PortAudio would overflow.
+        "capture_overflows": int((lateness > period_s).sum()),
+        "capture_p99_late_ms": np.percentile(lateness, 99) * 1000,
+        "frame_avg_ms": frame_times.mean() * 1000,
+        "frame_p99_ms": np.percentile(frame_times, 99) * 1000,
+    }
+
+
+def run_benchmark(args: dict) -> None:
+    seconds = float(args["--seconds"])
+    print("mode      inferences/s  capture overflows  capture p99 late  frame avg  frame p99")
+    for mode in ("thread", "process"):
+        stats = _benchmark_mode(args["--tf-model"], mode, seconds)
+        print(
+            "{:8s}  {:12.1f}  {:17d}  {:14.1f}ms  {:7.1f}ms  {:7.1f}ms".format(
+                mode,
+                stats["inferences_per_s"],
+                stats["capture_overflows"],
+                stats["capture_p99_late_ms"],
+                stats["frame_avg_ms"],
+                stats["frame_p99_ms"],
+            )
+        )
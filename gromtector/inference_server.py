@@ -0,0 +1,395 @@
+"""
+A local YAMNet inference server that batches requests from concurrent clients.
+
+Messages are length prefixed (u32, network order) in both directions.
+
+Request:  request id u32 | flags u8 | top k u8 | pad u16 | num samples u32
+          | float32 little endian 16kHz waveform
+Response: request id u32 | flags u8 | top k u8 | pad u16 | num scores u32
+          | embedding size u32 | queue ms f32 | inference ms f32
+          | top k class indices (u16) | top k scores (f32)
+          | [all the scores (f32) if FLAG_FULL_SCORES]
+          | [the embedding (f32) if FLAG_EMBEDDINGS]
+
+A request with FLAG_LABELS gets the newline separated model labels as the response
+payload instead. When inference fails the response has FLAG_ERROR set, no scores
+and the UTF-8 error message after its header; the connection stays open.
+"""
+import asyncio
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from gromtector.yamnet import YamnetModel
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ADDRESS = "127.0.0.1:5006"
+
+LENGTH_PREFIX = struct.Struct("!I")
+REQUEST_HEADER = struct.Struct("!IBBxxI")
+RESPONSE_HEADER = struct.Struct("!IBBxxIIff")
+
+FLAG_FULL_SCORES = 0x01
+FLAG_EMBEDDINGS = 0x02
+FLAG_ERROR = 0x40
+FLAG_LABELS = 0x80
+
+# A minute of 16kHz audio, far more than a YAMNet window, bounds what a client can
+# make the server buffer.
+MAX_REQUEST_SAMPLES = 60 * 16000
+MAX_REQUEST_SIZE = REQUEST_HEADER.size + MAX_REQUEST_SAMPLES * 4
+
+
+class InferenceServerError(Exception):
+    pass
+
+
+def parse_server_address(address: str):
+    """
+    Returns `(socket family, address)` for "unix:/path/to/socket" or "host:port".
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class InferenceResult:
+    __slots__ = (
+        "top_indices",
+        "top_scores",
+        "scores",
+        "embeddings",
+        "queue_ms",
+        "inference_ms",
+    )
+
+    def __init__(
+        self, top_indices, top_scores, scores, embeddings, queue_ms, inference_ms
+    ):
+        self.top_indices = top_indices
+        self.top_scores = top_scores
+        self.scores = scores
+        self.embeddings = embeddings
+        self.queue_ms = queue_ms
+        self.inference_ms = inference_ms
+
+
+def encode_response(request_id: int, flags: int, result: InferenceResult) -> bytes:
+    scores = result.scores if flags & FLAG_FULL_SCORES else None
+    embeddings = result.embeddings if flags & FLAG_EMBEDDINGS else None
+    parts = [
+        RESPONSE_HEADER.pack(
+            request_id,
+            flags,
+            result.top_indices.size,
+            0 if scores is None else scores.size,
+            0 if embeddings is None else embeddings.size,
+            result.queue_ms,
+            result.inference_ms,
+        ),
+        result.top_indices.astype("<u2").tobytes(),
+        result.top_scores.astype("<f4").tobytes(),
+    ]
+    if scores is not None:
+        parts.append(scores.astype("<f4").tobytes())
+    if embeddings is not None:
+        parts.append(embeddings.astype("<f4").tobytes())
+    return b"".join(parts)
+
+
+def encode_error_response(request_id: int, error: Exception) -> bytes:
+    return RESPONSE_HEADER.pack(
+        request_id, FLAG_ERROR, 0, 0, 0, 0.0, 0.0
+    ) + str(error).encode("utf-8")
+
+
+def decode_response(data: bytes) -> Tuple[int, InferenceResult]:
+    request_id, flags, top_k, num_scores, emb_size, queue_ms, inference_ms = (
+        RESPONSE_HEADER.unpack_from(data)
+    )
+    offset = RESPONSE_HEADER.size
+    if flags & FLAG_ERROR:
+        raise InferenceServerError(
+            "Inference failed on the server: {}".format(
+                data[offset:].decode("utf-8", errors="replace")
+            )
+        )
+    top_indices = np.frombuffer(data, dtype="<u2", count=top_k, offset=offset)
+    offset += top_k * 2
+    top_scores = np.frombuffer(data, dtype="<f4", count=top_k, offset=offset)
+    offset += top_k * 4
+    scores = None
+    if num_scores:
+        scores = np.frombuffer(data, dtype="<f4", count=num_scores, offset=offset)
+        offset += num_scores * 4
+    embeddings = None
+    if emb_size:
+        embeddings = np.frombuffer(data, dtype="<f4", count=emb_size, offset=offset)
+    return request_id, InferenceResult(
+        top_indices, top_scores, scores, embeddings, queue_ms, inference_ms
+    )
+
+
+class PendingRequest:
+    __slots__ = ("waveform", "flags", "top_k", "enqueue_time", "loop", "future")
+
+    def __init__(self, waveform, flags, top_k, loop, future):
+        self.waveform = waveform
+        self.flags = flags
+        self.top_k = top_k
+        self.enqueue_time = time.monotonic()
+        self.loop = loop
+        self.future = future
+
+
+class InferenceServer:
+    """
+    Serves classification requests with one warm model. Requests from all clients
+    go into one queue; the batcher thread takes up to `max_batch` of them, waiting
+    at most `max_delay_s` after the first for the batch to fill, and runs them
+    through the model together.
+    """
+
+    stats_interval_s: float = 10.0
+
+    def __init__(
+        self,
+        model: YamnetModel,
+        address: str = DEFAULT_ADDRESS,
+        max_batch: int = 8,
+        max_delay_s: float = 0.01,
+    ):
+        self.model = model
+        self.address = address
+        self.max_batch = max_batch
+        self.max_delay_s = max_delay_s
+        self.request_queue: queue.Queue = queue.Queue()
+        self.running = False
+        self.batcher_thread: threading.Thread = None
+
+        self.stats_time = time.monotonic()
+        self.stats_requests = 0
+        self.stats_batches = 0
+        self.stats_latency_ms = []
+
+    def run_batcher(self) -> None:
+        while self.running:
+            try:
+                first = self.request_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = first.enqueue_time + self.max_delay_s
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.request_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+            self.report_stats()
+
+    def run_batch(self, batch: Sequence[PendingRequest]) -> None:
+        # Clients send same sized windows, anything shorter is padded with silence.
+        num_samples = max(req.waveform.size for req in batch)
+        waveforms = np.zeros((len(batch), num_samples), dtype=np.float32)
+        for idx, req in enumerate(batch):
+            waveforms[idx, : req.waveform.size] = req.waveform
+
+        begin = time.monotonic()
+        try:
+            scores, embeddings = self.model.infer_batch(waveforms)
+        except Exception as e:
+            logger.exception("Inference failed for a batch of %d.", len(batch))
+            for req in batch:
+                req.loop.call_soon_threadsafe(req.future.set_exception, e)
+            return
+        end = time.monotonic()
+        inference_ms = (end - begin) * 1000
+
+        for idx, req in enumerate(batch):
+            top_k = min(req.top_k, scores.shape[1])
+            top_indices = np.argsort(scores[idx])[::-1][:top_k]
+            result = InferenceResult(
+                top_indices=top_indices,
+                top_scores=scores[idx][top_indices],
+                scores=scores[idx],
+                embeddings=None if embeddings is None else embeddings[idx],
+                queue_ms=(begin - req.enqueue_time) * 1000,
+                inference_ms=inference_ms,
+            )
+            self.stats_latency_ms.append((end - req.enqueue_time) * 1000)
+            req.loop.call_soon_threadsafe(req.future.set_result, result)
+        self.stats_requests += len(batch)
+        self.stats_batches += 1
+
+    def report_stats(self) -> None:
+        now = time.monotonic()
+        elapsed_s = now - self.stats_time
+        if elapsed_s < self.stats_interval_s or not self.stats_batches:
+            return
+        latencies = np.array(self.stats_latency_ms)
+        logger.info(
+            "%.1f req/s, batch occupancy %.0f%% (%.2f/%d), latency p50 %.1fms p99 %.1fms.",
+            self.stats_requests / elapsed_s,
+            100.0 * self.stats_requests / (self.stats_batches * self.max_batch),
+            self.stats_requests / self.stats_batches,
+            self.max_batch,
+            np.percentile(latencies, 50),
+            np.percentile(latencies, 99),
+        )
+        self.stats_time = now
+        self.stats_requests = 0
+        self.stats_batches = 0
+        self.stats_latency_ms = []
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                (length,) = LENGTH_PREFIX.unpack(
+                    await reader.readexactly(LENGTH_PREFIX.size)
+                )
+                if not REQUEST_HEADER.size <= length <= MAX_REQUEST_SIZE:
+                    raise ValueError("request of {} bytes".format(length))
+                message = await reader.readexactly(length)
+                request_id, flags, top_k, num_samples = REQUEST_HEADER.unpack_from(
+                    message
+                )
+                if REQUEST_HEADER.size + num_samples * 4 != length:
+                    raise ValueError(
+                        "{} samples in a request of {} bytes".format(
+                            num_samples, length
+                        )
+                    )
+
+                if flags & FLAG_LABELS:
+                    response = "\n".join(self.model.labels).encode("utf-8")
+                else:
+                    waveform = np.frombuffer(
+                        message,
+                        dtype="<f4",
+                        count=num_samples,
+                        offset=REQUEST_HEADER.size,
+                    )
+                    future = loop.create_future()
+                    self.request_queue.put(
+                        PendingRequest(waveform, flags, top_k, loop, future)
+                    )
+                    try:
+                        result = await future
+                    except Exception as e:
+                        # The batcher already logged it, the request itself was
+                        # well formed so the connection can carry on.
+                        response = encode_error_response(request_id, e)
+                    else:
+                        response = encode_response(request_id, flags, result)
+
+                writer.write(LENGTH_PREFIX.pack(len(response)) + response)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        except (struct.error, ValueError) as e:
+            # The stream can't be resynchronised after a bad message.
+            logger.warning(
+                "Closing the connection of %s on a malformed %s.",
+                writer.get_extra_info("peername"),
+                e,
+            )
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        family, address = parse_server_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            server = await asyncio.start_unix_server(self.handle_client, path=address)
+        else:
+            server = await asyncio.start_server(self.handle_client, *address)
+        logger.info(
+            'Serving "%s" on %s (max batch %d, max delay %.1fms).',
+            self.model.model_path,
+            self.address,
+            self.max_batch,
+            self.max_delay_s * 1000,
+        )
+        async with server:
+            await server.serve_forever()
+
+    def run(self) -> None:
+        self.running = True
+        self.batcher_thread = threading.Thread(target=self.run_batcher)
+        self.batcher_thread.start()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info("Exit requested.")
+        finally:
+            self.running = False
+            self.batcher_thread.join()
+
+
+class InferenceClient:
+    """
+    Blocking client for `InferenceServer`, one request in flight at a time.
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout_s: float = 10.0):
+        family, sock_address = parse_server_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout_s)
+        self.sock.connect(sock_address)
+        self.next_request_id = 0
+
+    def _recv_exactly(self, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise InferenceServerError("Inference server closed the connection.")
+            buf += chunk
+        return bytes(buf)
+
+    def _request(self, flags: int, top_k: int, waveform: np.ndarray) -> bytes:
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+        payload = waveform.astype("<f4", copy=False).tobytes()
+        message = REQUEST_HEADER.pack(request_id, flags, top_k, waveform.size) + payload
+        self.sock.sendall(LENGTH_PREFIX.pack(len(message)) + message)
+        (length,) = LENGTH_PREFIX.unpack(self._recv_exactly(LENGTH_PREFIX.size))
+        return self._recv_exactly(length)
+
+    def get_labels(self) -> Sequence[str]:
+        response = self._request(FLAG_LABELS, 0, np.zeros(0, dtype=np.float32))
+        return response.decode("utf-8").split("\n")
+
+    def classify(
+        self,
+        waveform: np.ndarray,
+        top_k: int = 10,
+        full_scores: bool = False,
+        embeddings: bool = False,
+    ) -> InferenceResult:
+        flags = (FLAG_FULL_SCORES if full_scores else 0) | (
+            FLAG_EMBEDDINGS if embeddings else 0
+        )
+        _, result = decode_response(self._request(flags, top_k, waveform))
+        return result
+
+    def close(self) -> None:
+        self.sock.close()
@@ -0,0 +1,299 @@
+"""
+Framed PCM streaming between remote sensors and a gromtector node.
+
+Every frame is a fixed size header followed by the payload:
+
+    magic "GRMT" | version u8 | codec u8 | channels u8 | pad | sample rate u32
+    | sequence number u32 | source id (16 bytes, utf-8, NUL padded) | payload size u32
+
+The payload is little endian int16 PCM, optionally zlib compressed. Over TCP the
+frames are sent back to back; over UDP each datagram is one frame.
+"""
+import asyncio
+import logging
+import math
+import struct
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+FRAME_MAGIC = b"GRMT"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("!4sBBBxII16sI")
+
+CODEC_PCM16 = 0
+CODEC_ZLIB_PCM16 = 1
+CODECS = {"pcm": CODEC_PCM16, "zlib": CODEC_ZLIB_PCM16}
+
+MAX_PAYLOAD_SIZE = 1 << 20
+
+
+class FrameError(Exception):
+    pass
+
+
+class AudioFrame:
+    __slots__ = ("source", "seq", "sample_rate", "channels", "samples")
+
+    def __init__(self, source: str, seq: int, sample_rate: int, channels: int, samples):
+        self.source = source
+        self.seq = seq
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples = samples
+
+
+def encode_frame(
+    source: str,
+    seq: int,
+    samples: np.ndarray,
+    sample_rate: int,
+    channels: int = 1,
+    codec: int = CODEC_PCM16,
+) -> bytes:
+    payload = samples.astype("<i2", copy=False).tobytes()
+    if codec == CODEC_ZLIB_PCM16:
+        payload = zlib.compress(payload, 1)
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        codec,
+        channels,
+        sample_rate,
+        seq & 0xFFFFFFFF,
+        source.encode("utf-8")[:16],
+        len(payload),
+    )
+    return header + payload
+
+
+def decode_header(header: bytes) -> Tuple[int, int, int, int, str, int]:
+    """
+    Returns `(codec, channels, sample_rate, seq, source, payload_size)`.
+    """
+    magic, version, codec, channels, sample_rate, seq, source, payload_size = (
+        FRAME_HEADER.unpack(header)
+    )
+    if magic != FRAME_MAGIC:
+        raise FrameError("Bad frame magic {!r}.".format(magic))
+    if version != FRAME_VERSION:
+        raise FrameError("Unsupported frame version {}.".format(version))
+    if codec not in CODECS.values():
+        raise FrameError("Unsupported codec {}.".format(codec))
+    if not channels or not sample_rate:
+        raise FrameError(
+            "Bad frame format, {} channels at {} Hz.".format(channels, sample_rate)
+        )
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise FrameError("Frame payload too large ({} bytes).".format(payload_size))
+    source = source.rstrip(b"\0").decode("utf-8", errors="replace")
+    return codec, channels, sample_rate, seq, source, payload_size
+
+
+def decode_payload(codec: int, channels: int, payload: bytes) -> np.ndarray:
+    if codec == CODEC_ZLIB_PCM16:
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(payload, MAX_PAYLOAD_SIZE)
+        except zlib.error as e:
+            raise FrameError("Corrupt compressed payload: {}.".format(e))
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise FrameError("Compressed payload is truncated or too large.")
+    if len(payload) % (2 * channels):
+        raise FrameError(
+            "Payload of {} bytes isn't whole {} channel int16 samples.".format(
+                len(payload), channels
+            )
+        )
+    samples = np.frombuffer(payload, dtype="<i2")
+    if channels > 1:
+        # Downmix to mono, the rest of the pipeline only deals with mono.
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples
+
+
+def decode_frame(data: bytes) -> AudioFrame:
+    if len(data) < FRAME_HEADER.size:
+        raise FrameError("Frame shorter than its header.")
+    codec, channels, sample_rate, seq, source, payload_size = decode_header(
+        data[: FRAME_HEADER.size]
+    )
+    payload = data[FRAME_HEADER.size :]
+    if len(payload) != payload_size:
+        raise FrameError(
+            "Frame payload is {} bytes, expected {}.".format(len(payload), payload_size)
+        )
+    return AudioFrame(
+        source, seq, sample_rate, channels, decode_payload(codec, channels, payload)
+    )
+
+
+class JitterBuffer:
+    """
+    Reorders the frames of one stream by sequence number. Frames are released in
+    order; when more than `depth` frames are waiting on a missing one, the missing
+    frames are given up on, counted as a gap and replaced with silence so the
+    stream timeline is preserved. A jump of more than `max_lost_frames` isn't
+    filled in, it is taken as a stream reset like a sequence restart is.
+    """
+
+    restart_frames: int = 1000
+    max_lost_frames: int = 50  # About a second of 20ms frames.
+
+    def __init__(self, depth: int = 4):
+        self.depth = depth
+        self.expected_seq: Optional[int] = None
+        self.pending: Dict[int, np.ndarray] = {}
+        self.last_frame_size = 0
+
+        self.received_frames = 0
+        self.late_frames = 0  # Arrived after being given up on, or duplicates.
+        self.gaps = 0
+        self.lost_frames = 0
+        self.resets = 0
+
+    def push(self, seq: int, samples: np.ndarray) -> List[np.ndarray]:
+        self.received_frames += 1
+        if self.expected_seq is None or self.expected_seq - seq > self.restart_frames:
+            # First frame, or the sensor restarted its sequence numbers.
+            if self.expected_seq is not None:
+                self.resets += 1
+            self.expected_seq = seq
+            self.pending.clear()
+        if seq < self.expected_seq or seq in self.pending:
+            self.late_frames += 1
+            return []
+        self.pending[seq] = samples
+        return self.release()
+
+    def release(self, flush: bool = False) -> List[np.ndarray]:
+        released = []
+        while self.pending:
+            samples = self.pending.pop(self.expected_seq, None)
+            if samples is not None:
+                self.last_frame_size = samples.size
+                released.append(samples)
+                self.expected_seq += 1
+                continue
+            if not flush and len(self.pending) <= self.depth:
+                break
+            next_seq = min(self.pending)
+            num_lost = next_seq - self.expected_seq
+            self.expected_seq = next_seq
+            if num_lost > self.max_lost_frames:
+                self.resets += 1
+                continue
+            self.gaps += 1
+            self.lost_frames += num_lost
+            released.append(np.zeros(num_lost * self.last_frame_size, dtype=np.int16))
+        return released
+
+    def flush(self) -> List[np.ndarray]:
+        """
+        Releases everything still pending, filling the gaps, and forgets the
+        sequence so the next frame starts the stream afresh, e.g. when the sensor
+        disconnects and may reconnect with its numbering restarted.
+        """
+        released = self.release(flush=True)
+        self.expected_seq = None
+        return released
+
+
+async def _run_sensor_stream(
+    host: str,
+    port: int,
+    source: str,
+    samples: np.ndarray,
+    sample_rate: int,
+    frame_s: float,
+    duration_s: float,
+    use_udp: bool,
+    codec: int,
+) -> int:
+    frame_size = int(sample_rate * frame_s)
+    num_frames = int(math.ceil(duration_s / frame_s))
+    loop = asyncio.get_running_loop()
+
+    if use_udp:
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=(host, port)
+        )
+        send = transport.sendto
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+        send = writer.write
+
+    begin = time.monotonic()
+    offset = 0
+    for seq in range(num_frames):
+        chunk = samples[offset : offset + frame_size]
+        if chunk.size < frame_size:
+            offset = 0  # Loop the clip.
+            chunk = samples[:frame_size]
+        offset += frame_size
+        send(encode_frame(source, seq, chunk, sample_rate, codec=codec))
+        if not use_udp:
+            await writer.drain()
+
+        # Pace in real time like a real sensor would.
+        delay = begin + (seq + 1) * frame_s - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    if use_udp:
+        transport.close()
+    else:
+        writer.close()
+        await writer.wait_closed()
+    return num_frames
+
+
+async def run_fake_sensors(
+    host: str,
+    port: int,
+    num_streams: int = 1,
+    samples: np.ndarray = None,
+    sample_rate: int = 16000,
+    frame_s: float = 0.02,
+    duration_s: float = 10.0,
+    use_udp: bool = False,
+    codec: int = CODEC_PCM16,
+) -> None:
+    """
+    Streams `samples` (a quiet test tone by default) from `num_streams` concurrent
+    fake sensors, "sensor0", "sensor1", ..., paced in real time.
+    """
+    if samples is None:
+        t = np.arange(sample_rate) / sample_rate
+        samples = (np.sin(2 * np.pi * 440.0 * t) * 3000).astype(np.int16)
+
+    begin = time.monotonic()
+    sent = await asyncio.gather(
+        *[
+            _run_sensor_stream(
+                host,
+                port,
+                "sensor{}".format(idx),
+                samples,
+                sample_rate,
+                frame_s,
+                duration_s,
+                use_udp,
+                codec,
+            )
+            for idx in range(num_streams)
+        ]
+    )
+    elapsed_s = time.monotonic() - begin
+    logger.info(
+        "Sent %d frames over %d streams in %.1fs (%.1fx real time per stream).",
+        sum(sent),
+        num_streams,
+        elapsed_s,
+        duration_s / elapsed_s,
+    )
@@ -0,0 +1,230 @@
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from gromtector.score_frame import LabelTable, ScoreFrame
+
+logger = logging.getLogger(__name__)
+
+
+class Clause:
+    """
+    At least `min_count` of `classes` score `threshold` or more. With `top_only`
+    only the frame's top classes count, like the original bark rule.
+    """
+
+    def __init__(
+        self,
+        classes: Sequence[str],
+        threshold: float,
+        min_count: int = 1,
+        top_only: bool = False,
+    ):
+        self.classes = [c.lower() for c in classes]
+        self.threshold = float(threshold)
+        self.min_count = int(min_count)
+        self.top_only = bool(top_only)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Clause) and vars(self) == vars(other)
+
+
+class Rule:
+    """
+    A sound to detect: all of its clauses hold on a frame. Episodes are opened
+    with `begin_event`, and closed `end_wait_s` after the rule last held with
+    `episode_event` (begin and end timestamps) and `end_event`. `event_fields`
+    are added to all three events.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        clauses: Sequence[Clause],
+        end_wait_s: float = 1.0,
+        begin_event: str = None,
+        episode_event: str = None,
+        end_event: str = None,
+        event_fields: Dict[str, Any] = None,
+    ):
+        if not clauses:
+            raise ValueError('Rule "{}" has no clauses.'.format(name))
+        self.name = name
+        self.clauses = list(clauses)
+        self.end_wait_s = float(end_wait_s)
+        self.begin_event = begin_event or "{}_begin".format(name)
+        self.episode_event = episode_event or "audio_event_{}".format(name)
+        self.end_event = end_event or "{}_end".format(name)
+        self.event_fields = event_fields or {}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Rule) and vars(self) == vars(other)
+
+
+def dog_bark_rule(
+    animal_classes: Sequence[str],
+    dog_noise_classes: Sequence[str],
+    animal_class_threshold: float,
+    dog_audio_class_threshold: float,
+) -> Rule:
+    """
+    The original bark rule: more than two animal classes and a dog noise class
+    among the top classes, with its original event names and fields.
+    """
+    return Rule(
+        "dog_bark",
+        [
+            Clause(animal_classes, animal_class_threshold, min_count=3, top_only=True),
+            Clause(dog_noise_classes, dog_audio_class_threshold, top_only=True),
+        ],
+        episode_event="audio_event_dogbark",
+        event_fields={
+            "dog_class_threshold": animal_class_threshold,
+            "dog_audio_class_threshold": dog_audio_class_threshold,
+        },
+    )
+
+
+def parse_rules(raw_rules: Any) -> List[Rule]:
+    """
+    Builds rules from their config file form, a list of tables like:
+
+        [[rules]]
+        name = "smoke_alarm"
+        end_wait_s = 2.0
+        [[rules.clauses]]
+        classes = ["Smoke detector, smoke alarm", "Fire alarm"]
+        threshold = 0.5
+
+    Raises `ValueError` on anything malformed, or on a rule that would clash with
+    the built-in bark rule or another rule by name or by event.
+    """
+    if not isinstance(raw_rules, list):
+        raise ValueError("{!r} is not a list of rules".format(raw_rules))
+    # The rules are evaluated next to the built-in bark rule.
+    builtin_rule = dog_bark_rule([], [], 0.0, 0.0)
+    rules = []
+    names = set()
+    rule_events = {
+        event: builtin_rule.name
+        for event in (
+            builtin_rule.begin_event,
+            builtin_rule.episode_event,
+            builtin_rule.end_event,
+        )
+    }
+    for raw_rule in raw_rules:
+        try:
+            name = raw_rule["name"]
+            if not isinstance(name, str) or not name:
+                raise ValueError("rule names must be non-empty strings")
+            if name == builtin_rule.name:
+                raise ValueError('"{}" is the built-in bark rule\'s name'.format(name))
+            if name in names:
+                raise ValueError('two rules are named "{}"'.format(name))
+            names.add(name)
+            clauses = []
+            for raw_clause in raw_rule["clauses"]:
+                classes = raw_clause["classes"]
+                if not isinstance(classes, list) or not all(
+                    isinstance(c, str) for c in classes
+                ):
+                    raise ValueError("clause classes must be a list of strings")
+                threshold = float(raw_clause["threshold"])
+                if not 0.0 <= threshold <= 1.0:
+                    raise ValueError("{} is not between 0 and 1".format(threshold))
+                clauses.append(
+                    Clause(
+                        classes,
+                        threshold,
+                        min_count=int(raw_clause.get("min_count", 1)),
+                        top_only=bool(raw_clause.get("top_only", False)),
+                    )
+                )
+            rule = Rule(
+                name, clauses, end_wait_s=float(raw_rule.get("end_wait_s", 1.0))
+            )
+            for event in (rule.begin_event, rule.episode_event, rule.end_event):
+                if event in rule_events:
+                    raise ValueError(
+                        'rules "{}" and "{}" both send "{}"'.format(
+                            rule_events[event], name, event
+                        )
+                    )
+                rule_events[event] = name
+            rules.append(rule)
+        except (KeyError, TypeError) as e:
+            raise ValueError("malformed rule {!r} ({!r})".format(raw_rule, e))
+    return rules
+
+
+class RuleEngine:
+    """
+    Evaluates any number of rules on a score frame in one vectorised pass.
+
+    The clauses of all rules are compiled, per label table, into a
+    `[clauses, classes]` mask and per-clause threshold and count arrays. A frame
+    is then a single comparison of its full score vector against every
+    threshold, a masked count per clause and an AND per rule, so adding rules
+    only grows the arrays.
+    """
+
+    def __init__(self, rules: Sequence[Rule]):
+        self.rules = list(rules)
+        self.clause_rules = np.array(
+            [idx for idx, rule in enumerate(self.rules) for _ in rule.clauses],
+            dtype=np.intp,
+        )
+        clauses = [clause for rule in self.rules for clause in rule.clauses]
+        self.rule_starts = np.flatnonzero(
+            np.r_[True, self.clause_rules[1:] != self.clause_rules[:-1]]
+        )
+        self.thresholds = np.array([c.threshold for c in clauses], dtype=np.float32)
+        self.min_counts = np.array([c.min_count for c in clauses], dtype=np.intp)
+        self.top_only = np.array([c.top_only for c in clauses], dtype=bool)
+        self.any_top_only = bool(self.top_only.any())
+        self.clauses = clauses
+
+        self.label_table: LabelTable = None
+        self.masks: np.ndarray = None
+
+    def compile(self, label_table: LabelTable) -> None:
+        self.label_table = label_table
+        self.masks = np.stack([label_table.mask(c.classes) for c in self.clauses])
+        for clause_idx, clause in enumerate(self.clauses):
+            if self.masks[clause_idx].sum() < len(set(clause.classes)):
+                known = {label.lower() for label in label_table.labels}
+                logger.warning(
+                    'Rule "%s": the model has no class %s.',
+                    self.rules[self.clause_rules[clause_idx]].name,
+                    ", ".join(
+                        '"{}"'.format(c) for c in clause.classes if c not in known
+                    ),
+                )
+
+    def evaluate(self, frame: ScoreFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns which rules hold on `frame` (`[rules]` bool) and the classes that
+        satisfied each clause (`[clauses, classes]` bool).
+        """
+        if frame.label_table is not self.label_table:
+            self.compile(frame.label_table)
+        hits = frame.scores[np.newaxis, :] >= self.thresholds[:, np.newaxis]
+        if self.any_top_only:
+            in_top = np.zeros(frame.scores.size, dtype=bool)
+            in_top[frame.top_indices] = True
+            hits &= in_top[np.newaxis, :] | ~self.top_only[:, np.newaxis]
+        hits &= self.masks
+        clauses_hold = hits.sum(axis=1) >= self.min_counts
+        return np.logical_and.reduceat(clauses_hold, self.rule_starts), hits
+
+    def trigger_indices(self, rule_idx: int, hits: np.ndarray, frame: ScoreFrame):
+        """
+        The classes that made rule `rule_idx` hold, clause by clause, best first.
+        """
+        indices = []
+        for clause_idx in np.flatnonzero(self.clause_rules == rule_idx):
+            clause_indices = np.flatnonzero(hits[clause_idx])
+            indices.append(clause_indices[np.argsort(-frame.scores[clause_indices])])
+        return np.concatenate(indices)
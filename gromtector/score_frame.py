@@ -0,0 +1,80 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+
+class LabelTable:
+    """
+    The class labels of a model, shared by all of its score frames. Turns label
+    names into class index masks once so consumers only compare numbers per frame.
+    """
+
+    __slots__ = ("labels", "_indices")
+
+    def __init__(self, labels: Sequence[str]):
+        self.labels = list(labels)
+        self._indices = {label.lower(): idx for idx, label in enumerate(self.labels)}
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, idx: int) -> str:
+        return self.labels[idx]
+
+    def indices(self, names: Iterable[str]) -> np.ndarray:
+        """
+        Class indices of the (case insensitive) `names` the model knows.
+        """
+        return np.array(
+            [self._indices[n.lower()] for n in names if n.lower() in self._indices],
+            dtype=np.intp,
+        )
+
+    def mask(self, names: Iterable[str]) -> np.ndarray:
+        """
+        A bool array over all classes, `True` for the classes in `names`.
+        """
+        mask = np.zeros(len(self.labels), dtype=bool)
+        mask[self.indices(names)] = True
+        return mask
+
+
+class ScoreFrame:
+    """
+    The scores of one inference over one source. The score vector is kept as is
+    and the frame is handed to every listener without copies; label strings are
+    only looked up when something is displayed or stored.
+    """
+
+    __slots__ = ("begin_timestamp", "source", "scores", "top_indices", "label_table")
+
+    def __init__(
+        self,
+        begin_timestamp: datetime,
+        source: str,
+        scores: np.ndarray,
+        top_indices: np.ndarray,
+        label_table: LabelTable,
+    ):
+        self.begin_timestamp = begin_timestamp
+        self.source = source
+        self.scores = scores  # float32 score of every class.
+        self.top_indices = top_indices  # Best classes first.
+        self.label_table = label_table
+
+    @property
+    def top_scores(self) -> np.ndarray:
+        return self.scores[self.top_indices]
+
+    def classes(self, indices: Iterable[int] = None) -> List[Dict]:
+        """
+        `{"label", "score"}` dicts of `indices` (the top classes by default), for
+        events that leave the hot path.
+        """
+        if indices is None:
+            indices = self.top_indices
+        return [
+            {"label": self.label_table[idx], "score": float(self.scores[idx])}
+            for idx in indices
+        ]
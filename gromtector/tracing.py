@@ -0,0 +1,193 @@
+"""
+Opt-in tracing of spans across threads into a Chrome trace-event JSON file, to
+open in https://ui.perfetto.dev or chrome://tracing.
+
+Tracing is off unless `start()` is called (`--trace`). Instrumented code calls
+`span()`, which then returns a shared do-nothing context manager, or checks
+`get_tracer()` once around a hot loop, so disabled tracing costs one global
+lookup. When on, spans are appended to a bounded in-memory buffer from any
+thread and a flusher thread writes them out every `FLUSH_INTERVAL_S`; spans
+recorded while the buffer is full are dropped and counted rather than blocking.
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+MAX_BUFFERED_EVENTS = 100_000
+FLUSH_INTERVAL_S = 1.0
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start_us")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_us = self.tracer.now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.complete(self.name, self.category, self.start_us, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Records complete ("X") trace events. The file is written in the JSON array
+    form of the trace-event format, which viewers also read when its closing
+    bracket is missing, so a crashed run still leaves a usable trace.
+    """
+
+    def __init__(
+        self,
+        trace_path: str,
+        max_buffered_events: int = MAX_BUFFERED_EVENTS,
+        flush_interval_s: float = FLUSH_INTERVAL_S,
+    ):
+        self.trace_path = trace_path
+        self.max_buffered_events = max_buffered_events
+        self.flush_interval_s = flush_interval_s
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+
+        # deque appends and pops are atomic, so recording threads never lock.
+        self.events = collections.deque()
+        self.named_threads = set()
+        self.events_written = 0
+        self.events_dropped = 0
+
+        self.trace_file = open(trace_path, "w")
+        self.trace_file.write("[\n")
+        self.first_event = True
+        self.stopping = threading.Event()
+        self.flush_thread = threading.Thread(
+            target=self.__class__.run_flush_thread, args=(self,), name="trace-flush"
+        )
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self.origin_ns) / 1000
+
+    def record(self, event: dict) -> None:
+        if len(self.events) >= self.max_buffered_events:
+            self.events_dropped += 1
+            return
+        tid = threading.get_ident()
+        if tid not in self.named_threads:
+            self.named_threads.add(tid)
+            self.events.append(
+                {
+                    "ph": "M",
+                    "name": "thread_name",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                }
+            )
+        event["pid"] = self.pid
+        event["tid"] = tid
+        self.events.append(event)
+
+    def complete(
+        self, name: str, category: str, start_us: float, args: dict = None
+    ) -> None:
+        """
+        Records a span of the current thread from `start_us` (see `now_us()`)
+        until now.
+        """
+        event = {
+            "ph": "X",
+            "name": name,
+            "cat": category,
+            "ts": start_us,
+            "dur": self.now_us() - start_us,
+        }
+        if args:
+            event["args"] = args
+        self.record(event)
+
+    def span(self, name: str, category: str = "app", args: dict = None) -> _Span:
+        return _Span(self, name, category, args)
+
+    def flush(self) -> None:
+        lines = []
+        while self.events:
+            lines.append(json.dumps(self.events.popleft(), default=str))
+        if not lines:
+            return
+        if not self.first_event:
+            self.trace_file.write(",\n")
+        self.first_event = False
+        self.trace_file.write(",\n".join(lines))
+        self.trace_file.flush()
+        self.events_written += len(lines)
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.flush_thread.join()
+        self.flush()
+        self.trace_file.write("\n]\n")
+        self.trace_file.close()
+        logger.info(
+            'Wrote %d trace events to "%s", %d dropped on a full buffer.',
+            self.events_written,
+            self.trace_path,
+            self.events_dropped,
+        )
+
+    @classmethod
+    def run_flush_thread(cls, tracer: "Tracer") -> None:
+        while not tracer.stopping.wait(tracer.flush_interval_s):
+            try:
+                tracer.flush()
+            except Exception:
+                logger.exception("Failed to flush the trace.")
+
+
+_tracer: Optional[Tracer] = None
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, category: str = "app", args: dict = None):
+    """
+    A context manager timing its block as a span of the current thread, a shared
+    no-op one when tracing is off.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, category, args)
+
+
+def start(trace_path: str, **kwargs) -> Tracer:
+    global _tracer
+    if _tracer is not None:
+        raise RuntimeError("Tracing is already on.")
+    _tracer = Tracer(trace_path, **kwargs)
+    logger.info('Tracing to "%s".', trace_path)
+    return _tracer
+
+
+def stop() -> None:
+    global _tracer
+    tracer = _tracer
+    if tracer is None:
+        return
+    _tracer = None
+    tracer.close()
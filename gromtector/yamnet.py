@@ -0,0 +1,467 @@
+import csv
+import io
+import logging
+import os
+import time
+import zipfile
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from gromtector import tracing
+
+logger = logging.getLogger(__name__)
+
+
+MODEL_SAMPLE_RATE = 16000  # The model required audio sample rate.
+WINDOW_NUM_SAMPLES = int(0.975 * MODEL_SAMPLE_RATE)  # One 0.96s patch worth of audio.
+PATCH_HOP_SAMPLES = int(0.48 * MODEL_SAMPLE_RATE)  # The model's patch hop.
+NUM_CLASSES = 521
+EMBEDDING_SIZE = 1024
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_MODELS = {
+    "tflite": os.path.join(
+        _REPO_DIR, "model_yamnet_tflite", "lite-model_yamnet_classification_tflite_1.tflite"
+    ),
+    "savedmodel": os.path.join(_REPO_DIR, "model_yamnet_savedmodel"),
+}
+BUNDLED_CLASS_MAP = os.path.join(
+    _REPO_DIR, "model_yamnet_savedmodel", "assets", "yamnet_class_map.csv"
+)
+BENCHMARK_REPEATS = 5
+
+
+def prepare_waveform(pcm_int16: np.ndarray, num_samples: int = None) -> np.ndarray:
+    """
+    Converts int16 PCM into the model's float32 [-1, 1] waveform, scaled relative to
+    the int16 min/max, padded with silence or trimmed to `num_samples`.
+    """
+    int16_iinfo = np.iinfo(np.int16)
+    waveform = (pcm_int16.astype(np.float32) - int16_iinfo.min) * (
+        2.0 / (int16_iinfo.max - int16_iinfo.min)
+    ) - 1.0
+    if num_samples is not None:
+        if waveform.size < num_samples:
+            waveform = np.pad(waveform, (0, num_samples - waveform.size))
+        else:
+            waveform = waveform[:num_samples]
+    return waveform
+
+
+def class_names_from_csv(class_map_csv_text: str) -> Sequence[str]:
+    """Returns list of class names corresponding to score vector."""
+    class_map_csv = io.StringIO(class_map_csv_text)
+    class_names = [
+        display_name for (class_index, mid, display_name) in csv.reader(class_map_csv)
+    ]
+    class_names = class_names[1:]  # Skip CSV header
+    return class_names
+
+
+class YamnetModel:
+    """
+    An inference backend: a loaded YAMNet model. Backends register themselves by
+    `name` (see `register_backend`) and only import their runtime (Tensorflow) when
+    a model is loaded.
+    """
+
+    name: str = None
+    model_path: str = None
+    labels: Sequence[str] = None
+    has_embeddings: bool = False
+    supports_threads: bool = False
+    supports_patches: bool = False
+    provides_log_mel: bool = False
+    num_threads: int = None
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        """
+        Whether `model_path` looks like a model of this backend.
+        """
+        raise NotImplementedError()
+
+    @property
+    def capabilities(self) -> dict:
+        return {
+            "embeddings": self.has_embeddings,
+            "threads": self.supports_threads,
+            "patches": self.supports_patches,
+            "log_mel": self.provides_log_mel,
+        }
+
+    def warm_up(self) -> None:
+        """
+        Runs a silent window through the model so the first real inference doesn't
+        pay for graph tracing and allocations.
+        """
+        self.infer(np.zeros(WINDOW_NUM_SAMPLES, dtype=np.float32))
+
+    def infer(self, waveform: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Returns the (max over patches) scores and, if the model has them, the
+        (mean over patches) embeddings of a single float32 waveform.
+        """
+        raise NotImplementedError()
+
+    def infer_with_log_mel(
+        self, waveform: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        """
+        `infer` that also returns the `[frames, 64]` log-mel frames the model's
+        frontend computed from the waveform, for backends that `provides_log_mel`.
+        """
+        raise NotImplementedError()
+
+    def infer_patch(self, patch: np.ndarray) -> np.ndarray:
+        """
+        Scores one `[96, 64]` log-mel patch (see `gromtector.features`) straight
+        from a shared frontend, for backends that `supports_patches`.
+        """
+        raise NotImplementedError()
+
+    def infer_batch(
+        self, waveforms: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Scores a `[batch, samples]` array of waveforms. The exported YAMNet graphs
+        take a single 1-D waveform, so this only loops over the batch; backends
+        that can vectorise it override this.
+        """
+        results = [self.infer(waveform) for waveform in waveforms]
+        scores = np.stack([r[0] for r in results])
+        embeddings = None
+        if self.has_embeddings:
+            embeddings = np.stack([r[1] for r in results])
+        return scores, embeddings
+
+
+BACKENDS: Dict[str, Type[YamnetModel]] = {}
+
+
+def register_backend(cls: Type[YamnetModel]) -> Type[YamnetModel]:
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+@register_backend
+class YamnetLiteModel(YamnetModel):
+    """
+    Reference: https://tfhub.dev/google/lite-model/yamnet/classification/tflite/1
+    """
+
+    name: str = "tflite"
+    supports_threads: bool = True
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        return model_path.endswith("tflite")
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.interpreter = tf.lite.Interpreter(model_path, num_threads=num_threads)
+        labels_file = zipfile.ZipFile(model_path).open("yamnet_label_list.txt")
+        self.labels = [l.decode("utf-8").strip() for l in labels_file.readlines()]
+
+        self.waveform_input_index = self.interpreter.get_input_details()[0]["index"]
+        self.scores_output_index = self.interpreter.get_output_details()[0]["index"]
+        self.interpreter.allocate_tensors()
+
+    def infer(self, waveform: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        waveform = waveform[:WINDOW_NUM_SAMPLES]
+        if waveform.size < WINDOW_NUM_SAMPLES:
+            waveform = np.pad(waveform, (0, WINDOW_NUM_SAMPLES - waveform.size))
+        self.interpreter.set_tensor(self.waveform_input_index, waveform)
+        with tracing.span("tflite.invoke", "inference"):
+            self.interpreter.invoke()
+        scores = self.interpreter.get_tensor(self.scores_output_index)
+        return scores.max(axis=0), None
+
+
+@register_backend
+class YamnetSavedModel(YamnetModel):
+    name: str = "savedmodel"
+    has_embeddings: bool = True
+    provides_log_mel: bool = True
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        return os.path.isfile(os.path.join(model_path, "saved_model.pb"))
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        import tensorflow as tf
+
+        # Tensorflow's thread pools are process wide, so `num_threads` is ignored.
+        self.model_path = model_path
+        self.model = tf.saved_model.load(model_path)
+        class_map_path = self.model.class_map_path().numpy()
+        self.labels = class_names_from_csv(
+            tf.io.read_file(class_map_path).numpy().decode("utf-8")
+        )
+
+    def infer(self, waveform: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        scores, embeddings, _ = self.infer_with_log_mel(waveform)
+        return scores, embeddings
+
+    def infer_with_log_mel(
+        self, waveform: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        with tracing.span("savedmodel.call", "inference"):
+            scores, embeddings, log_mel = self.model(waveform)
+        return (
+            scores.numpy().max(axis=0),
+            embeddings.numpy().mean(axis=0),
+            log_mel.numpy(),
+        )
+
+
+@register_backend
+class YamnetStubModel(YamnetModel):
+    """
+    A deterministic NumPy stand-in for tests and for running the pipeline without
+    Tensorflow: scores are a fixed random projection of the mean log-mel frame.
+    Labels come from the class map CSV given as the model path, or the bundled one.
+    """
+
+    name: str = "stub"
+    supports_patches: bool = True
+    provides_log_mel: bool = True
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        return model_path == "stub" or model_path.endswith(".csv")
+
+    def __init__(self, model_path: str = "stub", num_threads: int = None):
+        from gromtector.features import NUM_MEL_BINS
+
+        self.model_path = model_path
+        class_map_path = model_path if model_path.endswith(".csv") else BUNDLED_CLASS_MAP
+        if os.path.exists(class_map_path):
+            with open(class_map_path) as f:
+                self.labels = class_names_from_csv(f.read())
+        else:
+            self.labels = ["Class {}".format(idx) for idx in range(NUM_CLASSES)]
+        rng = np.random.default_rng(0)
+        self.weights = rng.normal(
+            scale=0.05, size=(NUM_MEL_BINS, len(self.labels))
+        ).astype(np.float32)
+        self.biases = rng.normal(loc=-3.0, size=len(self.labels)).astype(np.float32)
+
+    def infer(self, waveform: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        scores, embeddings, _ = self.infer_with_log_mel(waveform)
+        return scores, embeddings
+
+    def infer_with_log_mel(
+        self, waveform: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        from gromtector.features import log_mel_frames
+
+        frames = log_mel_frames(np.asarray(waveform, dtype=np.float32))
+        return self.infer_patch(frames), None, frames
+
+    def infer_patch(self, patch: np.ndarray) -> np.ndarray:
+        features = patch.mean(axis=0) if patch.size else np.zeros(
+            self.weights.shape[0], dtype=np.float32
+        )
+        # Roughly zero mean over quiet to loud audio.
+        logits = (features + 5.0) @ self.weights + self.biases
+        return (1.0 / (1.0 + np.exp(-logits))).astype(np.float32)
+
+
+@register_backend
+class DspBarkModel(YamnetModel):
+    """
+    A classical bark detector for devices where loading Tensorflow is too much:
+    onset strength, bark band energy ratio, spectral flux and harmonicity of the
+    window (see `gromtector.bark_dsp`) give one bark score, reported on the
+    `bark_classes` of the bundled class map so the detection rules work as with
+    YAMNet. The model path is "dsp", or a directory of bark template WAVs (one
+    per dog) to only detect those dogs.
+    """
+
+    name: str = "dsp"
+    bark_classes: Sequence[str] = [
+        "Dog",
+        "Canidae, dogs, wolves",
+        "Domestic animals, pets",
+        "Animal",
+        "Bark",
+    ]
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        return model_path == "dsp" or (
+            os.path.isdir(model_path)
+            and not os.path.exists(os.path.join(model_path, "saved_model.pb"))
+            and any(f.endswith(".wav") for f in os.listdir(model_path))
+        )
+
+    def __init__(self, model_path: str = "dsp", num_threads: int = None):
+        from gromtector.bark_dsp import BarkTemplates
+
+        self.model_path = model_path
+        with open(BUNDLED_CLASS_MAP) as f:
+            self.labels = class_names_from_csv(f.read())
+        self.templates = None
+        if model_path != "dsp":
+            self.templates = BarkTemplates.load(model_path)
+
+    def infer(self, waveform: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        scores, _ = self.infer_batch(np.asarray(waveform)[np.newaxis])
+        return scores[0], None
+
+    def infer_batch(
+        self, waveforms: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        from gromtector.bark_dsp import bark_scores, score_vectors
+
+        with tracing.span("dsp.infer", "inference", {"windows": len(waveforms)}):
+            scores = bark_scores(waveforms, self.templates)
+        return score_vectors(scores, self.labels, self.bark_classes), None
+
+
+def backend_for_path(model_path: str) -> Type[YamnetModel]:
+    for backend in BACKENDS.values():
+        if backend.can_load(model_path):
+            return backend
+    raise RuntimeError('No inference backend can load "{}".'.format(model_path))
+
+
+def load_yamnet(
+    model_path: str, backend: str = None, num_threads: int = None
+) -> YamnetModel:
+    """
+    Loads `model_path` with the named `backend`, or the one matching the path.
+    """
+    backend_cls = BACKENDS[backend] if backend else backend_for_path(model_path)
+    logger.debug('Tensorflow model: "{}" ({})'.format(model_path, backend_cls.name))
+    logger.debug("Loading model...")
+    model = backend_cls(model_path, num_threads=num_threads)
+    logger.debug("Loading model... DONE")
+    return model
+
+
+def benchmark_backend(model: YamnetModel, repeats: int = BENCHMARK_REPEATS) -> float:
+    """
+    Median seconds per window of `model`, after a warm up.
+    """
+    model.warm_up()
+    waveform = prepare_waveform(
+        np.random.default_rng(0).integers(
+            -3000, 3000, WINDOW_NUM_SAMPLES, dtype=np.int16
+        )
+    )[np.newaxis]
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.infer_batch(waveform)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+# "auto" benchmarks thread counts of the given model, "auto-any" may also swap it
+# for a faster bundled model.
+AUTO_BACKENDS = ("auto", "auto-any")
+
+
+def auto_select_candidates(
+    model_path: str = None, substitute: bool = False
+) -> List[Tuple[str, str, int]]:
+    """
+    `(backend, model path, threads)` configurations to benchmark: the given model
+    with a few thread counts if its backend takes them and, with `substitute` (or
+    without a model), the bundled models too.
+    """
+    paths = {}
+    if substitute or not model_path:
+        paths.update(
+            (name, path)
+            for name, path in BUNDLED_MODELS.items()
+            if os.path.exists(path)
+        )
+    if model_path:
+        name = backend_for_path(model_path).name
+        if name not in BUNDLED_MODELS:
+            # The stand-in and DSP backends are picked on purpose, not for speed.
+            return [(name, model_path, None)]
+        paths[name] = model_path
+    cpu_count = os.cpu_count() or 1
+    thread_counts = sorted({1, min(2, cpu_count), min(4, cpu_count), cpu_count})
+
+    candidates = []
+    for name, path in paths.items():
+        if BACKENDS[name].supports_threads:
+            candidates += [(name, path, threads) for threads in thread_counts]
+        else:
+            candidates.append((name, path, None))
+    return candidates
+
+
+def resolve_backend(
+    backend: str = None, model_path: str = None
+) -> Tuple[str, str, Optional[int]]:
+    """
+    The concrete `(backend, model path, threads)` that `select_backend` would
+    load, to hand over to another process. Auto selection is benchmarked here,
+    once, so the other process only has to load its result.
+    """
+    if backend not in AUTO_BACKENDS:
+        model_path = model_path or BUNDLED_MODELS.get(backend, "stub")
+        return backend or backend_for_path(model_path).name, model_path, None
+    model = select_backend(backend, model_path)
+    return model.name, model.model_path, model.num_threads
+
+
+def select_backend(
+    backend: str = None, model_path: str = None, num_threads: int = None
+) -> YamnetModel:
+    """
+    Loads and warms up the named backend (the one matching `model_path` if
+    `None`). With "auto" or "auto-any" (see `AUTO_BACKENDS`) it benchmarks every
+    candidate configuration instead and keeps the fastest one loaded.
+    """
+    if backend not in AUTO_BACKENDS:
+        model = load_yamnet(
+            model_path or BUNDLED_MODELS.get(backend, "stub"),
+            backend,
+            num_threads=num_threads,
+        )
+        model.warm_up()
+        return model
+
+    best_model = None
+    best_time_s = None
+    candidates = auto_select_candidates(model_path, substitute=backend == "auto-any")
+    for name, path, threads in candidates:
+        try:
+            model = load_yamnet(path, name, num_threads=threads)
+            time_s = benchmark_backend(model)
+        except Exception as e:
+            logger.warning(
+                'Skipping the %s backend for "%s", it failed to load or run: %s',
+                name,
+                path,
+                e,
+            )
+            continue
+        logger.info(
+            "Backend %s, %s threads: %.1fms per window.",
+            name,
+            threads or "default",
+            time_s * 1000,
+        )
+        if best_time_s is None or time_s < best_time_s:
+            best_model, best_time_s = model, time_s
+    if best_model is None:
+        raise RuntimeError("None of the inference backends could be loaded.")
+    logger.info(
+        'Selected the %s backend with %s threads for "%s".',
+        best_model.name,
+        best_model.num_threads or "default",
+        best_model.model_path,
+    )
+    return best_model
@@ -0,0 +1,212 @@
+"""
+The capture watchdog of `AudioMicSystem`, driven on a fake mic and a fake clock so
+losses, reopen backoffs and downtimes are exact.
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pygame")
+pytest.importorskip("pyaudio")
+
+from gromtector.app.BaseApplication import BaseApplication
+from gromtector.app.EventManager import EventManager
+from gromtector.app.systems import mic as mic_module
+from gromtector.app.systems.mic import AudioMicSystem
+
+SAMPLE_RATE = 16000
+STEP_S = 0.25  # Exact in binary, so downtimes add up exactly.
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class FakeMicControl:
+    """
+    Faults shared by every `FakeMic` of a system, so they survive reopening.
+    """
+
+    def __init__(self):
+        self.stalled = False  # Delivers no audio.
+        self.inactive = False  # The stream reports itself inactive.
+        self.failing_opens = 0  # The next opens fail.
+        self.num_opens = 0
+        self.num_failed_opens = 0
+
+
+class FakeMic:
+    """
+    Stands in for `CallbackAudioMic`: every drain returns a 10ms chunk unless the
+    control stalls it.
+    """
+
+    frames_per_buffer = 160
+    latency_s = frames_per_buffer / SAMPLE_RATE
+    sample_rate = SAMPLE_RATE
+    dropped_frames = 0
+    overruns = 0
+    input_overflows = 0
+
+    def __init__(self, control: FakeMicControl):
+        self.control = control
+        self.opened = False
+        self.num_samples = 0
+        self.stream_begin_timestamp = datetime.now(tz=timezone.utc)
+
+    def open(self) -> None:
+        self.control.num_opens += 1
+        if self.control.failing_opens > 0:
+            self.control.failing_opens -= 1
+            self.control.num_failed_opens += 1
+            raise OSError("Fake device unavailable.")
+        self.opened = True
+
+    def drain(self, timeout: float = None):
+        begin_timestamp = self.stream_begin_timestamp + timedelta(
+            seconds=self.num_samples / SAMPLE_RATE
+        )
+        if self.control.stalled:
+            return np.zeros(0, dtype=np.int16), begin_timestamp
+        self.num_samples += self.frames_per_buffer
+        return np.ones(self.frames_per_buffer, dtype=np.int16), begin_timestamp
+
+    def is_active(self) -> bool:
+        return self.opened and not self.control.inactive
+
+    def close(self) -> None:
+        self.opened = False
+
+    def abandon(self) -> None:
+        self.opened = False
+
+
+class FakeMicSystem(AudioMicSystem):
+    control: FakeMicControl = None
+
+    def find_device(self, device: str) -> dict:
+        return {"index": 0, "name": "fake mic"}
+
+    def create_mic(self, device_info: dict) -> FakeMic:
+        return FakeMic(self.control)
+
+
+class FakeApp(BaseApplication):
+    def __init__(self):
+        self.event_manager = EventManager()
+
+    def get_event_manager(self) -> EventManager:
+        return self.event_manager
+
+
+class Harness:
+    def __init__(self, monkeypatch):
+        self.clock = FakeClock()
+        monkeypatch.setattr(
+            mic_module,
+            "time",
+            SimpleNamespace(
+                monotonic=self.clock.monotonic, process_time=self.clock.monotonic
+            ),
+        )
+        self.app = FakeApp()
+        self.events = []
+        evt_mgr = self.app.get_event_manager()
+        for event_type in ("capture_lost", "capture_restored", "new_audio_data"):
+            evt_mgr.add_listener(
+                event_type, lambda t, e: self.events.append((t, e))
+            )
+
+        self.control = FakeMicControl()
+        self.system = FakeMicSystem(self.app, config={"--input-device": None})
+        self.system.control = self.control
+        self.system.init()
+
+    def step(self) -> None:
+        self.clock.now += STEP_S
+        self.system.update(int(STEP_S * 1000))
+        self.app.get_event_manager().dispatch_queued_events()
+
+    def run_until(self, event_type: str, max_steps: int = 1000) -> dict:
+        for _ in range(max_steps):
+            self.step()
+            for seen_type, event in self.events:
+                if seen_type == event_type:
+                    self.events.clear()
+                    return event
+        pytest.fail("No {} within {} steps.".format(event_type, max_steps))
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    harness = Harness(monkeypatch)
+    yield harness
+    harness.system.shutdown()
+
+
+def test_stall_is_lost_and_reopened_with_backoff(harness):
+    system = harness.system
+    system.capture_stall_s = 2.0
+    system.retry_min_backoff_s = 1.0
+    harness.run_until("new_audio_data")
+
+    harness.control.stalled = True
+    last_data_time = harness.clock.now
+    lost = harness.run_until("capture_lost")
+    lost_time = harness.clock.now
+    assert lost["source"] == "mic0"
+    assert lost["reason"].startswith("no audio")
+    assert lost_time - last_data_time == system.capture_stall_s + STEP_S
+
+    # The device comes back but refuses the first two reopens: retried right
+    # away, then after 1s and after 2s more.
+    harness.control.stalled = False
+    harness.control.failing_opens = 2
+    restored = harness.run_until("capture_restored")
+    assert harness.control.num_failed_opens == 2
+    assert restored["source"] == "mic0"
+    assert restored["lost_timestamp"] == lost["timestamp"]
+    assert restored["down_s"] == 3.0 + STEP_S
+
+    source = system.sources[0]
+    assert source.num_losses == 1
+    assert source.total_down_s == restored["down_s"]
+    harness.run_until("new_audio_data")
+
+
+def test_inactive_stream_is_reopened(harness):
+    harness.run_until("new_audio_data")
+
+    harness.control.inactive = True
+    lost = harness.run_until("capture_lost")
+    assert lost["reason"] == "stream inactive"
+
+    harness.control.inactive = False
+    restored = harness.run_until("capture_restored")
+    assert restored["down_s"] == STEP_S
+    assert harness.control.num_failed_opens == 0
+    harness.run_until("new_audio_data")
+
+
+def test_downtime_adds_up_over_losses(harness):
+    system = harness.system
+    system.capture_stall_s = 1.0
+    harness.run_until("new_audio_data")
+
+    down_s = []
+    for _ in range(3):
+        harness.control.stalled = True
+        harness.run_until("capture_lost")
+        harness.control.stalled = False
+        down_s.append(harness.run_until("capture_restored")["down_s"])
+        harness.run_until("new_audio_data")
+
+    source = system.sources[0]
+    assert source.num_losses == 3
+    assert source.total_down_s == sum(down_s)